@@ -49,6 +49,16 @@ export interface MistakeItem {
   language: string;
 }
 
+export interface WeakItem {
+  question_text: string;
+  correct_answer: string;
+  language: string;
+  miss_count: number;
+  attempt_count: number;
+  miss_rate: number;
+  last_seen: string;
+}
+
 export class AuthService {
   static getToken(): string | null {
     if (typeof window !== 'undefined') {
@@ -191,6 +201,26 @@ export async function submitQuizAttempt(attempt: QuizAttempt): Promise<{ message
   return await res.json();
 }
 
+export async function submitQuizAttempts(
+  attempts: QuizAttempt[]
+): Promise<{ message: string; recorded: number; correct: number }> {
+  const res = await fetch(`${API_BASE_URL}/submit-quiz-attempts`, {
+    method: 'POST',
+    headers: getAuthHeaders(),
+    body: JSON.stringify({ attempts }),
+  });
+
+  if (!res.ok) {
+    if (res.status === 401) {
+      AuthService.removeToken();
+      throw new Error('Session expired. Please log in again.');
+    }
+    throw new Error(await res.text());
+  }
+
+  return await res.json();
+}
+
 export async function getUserProgress(): Promise<UserProgress[]> {
   const res = await fetch(`${API_BASE_URL}/user-progress`, {
     method: 'GET',
@@ -227,4 +257,25 @@ export async function getUserMistakes(language?: string): Promise<MistakeItem[]>
   }
 
   return await res.json();
-}
\ No newline at end of file
+}
+
+export async function getWeakItems(language?: string): Promise<WeakItem[]> {
+  const url = language
+    ? `${API_BASE_URL}/weak-items?language=${encodeURIComponent(language)}`
+    : `${API_BASE_URL}/weak-items`;
+
+  const res = await fetch(url, {
+    method: 'GET',
+    headers: getAuthHeaders(),
+  });
+
+  if (!res.ok) {
+    if (res.status === 401) {
+      AuthService.removeToken();
+      throw new Error('Session expired. Please log in again.');
+    }
+    throw new Error(await res.text());
+  }
+
+  return await res.json();
+}
@@ -0,0 +1,347 @@
+# attempt_archive.py - Move old quiz attempts out of question_attempts into per-user monthly NDJSON files
+import io
+import os
+import re
+import gzip
+import json
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, IO, Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import SessionLocal, QuestionAttempt
+
+logger = logging.getLogger(__name__)
+
+ATTEMPT_ARCHIVE_ENABLED = os.getenv("ATTEMPT_ARCHIVE_ENABLED", "false").lower() == "true"
+# A local directory, or s3://bucket/prefix (needs boto3)
+ATTEMPT_ARCHIVE_URL = os.getenv("ATTEMPT_ARCHIVE_URL", "./attempt-archive")
+ATTEMPT_ARCHIVE_AFTER_DAYS = int(os.getenv("ATTEMPT_ARCHIVE_AFTER_DAYS", "180"))  # archive attempts older than this
+ATTEMPT_ARCHIVE_BATCH = int(os.getenv("ATTEMPT_ARCHIVE_BATCH", "10000"))  # attempts per transaction
+ATTEMPT_ARCHIVE_INTERVAL = float(os.getenv("ATTEMPT_ARCHIVE_INTERVAL", "21600"))  # seconds between runs
+ATTEMPT_ARCHIVE_COMPRESSION = os.getenv("ATTEMPT_ARCHIVE_COMPRESSION", "zstd").lower()  # zstd | gzip
+
+_FIELDS = ["id", "session_id", "user_id", "language", "question_text", "user_answer", "correct_answer",
+           "is_correct", "attempt_time"]
+# question_attempts/user=42/month=2026-01/attempts-<first id>-<last id>.ndjson.zst
+_FILE_NAME = re.compile(r"user=(?P<user>[^/]+)/month=(?P<month>\d{4}-\d{2})/"
+                        r"attempts-(?P<first>\d+)-(?P<last>\d+)\.ndjson\.(zst|gz)$")
+
+FileGroups = Dict[Tuple[str, str], List[Tuple[int, int, str]]]  # (month, user) -> (first id, last id, key)
+
+
+# ─── Storage ───────────────────────────────────────────
+class LocalArchiveStore:
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def put(self, key: str, data: bytes):
+        """Write a whole file atomically: readers never see a partial one"""
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def list(self, prefix: str) -> List[str]:
+        base = os.path.join(self.root, prefix)
+        keys = []
+        for directory, _, files in os.walk(base):
+            for name in files:
+                if not name.endswith(".tmp"):
+                    keys.append(os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, "/"))
+        return sorted(keys)
+
+    def open(self, key: str) -> IO[bytes]:
+        return open(os.path.join(self.root, key), "rb")
+
+
+class S3ArchiveStore:
+    name = "s3"
+
+    def __init__(self, url: str):
+        import boto3  # optional dependency, only needed for object storage
+
+        bucket, _, prefix = url[len("s3://"):].partition("/")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self._s3 = boto3.client("s3")
+
+    def put(self, key: str, data: bytes):
+        self._s3.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def list(self, prefix: str) -> List[str]:
+        keys = []
+        for page in self._s3.get_paginator("list_objects_v2").paginate(Bucket=self.bucket,
+                                                                       Prefix=self.prefix + prefix):
+            keys.extend(item["Key"][len(self.prefix):] for item in page.get("Contents", []))
+        return sorted(keys)
+
+    def open(self, key: str) -> IO[bytes]:
+        return self._s3.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"]  # streamed, not buffered
+
+
+def archive_store(url: str = ATTEMPT_ARCHIVE_URL):
+    return S3ArchiveStore(url) if url.startswith("s3://") else LocalArchiveStore(url)
+
+
+def _zstd():
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+
+# ─── Records ───────────────────────────────────────────
+def _encode(row: Dict[str, Any]) -> str:
+    return json.dumps({**row, "attempt_time": row["attempt_time"].isoformat()}, separators=(",", ":")) + "\n"
+
+
+def _decode(line: str) -> Dict[str, Any]:
+    record = json.loads(line)
+    record["attempt_time"] = datetime.fromisoformat(record["attempt_time"])
+    return record
+
+
+def _user_prefix(user_id: Optional[int]) -> str:
+    # Attempts whose session had no owner (before user_id was backfilled) share one directory
+    return f"question_attempts/user={user_id if user_id is not None else 'none'}/"
+
+
+class AttemptArchive:
+    """Cold storage for question_attempts: attempts older than ATTEMPT_ARCHIVE_AFTER_DAYS
+    are written to one compressed NDJSON file per user, month and batch, then deleted from the
+    table. Files sit under a per-user prefix, so paging through one user's history lists and
+    reads that user's files only, however large the archive grows.
+
+    Files are written before the rows are deleted, so a crash in between archives those rows
+    again on the next run; file names carry their id range and the reader drops the
+    duplicates of overlapping files. UserProgress and mistake_aggregates are rollups kept by
+    write_attempts and don't change when attempts move here.
+    """
+
+    def __init__(self, store=None, session_factory=SessionLocal, enabled: bool = ATTEMPT_ARCHIVE_ENABLED,
+                 after_days: int = ATTEMPT_ARCHIVE_AFTER_DAYS, batch_size: int = ATTEMPT_ARCHIVE_BATCH,
+                 interval: float = ATTEMPT_ARCHIVE_INTERVAL, compression: str = ATTEMPT_ARCHIVE_COMPRESSION):
+        self._store = store
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self.interval = interval
+        self._compression = compression
+        self._task: Optional[asyncio.Task] = None
+        self.archived = 0
+        self.files_written = 0
+        self.bytes_written = 0
+        self.runs = 0
+        self.last_run_seconds = 0.0
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = archive_store()
+        return self._store
+
+    @property
+    def compression(self) -> str:
+        # Probed on first use, so zstandard isn't imported at startup
+        if self._compression != "gzip" and _zstd() is None:
+            self._compression = "gzip"
+        return self._compression
+
+    # ─── Files ─────────────────────────────────────────
+    def _compress(self, text: str) -> Tuple[bytes, str]:
+        data = text.encode("utf-8")
+        if self.compression == "zstd":
+            return _zstd().ZstdCompressor(level=10).compress(data), "zst"
+        return gzip.compress(data, compresslevel=6), "gz"
+
+    def _lines(self, key: str) -> Iterator[str]:
+        raw = self.store.open(key)
+        try:
+            if key.endswith(".zst"):
+                stream = _zstd().ZstdDecompressor().stream_reader(raw)
+            else:
+                stream = gzip.GzipFile(fileobj=raw)
+            yield from io.TextIOWrapper(stream, encoding="utf-8")
+        finally:
+            raw.close()
+
+    def _write_file(self, user_id: Optional[int], month: str, rows: List[Dict[str, Any]]):
+        data, suffix = self._compress("".join(_encode(row) for row in rows))
+        ids = [row["id"] for row in rows]
+        key = f"{_user_prefix(user_id)}month={month}/attempts-{min(ids):012d}-{max(ids):012d}.ndjson.{suffix}"
+        self.store.put(key, data)
+        self.files_written += 1
+        self.bytes_written += len(data)
+
+    # ─── Archiving ─────────────────────────────────────
+    def archive_batch(self, now: Optional[datetime] = None) -> int:
+        """Archive up to batch_size of the oldest attempts past the horizon; returns how many"""
+        cutoff = (now or datetime.utcnow()) - timedelta(days=self.after_days)
+        db = self.session_factory()
+        try:
+            rows = db.execute(
+                select(*[getattr(QuestionAttempt, field) for field in _FIELDS])
+                .where(QuestionAttempt.attempt_time < cutoff)
+                .order_by(QuestionAttempt.attempt_time, QuestionAttempt.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)  # replicas archiving at once take different rows
+            ).mappings().all()
+            if not rows:
+                return 0
+            files: Dict[Tuple[Optional[int], str], List[Dict[str, Any]]] = {}
+            for row in rows:
+                files.setdefault((row["user_id"], row["attempt_time"].strftime("%Y-%m")), []).append(dict(row))
+            for (user_id, month), file_rows in files.items():
+                self._write_file(user_id, month, file_rows)
+            db.execute(delete(QuestionAttempt).where(QuestionAttempt.id.in_([row["id"] for row in rows])))
+            db.commit()
+            self.archived += len(rows)
+            return len(rows)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def run(self, now: Optional[datetime] = None) -> int:
+        """Archive everything past the horizon, one batch per transaction"""
+        start = time.perf_counter()
+        total = 0
+        while True:
+            archived = self.archive_batch(now)
+            total += archived
+            if archived < self.batch_size:
+                break
+        self.runs += 1
+        self.last_run_seconds = time.perf_counter() - start
+        if total:
+            logger.info(f"🗄️ Archived {total} quiz attempts in {self.last_run_seconds:.1f}s")
+        return total
+
+    async def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._archiver())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _archiver(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.run)
+            except (SQLAlchemyError, OSError) as e:
+                logger.warning(f"⚠️ Quiz attempt archival failed, will retry: {e}")
+            except Exception:
+                logger.exception("💥 Quiz attempt archiver failed")
+            await asyncio.sleep(self.interval)
+
+    # ─── Reading ───────────────────────────────────────
+    def _files(self, user_id: Optional[int] = None) -> FileGroups:
+        """Archive files of one user, or of everyone, by month and user (one listing)"""
+        groups: FileGroups = {}
+        for key in self.store.list(_user_prefix(user_id) if user_id is not None else "question_attempts/"):
+            match = _FILE_NAME.search(key)
+            if match:
+                groups.setdefault((match["month"], match["user"]), []).append(
+                    (int(match["first"]), int(match["last"]), key))
+        return groups
+
+    def months(self, user_id: Optional[int] = None) -> List[str]:
+        return sorted({month for month, _ in self._files(user_id)})
+
+    def _file_records(self, files: List[Tuple[int, int, str]]) -> Iterator[Dict[str, Any]]:
+        """Attempts of one user's month, read file by file"""
+        files = sorted(files)
+        # Only files whose id ranges overlap (a batch archived again after a crash) can share attempts
+        overlapping: Set[str] = set()
+        for i, (first, last, key) in enumerate(files):
+            for other_first, _, other in files[i + 1:]:
+                if other_first > last:
+                    break
+                overlapping.update((key, other))
+        seen: Set[int] = set()
+        for _, _, key in files:
+            for line in self._lines(key):
+                record = _decode(line)
+                if key in overlapping:
+                    if record["id"] in seen:
+                        continue
+                    seen.add(record["id"])
+                yield record
+
+    def iter_attempts(self, user_id: Optional[int] = None, language: Optional[str] = None,
+                      since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      mistakes_only: bool = False, newest_month_first: bool = False) -> Iterator[Dict[str, Any]]:
+        """Stream archived attempts month by month, decompressing one file at a time"""
+        groups = sorted(self._files(user_id).items(), reverse=newest_month_first)
+        if since is not None:
+            groups = [group for group in groups if group[0][0] >= since.strftime("%Y-%m")]
+        if until is not None:
+            groups = [group for group in groups if group[0][0] <= until.strftime("%Y-%m")]
+        for _, files in groups:
+            for record in self._file_records(files):
+                if language is not None and record["language"] != language:
+                    continue
+                if mistakes_only and record["is_correct"]:
+                    continue
+                if since is not None and record["attempt_time"] < since:
+                    continue
+                if until is not None and record["attempt_time"] >= until:
+                    continue
+                yield record
+
+    def mistakes_before(self, user_id: int, language: Optional[str], before: Optional[Tuple[datetime, int]],
+                        limit: int) -> List[Dict[str, Any]]:
+        """A user's archived mistakes older than the (attempt_time, id) position, newest first.
+
+        Reads only this user's files, newest month first, and stops once it has limit.
+        """
+        found: List[Dict[str, Any]] = []
+        groups = self._files(user_id)
+        if before is not None:
+            groups = {group: files for group, files in groups.items() if group[0] <= before[0].strftime("%Y-%m")}
+        for _, files in sorted(groups.items(), reverse=True):
+            in_month = [
+                record for record in self._file_records(files)
+                if not record["is_correct"]
+                and (language is None or record["language"] == language)
+                and (before is None or (record["attempt_time"], record["id"]) < before)
+            ]
+            in_month.sort(key=lambda record: (record["attempt_time"], record["id"]), reverse=True)
+            found.extend(in_month)
+            if len(found) >= limit:
+                break
+        return found[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "store": self._store.name if self._store is not None else None,
+            "compression": self.compression,
+            "after_days": self.after_days,
+            "archived": self.archived,
+            "files_written": self.files_written,
+            "bytes_written": self.bytes_written,
+            "runs": self.runs,
+            "last_run_seconds": round(self.last_run_seconds, 3),
+        }
+
+
+attempt_archive = AttemptArchive()
@@ -0,0 +1,388 @@
+# attempt_buffer.py - Quiz attempt writes: shared bulk writer plus an optional write-behind journal
+import io
+import os
+import csv
+import glob
+import json
+import time
+import uuid
+import fcntl
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import DataError, IntegrityError, SQLAlchemyError
+
+from database import SessionLocal, QuestionAttempt, UserProgress
+from metrics import Histogram, DEFAULT_BUCKETS_COUNT
+from upsert import increment_upsert
+from mistake_aggregates import update_mistake_aggregates
+
+logger = logging.getLogger(__name__)
+
+QUIZ_WRITE_BEHIND = os.getenv("QUIZ_WRITE_BEHIND", "false").lower() == "true"
+QUIZ_BUFFER_DIR = os.getenv("QUIZ_BUFFER_DIR", "./quiz-buffer")
+QUIZ_BUFFER_MAX_PENDING = int(os.getenv("QUIZ_BUFFER_MAX_PENDING", "50000"))  # attempts held before falling back
+QUIZ_BUFFER_FSYNC = os.getenv("QUIZ_BUFFER_FSYNC", "true").lower() == "true"
+QUIZ_FLUSH_INTERVAL = float(os.getenv("QUIZ_FLUSH_INTERVAL", "2"))  # seconds
+QUIZ_FLUSH_SIZE = int(os.getenv("QUIZ_FLUSH_SIZE", "1000"))  # flush early once this many are waiting
+QUIZ_FLUSH_CHUNK = int(os.getenv("QUIZ_FLUSH_CHUNK", "500"))  # attempts per transaction within a flush
+QUIZ_COPY_MIN_ROWS = int(os.getenv("QUIZ_COPY_MIN_ROWS", "100"))  # use COPY (psycopg2) for batches this large
+# Flushes the database rejected (constraint or data errors) before the bad attempts are set aside
+QUIZ_DEAD_LETTER_AFTER = int(os.getenv("QUIZ_DEAD_LETTER_AFTER", "3"))
+
+# The batch itself is bad: retrying it unchanged fails the same way
+_REJECTED = (IntegrityError, DataError)
+
+_ATTEMPT_COLUMNS = ["session_id", "user_id", "language", "question_text", "user_answer", "correct_answer",
+                    "is_correct", "attempt_time"]
+
+
+def attempt_record(user_id: int, language: str, session_id: int, question_text: str, user_answer: str,
+                   correct_answer: str, is_correct: bool, attempt_time: datetime) -> Dict[str, Any]:
+    """One answered question, with what the progress rollup needs (user, language) denormalized in"""
+    return {"user_id": user_id, "language": language, "session_id": session_id, "question_text": question_text,
+            "user_answer": user_answer, "correct_answer": correct_answer, "is_correct": is_correct,
+            "attempt_time": attempt_time}
+
+
+def _copy_attempts(db: Session, rows: List[Dict[str, Any]]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in _ATTEMPT_COLUMNS])
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY question_attempts ({', '.join(_ATTEMPT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                           buffer)
+    finally:
+        cursor.close()
+
+
+def write_attempts(db: Session, records: List[Dict[str, Any]]):
+    """Insert attempts and add them to UserProgress in the caller's transaction (the caller commits).
+
+    Large batches on psycopg2 go in through COPY, everything else through one executemany INSERT.
+    Progress is a single upsert with one row per (user, language), mistake aggregates another.
+    Both only move their timestamps forward, so replayed or late batches still add up correctly.
+    """
+    rows = [{column: record[column] for column in _ATTEMPT_COLUMNS} for record in records]
+    dialect = db.get_bind().dialect
+    if dialect.name == "postgresql" and dialect.driver == "psycopg2" and len(rows) >= QUIZ_COPY_MIN_ROWS:
+        _copy_attempts(db, rows)
+    else:
+        db.execute(insert(QuestionAttempt), rows)
+
+    # (user_id, language) -> [questions, correct answers, last attempt]
+    totals: Dict[Tuple[int, str], List[Any]] = {}
+    for record in records:
+        counts = totals.setdefault((record["user_id"], record["language"]), [0, 0, record["attempt_time"]])
+        counts[0] += 1
+        counts[1] += record["is_correct"]
+        counts[2] = max(counts[2], record["attempt_time"])
+    db.execute(increment_upsert(
+        dialect.name, UserProgress,
+        [{"user_id": user_id, "language": language, "total_questions": questions, "correct_answers": correct,
+          "last_studied": last}
+         for (user_id, language), (questions, correct, last) in totals.items()],
+        conflict_columns=["user_id", "language"],
+        increments=["total_questions", "correct_answers"],
+        newest="last_studied"
+    ))
+    update_mistake_aggregates(db, records)
+
+
+class AttemptBufferFull(Exception):
+    pass
+
+
+class _Segment:
+    """A journal file and the attempts in it; the file stays flock-ed until its attempts are in the database"""
+
+    def __init__(self, path: str, handle, records: List[Dict[str, Any]]):
+        self.path = path
+        self.handle = handle
+        self.records = records
+
+    def remove(self):
+        os.unlink(self.path)
+        self.handle.close()  # releases the lock
+
+
+def _encode(record: Dict[str, Any]) -> str:
+    return json.dumps({**record, "attempt_time": record["attempt_time"].isoformat()}, separators=(",", ":")) + "\n"
+
+
+def _decode(line: str) -> Optional[Dict[str, Any]]:
+    try:
+        record = json.loads(line)
+        record["attempt_time"] = datetime.fromisoformat(record["attempt_time"])
+        return record
+    except (ValueError, KeyError, TypeError):
+        return None  # torn last line of a crashed writer
+
+
+class AttemptBuffer:
+    """Write-behind for quiz attempts: acknowledged once appended (and fsync-ed) to a local journal.
+
+    A background task flushes everything buffered every QUIZ_FLUSH_INTERVAL seconds, or as soon
+    as QUIZ_FLUSH_SIZE attempts are waiting, with write_attempts in chunks of QUIZ_FLUSH_CHUNK
+    attempts, one transaction each, so a backlog never becomes one oversized statement. A flush
+    first seals the active journal file, so appends carry on into a new one meanwhile; sealed
+    files are deleted once all their attempts are committed. Journals left by a crashed process
+    are replayed at startup, so delivery is at-least-once: a crash between a commit and the file
+    deletion inserts those attempts twice. At most QUIZ_BUFFER_MAX_PENDING attempts are held;
+    beyond that add() raises AttemptBufferFull and callers write directly.
+
+    A chunk the database keeps rejecting (say an attempt for a session deleted meanwhile) stays
+    buffered while the other chunks go in. After QUIZ_DEAD_LETTER_AFTER flushes with a rejected
+    chunk its attempts are written one at a time, and those still rejected go to a
+    dead-letter-*.jsonl file in the buffer directory, never replayed, for someone to look at.
+    Connection errors never dead-letter anything; the attempts wait for the database to come back.
+    """
+
+    def __init__(self, directory: str = QUIZ_BUFFER_DIR, session_factory=SessionLocal,
+                 enabled: bool = QUIZ_WRITE_BEHIND, flush_interval: float = QUIZ_FLUSH_INTERVAL,
+                 flush_size: int = QUIZ_FLUSH_SIZE, max_pending: int = QUIZ_BUFFER_MAX_PENDING,
+                 fsync: bool = QUIZ_BUFFER_FSYNC, dead_letter_after: int = QUIZ_DEAD_LETTER_AFTER,
+                 chunk_size: int = QUIZ_FLUSH_CHUNK):
+        self.directory = directory
+        self.session_factory = session_factory
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self.dead_letter_after = dead_letter_after
+        self.chunk_size = chunk_size
+        self._rejected_flushes = 0  # consecutive
+        self._active: Optional[_Segment] = None
+        self._sealed: List[_Segment] = []
+        self._lock = threading.Lock()  # journal appends and sealing
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self.appended = 0
+        self.rejected = 0
+        self.recovered = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.dead_lettered = 0
+        self.flush_time = Histogram()
+        self.flush_rows = Histogram(buckets=DEFAULT_BUCKETS_COUNT, unit="")
+
+    @property
+    def depth(self) -> int:
+        active = len(self._active.records) if self._active is not None else 0
+        return active + sum(len(segment.records) for segment in self._sealed)
+
+    # ─── Journal ───────────────────────────────────────
+    def _open_segment(self) -> _Segment:
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"attempts-{uuid.uuid4().hex}.journal")
+        handle = open(path, "a", encoding="utf-8")
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return _Segment(path, handle, [])
+
+    def append(self, records: List[Dict[str, Any]]) -> int:
+        """Durably buffer records; returns the number of attempts now waiting to be flushed"""
+        with self._lock:
+            if self.depth + len(records) > self.max_pending:
+                self.rejected += len(records)
+                raise AttemptBufferFull(f"{self.depth} quiz attempts already waiting to be flushed")
+            if self._active is None:
+                self._active = self._open_segment()
+            handle = self._active.handle
+            handle.write("".join(_encode(record) for record in records))
+            handle.flush()
+            if self.fsync:
+                os.fsync(handle.fileno())
+            self._active.records.extend(records)
+            self.appended += len(records)
+            return self.depth
+
+    def recover(self) -> int:
+        """Adopt journals of processes that are gone (their files are no longer locked)"""
+        os.makedirs(self.directory, exist_ok=True)
+        adopted = 0
+        for path in sorted(glob.glob(os.path.join(self.directory, "attempts-*.journal"))):
+            handle = open(path, "r+", encoding="utf-8")
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                handle.close()  # a live process owns it
+                continue
+            records = [record for record in map(_decode, handle) if record is not None]
+            with self._lock:
+                self._sealed.append(_Segment(path, handle, records))
+            adopted += len(records)
+        self.recovered += adopted
+        if adopted:
+            logger.info(f"♻️ Recovered {adopted} buffered quiz attempts from an earlier run")
+        return adopted
+
+    # ─── Flushing ──────────────────────────────────────
+    def flush(self) -> int:
+        """Write every buffered attempt, a chunk per transaction; returns how many were written.
+
+        Raises the first error once the chunks that could be written are in; the attempts of
+        the failed chunks stay buffered for the next flush.
+        """
+        with self._flush_lock:
+            with self._lock:
+                if self._active is not None and self._active.records:
+                    self._sealed.append(self._active)
+                    self._active = None
+                segments = list(self._sealed)
+            records = [record for segment in segments for record in segment.records]
+            if not records:
+                self._drop(segments)
+                return 0
+
+            start = time.perf_counter()
+            written, held, error, rejected = 0, [], None, False
+            for offset in range(0, len(records), self.chunk_size):
+                chunk = records[offset:offset + self.chunk_size]
+                try:
+                    self._write(chunk)
+                    written += len(chunk)
+                except _REJECTED as e:
+                    self.flush_errors += 1
+                    rejected = True
+                    if self._rejected_flushes + 1 >= self.dead_letter_after:
+                        written += self._write_each(chunk)
+                    else:
+                        held.extend(chunk)
+                        error = error or e
+                except Exception as e:
+                    # The database is away: this chunk and the rest wait for the next flush
+                    self.flush_errors += 1
+                    held.extend(records[offset:])
+                    error = e
+                    break
+            self._rejected_flushes = self._rejected_flushes + 1 if rejected else 0
+
+            self._release(segments, held)
+            if written:
+                self.flushed += written
+                self.flush_time.observe(time.perf_counter() - start)
+                self.flush_rows.observe_value(written)
+            if error is not None:
+                raise error
+            self.flushes += 1
+            return written
+
+    def _write(self, records: List[Dict[str, Any]]):
+        db = self.session_factory()
+        try:
+            write_attempts(db, records)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _write_each(self, records: List[Dict[str, Any]]) -> int:
+        """Write attempts one per transaction and dead-letter the ones the database rejects"""
+        rejected = []
+        for record in records:
+            try:
+                self._write([record])
+            except _REJECTED as e:
+                rejected.append({**record, "error": str(getattr(e, "orig", e))[:500]})
+        if rejected:
+            name = f"dead-letter-{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.jsonl"
+            path = os.path.join(self.directory, name)
+            with open(path, "w", encoding="utf-8") as handle:
+                handle.write("".join(_encode(record) for record in rejected))
+                handle.flush()
+                os.fsync(handle.fileno())
+            self.dead_lettered += len(rejected)
+            logger.error(f"☠️ {len(rejected)} quiz attempts rejected by the database, moved to {path}: "
+                         f"{rejected[0]['error']}")
+        return len(records) - len(rejected)
+
+    def _release(self, segments: List[_Segment], held: List[Dict[str, Any]]):
+        """Delete the segments that are fully written; the rest keep only their unwritten attempts"""
+        held_ids = {id(record) for record in held}
+        done = []
+        for segment in segments:
+            segment.records = [record for record in segment.records if id(record) in held_ids]
+            if not segment.records:
+                done.append(segment)
+        self._drop(done)
+
+    def _drop(self, segments: List[_Segment]):
+        with self._lock:
+            self._sealed = [segment for segment in self._sealed if segment not in segments]
+        for segment in segments:
+            segment.remove()
+
+    async def add(self, records: List[Dict[str, Any]]):
+        depth = await asyncio.to_thread(self.append, records)
+        if depth >= self.flush_size and self._wake is not None:
+            self._wake.set()
+
+    async def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        await asyncio.to_thread(self.recover)
+        self._wake = asyncio.Event()
+        if self.depth:
+            self._wake.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and write out whatever is still buffered"""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        try:
+            flushed = await asyncio.to_thread(self.flush)
+            if flushed:
+                logger.info(f"💾 Flushed {flushed} buffered quiz attempts on shutdown")
+        except SQLAlchemyError as e:
+            logger.error(f"❌ Final quiz attempt flush failed, {self.depth} attempts stay in the journal: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except SQLAlchemyError as e:
+                logger.warning(f"⚠️ Quiz attempt flush failed, will retry: {e}")
+            except Exception:
+                logger.exception("💥 Quiz attempt flusher failed")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None,
+            "depth": self.depth,
+            "max_pending": self.max_pending,
+            "appended": self.appended,
+            "rejected": self.rejected,
+            "recovered": self.recovered,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "dead_lettered": self.dead_lettered,
+            "flush_time": self.flush_time.snapshot(),
+            "flush_rows": self.flush_rows.snapshot(),
+        }
+
+
+attempt_buffer = AttemptBuffer()
@@ -0,0 +1,323 @@
+# email_outbox.py - Table-backed email outbox drained by a background sender over one reused SMTP connection
+import os
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import SessionLocal, OutboxEmail
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_EMAIL = os.getenv("SMTP_EMAIL")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+# Turn off for a local debugging server (python -m aiosmtpd -n -l localhost:1025), which speaks plain SMTP
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "10"))
+SMTP_IDLE_SECONDS = float(os.getenv("SMTP_IDLE_SECONDS", "60"))  # close the connection after this long unused
+
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "50"))
+EMAIL_OUTBOX_POLL_INTERVAL = float(os.getenv("EMAIL_OUTBOX_POLL_INTERVAL", "2"))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "5"))
+EMAIL_OUTBOX_RETRY_BASE = float(os.getenv("EMAIL_OUTBOX_RETRY_BASE", "5"))  # seconds; doubles per attempt
+EMAIL_OUTBOX_LEASE_SECONDS = int(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", "60"))
+EMAIL_OUTBOX_RETENTION_HOURS = float(os.getenv("EMAIL_OUTBOX_RETENTION_HOURS", "168"))  # sent/failed rows kept
+EMAIL_OUTBOX_PRUNE_INTERVAL = float(os.getenv("EMAIL_OUTBOX_PRUNE_INTERVAL", "3600"))
+EMAIL_OUTBOX_PRUNE_CHUNK = int(os.getenv("EMAIL_OUTBOX_PRUNE_CHUNK", "1000"))
+
+
+class EmailOutbox:
+    """Emails are inserted in the caller's transaction; a background task sends them in batches.
+
+    The sender keeps one authenticated SMTP connection open between batches (closed after
+    SMTP_IDLE_SECONDS idle), reconnects when the server drops it, and retries failed messages
+    with exponential backoff. Rows are leased before sending so several replicas can share
+    the outbox without double-sending. A sent or abandoned row loses its body (it holds the
+    verification code) and is deleted once older than EMAIL_OUTBOX_RETENTION_HOURS.
+    """
+
+    def __init__(self, session_factory=SessionLocal, batch_size: int = EMAIL_OUTBOX_BATCH_SIZE,
+                 poll_interval: float = EMAIL_OUTBOX_POLL_INTERVAL, max_attempts: int = EMAIL_OUTBOX_MAX_ATTEMPTS,
+                 retry_base: float = EMAIL_OUTBOX_RETRY_BASE, lease_seconds: int = EMAIL_OUTBOX_LEASE_SECONDS,
+                 server: str = SMTP_SERVER, port: int = SMTP_PORT, sender: Optional[str] = SMTP_EMAIL,
+                 password: Optional[str] = SMTP_PASSWORD, use_tls: bool = SMTP_USE_TLS,
+                 retention_hours: float = EMAIL_OUTBOX_RETENTION_HOURS,
+                 prune_interval: float = EMAIL_OUTBOX_PRUNE_INTERVAL, prune_chunk: int = EMAIL_OUTBOX_PRUNE_CHUNK):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.lease_seconds = lease_seconds
+        self.server = server
+        self.port = port
+        self.sender = sender
+        self.password = password
+        self.use_tls = use_tls
+        self.retention_hours = retention_hours
+        self.prune_interval = prune_interval
+        self.prune_chunk = prune_chunk
+        self._conn: Optional["smtplib.SMTP"] = None
+        self._last_used = 0.0
+        self._sending = threading.Lock()  # held by the thread using the SMTP connection
+        self._last_prune = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+        self.enqueued = 0
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.connections_opened = 0
+        self.batches = 0
+        self.pruned = 0
+        self.delivery_delay = Histogram()  # enqueue -> accepted by the SMTP server
+        self.send_time = Histogram()
+
+    @property
+    def configured(self) -> bool:
+        # A local debugging server (no TLS) needs no password
+        return bool(self.sender) and (bool(self.password) or not self.use_tls)
+
+    # ─── Producer side ─────────────────────────────────
+    def enqueue(self, db: Session, recipient: str, subject: str, html_body: str) -> OutboxEmail:
+        """Add an email to the caller's session; it is sent once the caller commits"""
+        message = OutboxEmail(recipient=recipient, subject=subject, html_body=html_body, status="pending",
+                              attempts=0, next_attempt_at=datetime.utcnow())
+        db.add(message)
+        self.enqueued += 1
+        return message
+
+    def notify(self):
+        """Wake the sender now instead of at its next poll"""
+        if self._wake is not None:
+            self._wake.set()
+
+    # ─── Sender lifecycle ──────────────────────────────
+    async def start(self):
+        if self._task is not None:
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await asyncio.to_thread(self._close)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                # Keep draining while full batches come back
+                while await asyncio.to_thread(self.send_due) >= self.batch_size:
+                    pass
+            except SQLAlchemyError as e:
+                logger.warning(f"⚠️ Email outbox unavailable: {e}")
+            except Exception:
+                logger.exception("💥 Email outbox sender failed")
+            if time.monotonic() - self._last_prune >= self.prune_interval:
+                self._last_prune = time.monotonic()
+                try:
+                    await asyncio.to_thread(self.prune)
+                except SQLAlchemyError as e:
+                    logger.warning(f"⚠️ Email outbox prune failed: {e}")
+
+    # ─── Sending (runs in a worker thread) ─────────────
+    # smtplib and email.mime load on the first send, not when the app starts
+    def _connect(self) -> "smtplib.SMTP":
+        import smtplib
+        if self._conn is not None and time.monotonic() - self._last_used > SMTP_IDLE_SECONDS:
+            self._disconnect()
+        if self._conn is None:
+            conn = smtplib.SMTP(self.server, self.port, timeout=SMTP_TIMEOUT)
+            try:
+                if self.use_tls:
+                    conn.starttls()
+                if self.password:
+                    conn.login(self.sender, self.password)
+            except Exception:
+                conn.close()
+                raise
+            self._conn = conn
+            self._last_used = time.monotonic()
+            self.connections_opened += 1
+        return self._conn
+
+    def _close(self):
+        # Cancelling the sender task leaves a send_due thread running; let it finish with the connection
+        with self._sending:
+            self._disconnect()
+
+    def _disconnect(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.quit()
+            except Exception:
+                conn.close()
+
+    def _build(self, message: OutboxEmail) -> str:
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+        msg = MIMEMultipart()
+        msg['From'] = self.sender
+        msg['To'] = message.recipient
+        msg['Subject'] = message.subject
+        msg.attach(MIMEText(message.html_body, 'html'))
+        return msg.as_string()
+
+    def _deliver(self, message: OutboxEmail):
+        import smtplib
+        # Errors after which the connection can't be trusted and is reopened
+        connection_errors = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+        text = self._build(message)
+        for attempt in range(2):
+            conn = self._connect()
+            try:
+                conn.sendmail(self.sender, message.recipient, text)
+                self._last_used = time.monotonic()
+                return
+            except connection_errors:
+                # A kept-alive connection may have been dropped by the server; retry once on a fresh one
+                self._disconnect()
+                if attempt:
+                    raise
+
+    def _claim(self, db: Session) -> List[OutboxEmail]:
+        now = datetime.utcnow()
+        due = (db.query(OutboxEmail)
+               .filter(OutboxEmail.status == "pending", OutboxEmail.next_attempt_at <= now)
+               .order_by(OutboxEmail.next_attempt_at)
+               .limit(self.batch_size)
+               .with_for_update(skip_locked=True)
+               .all())
+        lease_until = now + timedelta(seconds=self.lease_seconds)
+        claimed = []
+        for message in due:
+            # Push the row out of everyone else's due window while we send it
+            won = db.query(OutboxEmail).filter(
+                OutboxEmail.id == message.id, OutboxEmail.next_attempt_at == message.next_attempt_at
+            ).update({"next_attempt_at": lease_until}, synchronize_session=False)
+            if won:
+                claimed.append(message)
+        db.commit()
+        return claimed
+
+    def send_due(self) -> int:
+        """Send one batch of due emails; returns how many were claimed"""
+        if not self.configured:
+            return 0
+        with self._sending:
+            return self._send_due()
+
+    def _send_due(self) -> int:
+        db = self.session_factory()
+        db.expire_on_commit = False  # the claimed rows are used right after the claim commits
+        try:
+            batch = self._claim(db)
+            if not batch:
+                return 0
+            self.batches += 1
+            for message in batch:
+                start = time.perf_counter()
+                try:
+                    self._deliver(message)
+                except Exception as e:
+                    self._record_failure(message, e)
+                    continue
+                self.send_time.observe(time.perf_counter() - start)
+                message.status = "sent"
+                message.html_body = None
+                message.sent_at = datetime.utcnow()
+                message.attempts += 1
+                self.sent += 1
+                self.delivery_delay.observe((message.sent_at - message.created_at).total_seconds())
+                logger.info(f"✅ Verification email sent to {message.recipient}")
+            db.commit()
+            return len(batch)
+        finally:
+            db.close()
+
+    def _record_failure(self, message: OutboxEmail, error: Exception):
+        message.attempts += 1
+        message.last_error = str(error)[:500]
+        if message.attempts >= self.max_attempts:
+            message.status = "failed"
+            message.html_body = None
+            self.failed += 1
+            logger.error(f"❌ Giving up on email to {message.recipient} after {message.attempts} attempts: {error}")
+        else:
+            delay = self.retry_base * 2 ** (message.attempts - 1)
+            message.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+            self.retried += 1
+            logger.warning(f"⚠️ Email to {message.recipient} failed ({error}); retrying in {delay:.0f}s")
+
+    def prune(self) -> int:
+        """Delete sent and failed rows older than the retention, one short transaction per chunk"""
+        total = 0
+        db = self.session_factory()
+        try:
+            while True:
+                # next_attempt_at of a finished row is when it was last claimed
+                old = (select(OutboxEmail.id)
+                       .where(OutboxEmail.status.in_(("sent", "failed")),
+                              OutboxEmail.next_attempt_at < datetime.utcnow() - timedelta(hours=self.retention_hours))
+                       .limit(self.prune_chunk))
+                deleted = db.execute(delete(OutboxEmail).where(OutboxEmail.id.in_(old))).rowcount
+                db.commit()
+                total += deleted
+                if deleted < self.prune_chunk:
+                    break
+        except SQLAlchemyError:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self.pruned += total
+        return total
+
+    async def pending_count(self) -> int:
+        return await asyncio.to_thread(self._pending_count)
+
+    def _pending_count(self) -> int:
+        db = self.session_factory()
+        try:
+            return db.query(OutboxEmail).filter(OutboxEmail.status == "pending").count()
+        except SQLAlchemyError:
+            return -1
+        finally:
+            db.close()
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "configured": self.configured,
+            "running": self._task is not None,
+            "pending": await self.pending_count(),
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "batches": self.batches,
+            "pruned": self.pruned,
+            "smtp_connections_opened": self.connections_opened,
+            "delivery_delay": self.delivery_delay.snapshot(),
+            "send_time": self.send_time.snapshot(),
+        }
+
+
+email_outbox = EmailOutbox()
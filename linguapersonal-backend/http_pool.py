@@ -0,0 +1,133 @@
+# http_pool.py - Application-scoped, pooled HTTP client for outbound LLM calls
+import os
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Pool sizing and timeouts (seconds) for calls to the LLM provider
+OUTBOUND_MAX_CONNECTIONS = int(os.getenv("OUTBOUND_MAX_CONNECTIONS", "100"))
+OUTBOUND_MAX_KEEPALIVE = int(os.getenv("OUTBOUND_MAX_KEEPALIVE", "20"))
+OUTBOUND_KEEPALIVE_EXPIRY = float(os.getenv("OUTBOUND_KEEPALIVE_EXPIRY", "30"))
+OUTBOUND_HTTP2 = os.getenv("OUTBOUND_HTTP2", "false").lower() == "true"
+OUTBOUND_CONNECT_TIMEOUT = float(os.getenv("OUTBOUND_CONNECT_TIMEOUT", "10"))
+OUTBOUND_READ_TIMEOUT = float(os.getenv("OUTBOUND_READ_TIMEOUT", "90"))
+OUTBOUND_WRITE_TIMEOUT = float(os.getenv("OUTBOUND_WRITE_TIMEOUT", "10"))
+OUTBOUND_POOL_TIMEOUT = float(os.getenv("OUTBOUND_POOL_TIMEOUT", "5"))
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class OutboundHTTPPool:
+    """Owns the single httpx.AsyncClient shared by every lesson request"""
+
+    def __init__(self, max_connections: int = OUTBOUND_MAX_CONNECTIONS,
+                 max_keepalive: int = OUTBOUND_MAX_KEEPALIVE,
+                 keepalive_expiry: float = OUTBOUND_KEEPALIVE_EXPIRY,
+                 http2: bool = OUTBOUND_HTTP2):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(
+            connect=OUTBOUND_CONNECT_TIMEOUT,
+            read=OUTBOUND_READ_TIMEOUT,
+            write=OUTBOUND_WRITE_TIMEOUT,
+            pool=OUTBOUND_POOL_TIMEOUT
+        )
+        self.http2 = http2
+        self._client: Optional[httpx.AsyncClient] = None
+        self.requests_total = 0
+        self.errors_total = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    async def start(self):
+        if self._client is not None:
+            return
+        if self.http2 and not _http2_available():
+            logger.warning("⚠️ OUTBOUND_HTTP2 requested but the 'h2' package is not installed; using HTTP/1.1")
+            self.http2 = False
+        self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout, http2=self.http2)
+        logger.info(f"🌐 Outbound HTTP pool started (max_connections={self.limits.max_connections}, "
+                    f"keepalive={self.limits.max_keepalive_connections}, http2={self.http2})")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info("🌐 Outbound HTTP pool closed")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The shared client; created on first use when running outside the app lifespan (scripts, tests)"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout,
+                                             http2=self.http2 and _http2_available())
+        return self._client
+
+    def _enter(self):
+        self.requests_total += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        self._enter()
+        try:
+            return await self.client.post(url, **kwargs)
+        except httpx.HTTPError:
+            self.errors_total += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs):
+        self._enter()
+        try:
+            async with self.client.stream(method, url, **kwargs) as response:
+                yield response
+        except httpx.HTTPError:
+            self.errors_total += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    def _connection_counts(self) -> Dict[str, int]:
+        # httpcore does not expose pool occupancy publicly, so this is best-effort
+        try:
+            connections = list(self._client._transport._pool.connections)
+        except AttributeError:
+            return {}
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {"connections_open": len(connections), "connections_idle": idle,
+                "connections_active": len(connections) - idle}
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "started": self._client is not None,
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "requests_total": self.requests_total,
+            "errors_total": self.errors_total,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+        }
+        if self._client is not None:
+            stats.update(self._connection_counts())
+        return stats
+
+
+outbound_http = OutboundHTTPPool()
@@ -0,0 +1,156 @@
+# lesson_cache.py - Two-tier cache for generated lessons
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import CachedLesson
+
+logger = logging.getLogger(__name__)
+
+LESSON_CACHE_MAX_ENTRIES = int(os.getenv("LESSON_CACHE_MAX_ENTRIES", "2048"))
+LESSON_CACHE_PERSIST = os.getenv("LESSON_CACHE_PERSIST", "true").lower() == "true"
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n.,;:!?¡¿\"'"
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalize a user prompt so trivially different spellings share a cache entry"""
+    normalized = unicodedata.normalize("NFKC", prompt).casefold()
+    normalized = _WHITESPACE_RE.sub(" ", normalized)
+    return normalized.strip(_EDGE_PUNCTUATION)
+
+
+def lesson_cache_key(prompt: str, target_lang: str, native_lang: str, model: str, template_version: str) -> str:
+    """Content address of a lesson: everything that changes what the LLM is asked to produce"""
+    parts = [
+        normalize_prompt(prompt),
+        target_lang.strip().casefold(),
+        native_lang.strip().casefold(),
+        model,
+        template_version,
+    ]
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class LessonCache:
+    """Bounded in-process LRU in front of the lesson_cache table"""
+
+    def __init__(self, max_entries: int = LESSON_CACHE_MAX_ENTRIES, persist: bool = LESSON_CACHE_PERSIST):
+        self.max_entries = max_entries
+        self.persist = persist
+        # key -> (lesson_json, generation_ms); lessons are kept serialized so callers can't mutate them
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stores = 0
+        self.errors = 0
+        self.generation_ms_saved = 0
+
+    def _remember(self, key: str, lesson_json: str, generation_ms: int):
+        with self._lock:
+            self._entries[key] = (lesson_json, generation_ms)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, db: Session, key: str) -> Optional[Dict[str, Any]]:
+        """Return a fresh copy of the cached lesson, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                self.generation_ms_saved += entry[1] or 0
+        if entry is not None:
+            return json.loads(entry[0])
+
+        if self.persist:
+            try:
+                row = db.query(CachedLesson.lesson_json, CachedLesson.generation_ms).filter(
+                    CachedLesson.cache_key == key
+                ).first()
+            except SQLAlchemyError as e:
+                db.rollback()
+                self.errors += 1
+                logger.warning(f"⚠️ Lesson cache lookup failed: {e}")
+                row = None
+
+            if row is not None:
+                self._remember(key, row.lesson_json, row.generation_ms or 0)
+                with self._lock:
+                    self.persistent_hits += 1
+                    self.generation_ms_saved += row.generation_ms or 0
+                return json.loads(row.lesson_json)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, db: Session, key: str, lesson: Dict[str, Any], *, prompt: str, target_lang: str,
+            native_lang: str, model: str, template_version: str, generation_ms: int = 0):
+        """Store a freshly generated lesson in both tiers; persistence failures are logged, not raised"""
+        lesson_json = json.dumps(lesson, ensure_ascii=False)
+        self._remember(key, lesson_json, generation_ms)
+        with self._lock:
+            self.stores += 1
+
+        if not self.persist:
+            return
+        try:
+            exists = db.query(CachedLesson.id).filter(CachedLesson.cache_key == key).first()
+            if not exists:
+                db.add(CachedLesson(
+                    cache_key=key,
+                    prompt=normalize_prompt(prompt)[:500],
+                    target_lang=target_lang,
+                    native_lang=native_lang,
+                    model=model,
+                    template_version=template_version,
+                    lesson_json=lesson_json,
+                    generation_ms=generation_ms
+                ))
+                db.commit()
+        except SQLAlchemyError as e:
+            # A concurrent writer may have inserted the same key first; the memory tier still has it
+            db.rollback()
+            self.errors += 1
+            logger.warning(f"⚠️ Lesson cache store failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.persistent_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "memory_hits": self.memory_hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "stores": self.stores,
+                "errors": self.errors,
+                "llm_calls_avoided": hits,
+                "generation_seconds_saved": round(self.generation_ms_saved / 1000, 3),
+            }
+
+
+lesson_cache = LessonCache()
@@ -0,0 +1,418 @@
+# lesson_jobs.py - Asynchronous lesson generation jobs: queue backends and worker pool
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import or_, and_
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import SessionLocal, LessonJob
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+LESSON_JOB_BACKEND = os.getenv("LESSON_JOB_BACKEND", "memory").lower()  # memory | database
+LESSON_JOB_WORKERS = int(os.getenv("LESSON_JOB_WORKERS", "4"))
+LESSON_JOB_POLL_INTERVAL = float(os.getenv("LESSON_JOB_POLL_INTERVAL", "0.5"))
+LESSON_JOB_LEASE_SECONDS = int(os.getenv("LESSON_JOB_LEASE_SECONDS", "300"))  # reclaim jobs of dead workers
+LESSON_JOB_MAX_ATTEMPTS = int(os.getenv("LESSON_JOB_MAX_ATTEMPTS", "3"))
+LESSON_JOB_RESULT_TTL = int(os.getenv("LESSON_JOB_RESULT_TTL", "3600"))
+LESSON_JOB_MAX_WAIT = float(os.getenv("LESSON_JOB_MAX_WAIT", "30"))  # long-poll cap (seconds)
+
+FINISHED = ("done", "failed")
+
+Job = Dict[str, Any]
+JobHandler = Callable[[Job], Awaitable[Dict[str, Any]]]
+
+
+def new_job(user_id: int, request: Dict[str, Any]) -> Job:
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "request": request,
+        "status": "queued",
+        "result": None,
+        "error": None,
+        "error_status": None,
+        "worker_id": None,
+        "attempts": 0,
+        "created_at": datetime.utcnow(),
+        "started_at": None,
+        "finished_at": None,
+    }
+
+
+class MemoryJobBackend:
+    """Jobs live in this process; fine for a single replica, lost on restart"""
+
+    name = "memory"
+    poll_interval = 1.0  # completions wake waiters directly, polling is only a safety net
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def start(self):
+        # Bind a fresh queue to the running loop, keeping anything submitted before start
+        pending = [job_id for job_id, job in self._jobs.items() if job["status"] == "queued"]
+        self._queue = asyncio.Queue()
+        for job_id in pending:
+            self._queue.put_nowait(job_id)
+
+    async def submit(self, job: Job):
+        self._jobs[job["id"]] = dict(job)
+        self._queue.put_nowait(job["id"])
+
+    async def claim(self, worker_id: str) -> Optional[Job]:
+        job = self._jobs.get(await self._queue.get())
+        if job is None or job["status"] != "queued":
+            return None
+        job.update(status="running", worker_id=worker_id, started_at=datetime.utcnow(), attempts=job["attempts"] + 1)
+        return dict(job)
+
+    async def finish(self, job_id: str, **fields):
+        if job_id in self._jobs:
+            self._jobs[job_id].update(fields)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    async def prune(self, finished_before: datetime) -> int:
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["status"] in FINISHED and job["finished_at"] < finished_before]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return len(expired)
+
+    async def depth(self) -> int:
+        return self._queue.qsize()
+
+    def clear(self):
+        self._jobs.clear()
+        self._queue = asyncio.Queue()
+
+
+class DatabaseJobBackend:
+    """Jobs in the lesson_jobs table, so every API replica's workers drain one shared queue.
+
+    Workers poll for the oldest queued job and claim it with a conditional UPDATE (plus
+    SKIP LOCKED on PostgreSQL), so a job is only ever run by one worker at a time. Jobs left
+    running by a dead worker are reclaimed once their lease expires.
+    """
+
+    name = "database"
+
+    def __init__(self, session_factory=SessionLocal, poll_interval: float = LESSON_JOB_POLL_INTERVAL,
+                 lease_seconds: int = LESSON_JOB_LEASE_SECONDS, max_attempts: int = LESSON_JOB_MAX_ATTEMPTS):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    @staticmethod
+    def _to_job(row: LessonJob) -> Job:
+        return {
+            "id": row.id,
+            "user_id": row.user_id,
+            "request": json.loads(row.request_json),
+            "status": row.status,
+            "result": json.loads(row.result_json) if row.result_json else None,
+            "error": row.error,
+            "error_status": row.error_status,
+            "worker_id": row.worker_id,
+            "attempts": row.attempts,
+            "created_at": row.created_at,
+            "started_at": row.started_at,
+            "finished_at": row.finished_at,
+        }
+
+    async def start(self):
+        pass
+
+    async def submit(self, job: Job):
+        await asyncio.to_thread(self._insert, job)
+
+    def _insert(self, job: Job):
+        db = self.session_factory()
+        try:
+            db.add(LessonJob(id=job["id"], user_id=job["user_id"], status="queued",
+                             request_json=json.dumps(job["request"], ensure_ascii=False), attempts=0,
+                             created_at=job["created_at"]))
+            db.commit()
+        finally:
+            db.close()
+
+    async def claim(self, worker_id: str) -> Optional[Job]:
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim_one, worker_id)
+            except SQLAlchemyError as e:
+                logger.warning(f"⚠️ Could not claim a lesson job: {e}")
+                job = None
+            if job is not None:
+                return job
+            await asyncio.sleep(self.poll_interval)
+
+    def _claim_one(self, worker_id: str) -> Optional[Job]:
+        db = self.session_factory()
+        try:
+            while True:
+                now = datetime.utcnow()
+                claimable = or_(
+                    LessonJob.status == "queued",
+                    and_(LessonJob.status == "running",
+                         LessonJob.started_at < now - timedelta(seconds=self.lease_seconds)),
+                )
+                row = (db.query(LessonJob)
+                       .filter(claimable)
+                       .order_by(LessonJob.created_at)
+                       .with_for_update(skip_locked=True)
+                       .first())
+                if row is None:
+                    db.rollback()
+                    return None
+                # Only wins if nobody claimed the row since it was read (SQLite has no row locks)
+                unchanged = db.query(LessonJob).filter(
+                    LessonJob.id == row.id, LessonJob.status == row.status, LessonJob.attempts == row.attempts)
+                if row.attempts >= self.max_attempts:
+                    # Its last worker died mid-run; fail it so long-polling clients get an answer
+                    if unchanged.update({"status": "failed", "error_status": 500, "finished_at": now,
+                                         "error": f"Lesson job abandoned after {row.attempts} attempts"},
+                                        synchronize_session=False):
+                        logger.warning(f"❌ Lesson job {row.id} abandoned after {row.attempts} attempts")
+                    db.commit()
+                    continue
+                claimed = unchanged.update({"status": "running", "worker_id": worker_id, "started_at": now,
+                                            "attempts": row.attempts + 1}, synchronize_session=False)
+                db.commit()
+                if not claimed:
+                    return None
+                db.refresh(row)
+                return self._to_job(row)
+        finally:
+            db.close()
+
+    async def finish(self, job_id: str, **fields):
+        await asyncio.to_thread(self._update, job_id, fields)
+
+    def _update(self, job_id: str, fields: Dict[str, Any]):
+        if "result" in fields:
+            fields["result_json"] = json.dumps(fields.pop("result"), ensure_ascii=False)
+        db = self.session_factory()
+        try:
+            db.query(LessonJob).filter(LessonJob.id == job_id).update(fields, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await asyncio.to_thread(self._get, job_id)
+
+    def _get(self, job_id: str) -> Optional[Job]:
+        db = self.session_factory()
+        try:
+            row = db.get(LessonJob, job_id)
+            return self._to_job(row) if row is not None else None
+        finally:
+            db.close()
+
+    async def prune(self, finished_before: datetime) -> int:
+        return await asyncio.to_thread(self._prune, finished_before)
+
+    def _prune(self, finished_before: datetime) -> int:
+        db = self.session_factory()
+        try:
+            deleted = db.query(LessonJob).filter(LessonJob.status.in_(FINISHED),
+                                                 LessonJob.finished_at < finished_before
+                                                 ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    async def depth(self) -> int:
+        return await asyncio.to_thread(self._depth)
+
+    def _depth(self) -> int:
+        db = self.session_factory()
+        try:
+            return db.query(LessonJob).filter(LessonJob.status == "queued").count()
+        except SQLAlchemyError:
+            return -1
+        finally:
+            db.close()
+
+    def clear(self):
+        pass
+
+
+JOB_BACKENDS = {
+    "memory": MemoryJobBackend,
+    "database": DatabaseJobBackend,
+}
+
+
+def get_job_backend(name: str = LESSON_JOB_BACKEND):
+    try:
+        return JOB_BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown LESSON_JOB_BACKEND '{name}'; expected one of {sorted(JOB_BACKENDS)}")
+
+
+class LessonJobQueue:
+    """Accepts lesson jobs and runs them on a pool of worker tasks started with the app"""
+
+    def __init__(self, backend, workers: int = LESSON_JOB_WORKERS, result_ttl: int = LESSON_JOB_RESULT_TTL):
+        self.backend = backend
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self._handler: Optional[JobHandler] = None
+        self._tasks: List[asyncio.Task] = []
+        self._events: Dict[str, asyncio.Event] = {}
+        self._waiters: Dict[str, int] = {}  # long-polls per job; the last one out drops its event
+        self._started_at: Optional[float] = None
+        self._busy_since: Dict[str, float] = {}
+        self._busy_seconds = 0.0
+        self._last_prune = 0.0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.queue_latency = Histogram()
+        self.service_time = Histogram()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self, handler: JobHandler):
+        if self._tasks:
+            return
+        self._handler = handler
+        self._started_at = time.monotonic()
+        self._busy_seconds = 0.0
+        await self.backend.start()
+        prefix = f"{socket.gethostname()}-{os.getpid()}"
+        self._tasks = [asyncio.create_task(self._worker(f"{prefix}-{i}")) for i in range(self.workers)]
+        logger.info(f"👷 Started {self.workers} lesson job workers ({self.backend.name} backend)")
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._busy_since.clear()
+
+    async def submit(self, user_id: int, request: Dict[str, Any]) -> Job:
+        job = new_job(user_id, request)
+        await self.backend.submit(job)
+        self.submitted += 1
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        return await self.backend.get(job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Long-poll: the job once it finishes, or its current state when timeout runs out"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(timeout, LESSON_JOB_MAX_WAIT)
+        self._waiters[job_id] = self._waiters.get(job_id, 0) + 1
+        try:
+            while True:
+                job = await self.backend.get(job_id)
+                remaining = deadline - loop.time()
+                if job is None or job["status"] in FINISHED or remaining <= 0:
+                    return job
+                # Jobs finished by this process wake us at once; other replicas' are seen by polling
+                event = self._events.setdefault(job_id, asyncio.Event())
+                try:
+                    await asyncio.wait_for(event.wait(), min(remaining, self.backend.poll_interval))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # Jobs finished elsewhere, or never, would otherwise leave their event behind
+            waiters = self._waiters.pop(job_id, 1) - 1
+            if waiters:
+                self._waiters[job_id] = waiters
+            else:
+                self._events.pop(job_id, None)
+
+    async def _worker(self, worker_id: str):
+        while True:
+            job = await self.backend.claim(worker_id)
+            if job is None:
+                continue
+            self.queue_latency.observe((job["started_at"] - job["created_at"]).total_seconds())
+            start = self._busy_since[worker_id] = time.monotonic()
+            try:
+                result = await self._handler(job)
+                fields = {"status": "done", "result": result}
+                self.completed += 1
+            except Exception as e:
+                # HTTPException carries the status and message the client would have seen
+                fields = {"status": "failed", "error": str(getattr(e, "detail", e))[:500],
+                          "error_status": getattr(e, "status_code", 500)}
+                self.failed += 1
+                logger.warning(f"❌ Lesson job {job['id']} failed: {fields['error']}")
+            finally:
+                elapsed = time.monotonic() - start
+                del self._busy_since[worker_id]
+                self._busy_seconds += elapsed
+                self.service_time.observe(elapsed)
+
+            fields["finished_at"] = datetime.utcnow()
+            try:
+                await self.backend.finish(job["id"], **fields)
+            except Exception:
+                # Whatever went wrong is this job's problem; the worker goes on to the next one
+                logger.exception(f"💥 Could not record result of lesson job {job['id']}")
+            event = self._events.pop(job["id"], None)
+            if event is not None:
+                event.set()
+            await self._maybe_prune()
+
+    async def _maybe_prune(self):
+        now = time.monotonic()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        try:
+            await self.backend.prune(datetime.utcnow() - timedelta(seconds=self.result_ttl))
+        except SQLAlchemyError as e:
+            logger.warning(f"⚠️ Could not prune finished lesson jobs: {e}")
+
+    def utilization(self) -> float:
+        """Fraction of worker time spent running jobs since start"""
+        if self._started_at is None or not self.workers:
+            return 0.0
+        now = time.monotonic()
+        busy = self._busy_seconds + sum(now - since for since in self._busy_since.values())
+        elapsed = (now - self._started_at) * self.workers
+        return round(busy / elapsed, 3) if elapsed else 0.0
+
+    def clear(self):
+        self.backend.clear()
+        self._events.clear()
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend.name,
+            "workers": len(self._tasks),
+            "busy_workers": len(self._busy_since),
+            "queue_depth": await self.backend.depth(),  # a query on the database backend
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "worker_utilization": self.utilization(),
+            "queue_latency": self.queue_latency.snapshot(),
+            "service_time": self.service_time.snapshot(),
+        }
+
+
+lesson_jobs = LessonJobQueue(get_job_backend())
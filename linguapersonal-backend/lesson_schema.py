@@ -0,0 +1,267 @@
+# lesson_schema.py - Validated lesson parsing with repair of common model output defects
+import re
+import json
+import time
+import logging
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from metrics import Histogram
+from lesson_stream import IncrementalLessonParser
+
+try:
+    import orjson
+    _loads = orjson.loads
+    _DECODE_ERRORS: Tuple = (orjson.JSONDecodeError, ValueError)
+except ImportError:  # orjson is optional; the stdlib parser is just slower
+    _loads = json.loads
+    _DECODE_ERRORS = (ValueError,)
+
+logger = logging.getLogger(__name__)
+
+# The shape the frontend renders (src/types/lesson.ts); list bounds are (min, max or None)
+PAIR = {"native": str, "target": str}
+LESSON_SCHEMA = {
+    "vocabulary": ([PAIR], 1, None),
+    "grammar_notes": str,
+    "quiz": {
+        "vocab_matching": ([PAIR], 1, None),
+        "mini_translations": ([PAIR], 1, None),
+    },
+}
+
+_CODE_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+
+Validator = Callable[[Any, str, List[str]], None]
+
+
+class LessonFormatError(ValueError):
+    """The model output could not be turned into a lesson of the expected shape"""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors[:5]))
+        self.errors = errors
+
+
+class ParsedLesson(NamedTuple):
+    lesson: Dict[str, Any]
+    repairs: List[str]
+
+
+def compile_schema(spec) -> Validator:
+    """Turn a schema spec into a nested closure that appends 'path: problem' strings to an error list.
+
+    Compiling once means validation is a handful of direct isinstance checks per value instead of
+    re-interpreting the schema on every lesson.
+    """
+    if isinstance(spec, type):
+        type_name = spec.__name__
+
+        def check_type(value, path, errors):
+            if not isinstance(value, spec):
+                errors.append(f"{path}: expected {type_name}")
+        return check_type
+
+    if isinstance(spec, tuple):
+        (item_spec,), min_items, max_items = spec
+        check_item = compile_schema(item_spec)
+
+        def check_list(value, path, errors):
+            if not isinstance(value, list):
+                errors.append(f"{path}: expected list")
+                return
+            if len(value) < min_items or (max_items is not None and len(value) > max_items):
+                errors.append(f"{path}: expected {min_items}..{max_items or ''} items, got {len(value)}")
+            for i, item in enumerate(value):
+                check_item(item, f"{path}[{i}]", errors)
+        return check_list
+
+    fields = [(key, compile_schema(field_spec)) for key, field_spec in spec.items()]
+
+    def check_object(value, path, errors):
+        if not isinstance(value, dict):
+            errors.append(f"{path}: expected object")
+            return
+        for key, check_field in fields:
+            if key not in value:
+                errors.append(f"{path}.{key}: missing")
+            else:
+                check_field(value[key], f"{path}.{key}", errors)
+    return check_object
+
+
+_check_lesson = compile_schema(LESSON_SCHEMA)
+
+
+def validate_lesson(lesson: Any) -> List[str]:
+    errors: List[str] = []
+    _check_lesson(lesson, "lesson", errors)
+    return errors
+
+
+def extract_json_object(text: str) -> Tuple[str, bool]:
+    """The outermost JSON object in text and whether it was complete.
+
+    Drops code fences and any prose before or after the object.
+    """
+    fenced = _CODE_FENCE_RE.search(text)
+    if fenced and "{" in fenced.group(1):
+        text = fenced.group(1)
+    parser = IncrementalLessonParser(watch={})
+    parser.feed(text)
+    return parser.document(), parser.complete
+
+
+def close_truncated(text: str) -> str:
+    """Cut a truncated JSON document back to its last complete value and close what is still open"""
+    stack: List[str] = []
+    cut, cut_stack = 0, ()
+    in_string = escape = False
+    for i, c in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c == '"':
+            in_string = True
+        elif c == "{" or c == "[":
+            # An array item that never finishes is dropped rather than kept as an empty container,
+            # so only containers opened as object values (or the root) are cut points
+            parent_is_array = bool(stack) and stack[-1] == "]"
+            stack.append("}" if c == "{" else "]")
+            if not parent_is_array:
+                cut, cut_stack = i + 1, tuple(stack)
+        elif c == "}" or c == "]":
+            if stack:
+                stack.pop()
+            cut, cut_stack = i + 1, tuple(stack)
+        elif c == ",":
+            cut, cut_stack = i, tuple(stack)
+    return text[:cut] + "".join(reversed(cut_stack))
+
+
+def _pair_items(items: Any) -> Optional[List[Dict[str, str]]]:
+    """Keep only well-formed {"native", "target"} string pairs"""
+    if not isinstance(items, list):
+        return None
+    return [
+        {"native": item["native"], "target": item["target"]}
+        for item in items
+        if isinstance(item, dict) and isinstance(item.get("native"), str) and isinstance(item.get("target"), str)
+    ]
+
+
+def repair_structure(lesson: Dict[str, Any], repairs: List[str]) -> Dict[str, Any]:
+    vocabulary = _pair_items(lesson.get("vocabulary"))
+    if vocabulary is not None and vocabulary != lesson["vocabulary"]:
+        repairs.append("dropped_malformed_items")
+        lesson["vocabulary"] = vocabulary
+
+    notes = lesson.get("grammar_notes")
+    if notes is None:
+        repairs.append("missing_grammar_notes")
+        lesson["grammar_notes"] = ""
+    elif isinstance(notes, list) and all(isinstance(n, str) for n in notes):
+        repairs.append("joined_grammar_notes")
+        lesson["grammar_notes"] = "\n".join(notes)
+
+    quiz = lesson.get("quiz")
+    if not isinstance(quiz, dict):
+        quiz = lesson["quiz"] = {}
+    for key in ("vocab_matching", "mini_translations"):
+        items = _pair_items(quiz.get(key))
+        if items is not None and items != quiz[key]:
+            repairs.append("dropped_malformed_items")
+            quiz[key] = items
+    if not quiz.get("vocab_matching") and vocabulary:
+        repairs.append("derived_vocab_matching")
+        quiz["vocab_matching"] = [dict(item) for item in vocabulary]
+    return lesson
+
+
+class LessonParsingStats:
+    def __init__(self):
+        self.clean = 0
+        self.repaired = 0
+        self.failed = 0
+        self.repairs: Dict[str, int] = {}
+        self.parse_time = Histogram()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.clean + self.repaired + self.failed
+        return {
+            "parsed_clean": self.clean,
+            "repaired": self.repaired,
+            "failed": self.failed,
+            "salvage_rate": round(self.repaired / (self.repaired + self.failed), 3)
+            if self.repaired + self.failed else 0.0,
+            "failure_rate": round(self.failed / total, 3) if total else 0.0,
+            "repairs": dict(self.repairs),
+            "parse_time": self.parse_time.snapshot(),
+        }
+
+
+lesson_parsing = LessonParsingStats()
+
+
+def _parse(text: str) -> ParsedLesson:
+    try:
+        lesson = _loads(text)
+        if not validate_lesson(lesson):
+            return ParsedLesson(lesson, [])
+    except _DECODE_ERRORS:
+        lesson = None
+
+    repairs: List[str] = []
+    if not isinstance(lesson, dict):
+        try:
+            # The incremental parser decodes keys as it goes, so a bad escape in one fails here
+            document, complete = extract_json_object(text)
+        except _DECODE_ERRORS as e:
+            raise LessonFormatError([f"invalid JSON: {e}"])
+        if not document:
+            raise LessonFormatError(["no JSON object in model output"])
+        if document.strip() != text.strip():
+            repairs.append("stripped_surrounding_text")
+        if not complete:
+            repairs.append("closed_truncated_json")
+            document = close_truncated(document)
+        try:
+            lesson = _loads(document)
+        except _DECODE_ERRORS as e:
+            raise LessonFormatError([f"invalid JSON: {e}"])
+        if not isinstance(lesson, dict):
+            raise LessonFormatError(["lesson: expected object"])
+
+    lesson = repair_structure(lesson, repairs)
+    errors = validate_lesson(lesson)
+    if errors:
+        raise LessonFormatError(errors)
+    return ParsedLesson(lesson, list(dict.fromkeys(repairs)))
+
+
+def parse_lesson(text: str) -> ParsedLesson:
+    """Decode and validate model output, repairing salvageable defects instead of failing.
+
+    Raises LessonFormatError only when no usable lesson can be recovered.
+    """
+    start = time.perf_counter()
+    try:
+        parsed = _parse(text)
+    except LessonFormatError as e:
+        lesson_parsing.failed += 1
+        logger.warning(f"🧩 Unusable lesson from model: {e}")
+        raise
+    finally:
+        lesson_parsing.parse_time.observe(time.perf_counter() - start)
+    if parsed.repairs:
+        lesson_parsing.repaired += 1
+        for repair in parsed.repairs:
+            lesson_parsing.repairs[repair] = lesson_parsing.repairs.get(repair, 0) + 1
+        logger.info(f"🧩 Repaired lesson from model: {', '.join(parsed.repairs)}")
+    else:
+        lesson_parsing.clean += 1
+    return parsed
@@ -0,0 +1,183 @@
+# lesson_stream.py - Incremental parsing of a streamed lesson JSON and SSE framing
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import Histogram
+
+# Paths inside the lesson whose values are emitted as soon as they are complete ("*" = any array index)
+LESSON_STREAM_EVENTS = {
+    ("vocabulary", "*"): "vocabulary",
+    ("grammar_notes",): "grammar_notes",
+    ("quiz", "vocab_matching", "*"): "vocab_matching",
+    ("quiz", "mini_translations", "*"): "mini_translation",
+}
+
+_WHITESPACE = " \t\r\n"
+
+
+class _Frame:
+    __slots__ = ("is_object", "start", "key", "index", "expect")
+
+    def __init__(self, is_object: bool, start: int):
+        self.is_object = is_object
+        self.start = start
+        self.key = None
+        self.index = 0
+        self.expect = "key" if is_object else "value"
+
+    @property
+    def current(self):
+        return self.key if self.is_object else self.index
+
+
+def _matches(pattern: Tuple, path: Tuple) -> bool:
+    if len(pattern) != len(path):
+        return False
+    return all(p == "*" and isinstance(v, int) or p == v for p, v in zip(pattern, path))
+
+
+class IncrementalLessonParser:
+    """Feed model output chunk by chunk; get (event, value) pairs as watched values complete.
+
+    Only structure is tracked while scanning - each completed value is decoded once with json.loads
+    from its slice of the buffer. Anything before the first '{' (e.g. a code fence) is skipped.
+    """
+
+    def __init__(self, watch: Optional[Dict[Tuple, str]] = None):
+        self.watch = watch if watch is not None else LESSON_STREAM_EVENTS
+        self.buffer = ""
+        self.pos = 0
+        self.stack: List[_Frame] = []
+        self.root_start: Optional[int] = None
+        self.root_end: Optional[int] = None
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._string_is_key = False
+        self._primitive_start: Optional[int] = None
+
+    @property
+    def complete(self) -> bool:
+        return self.root_end is not None
+
+    def document(self) -> str:
+        """The raw JSON text of the root object seen so far"""
+        if self.root_start is None:
+            return ""
+        return self.buffer[self.root_start:self.root_end]
+
+    def _value_done(self, start: int, end: int, events: List[Tuple[str, Any]]):
+        if not self.stack:
+            self.root_end = end
+            return
+        path = tuple(frame.current for frame in self.stack)
+        for pattern, event in self.watch.items():
+            if _matches(pattern, path):
+                events.append((event, json.loads(self.buffer[start:end])))
+                break
+        top = self.stack[-1]
+        if top.is_object:
+            top.expect = "comma"
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        events: List[Tuple[str, Any]] = []
+        self.buffer += chunk
+        buffer = self.buffer
+        i = self.pos
+        while i < len(buffer) and self.root_end is None:
+            c = buffer[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._string_is_key:
+                        top = self.stack[-1]
+                        top.key = json.loads(buffer[self._string_start:i + 1])
+                        top.expect = "colon"
+                    else:
+                        self._value_done(self._string_start, i + 1, events)
+                i += 1
+                continue
+
+            if self.root_start is None:
+                if c == "{":
+                    self.root_start = i
+                    self.stack.append(_Frame(True, i))
+                i += 1
+                continue
+
+            if self._primitive_start is not None:
+                if c in _WHITESPACE or c in ",}]":
+                    self._value_done(self._primitive_start, i, events)
+                    self._primitive_start = None
+                else:
+                    i += 1
+                    continue
+
+            if c in _WHITESPACE:
+                pass
+            elif c == '"':
+                top = self.stack[-1]
+                self._in_string = True
+                self._string_start = i
+                self._string_is_key = top.is_object and top.expect == "key"
+            elif c == "{" or c == "[":
+                self.stack.append(_Frame(c == "{", i))
+            elif c == "}" or c == "]":
+                frame = self.stack.pop()
+                self._value_done(frame.start, i + 1, events)
+            elif c == ":":
+                self.stack[-1].expect = "value"
+            elif c == ",":
+                top = self.stack[-1]
+                if top.is_object:
+                    top.expect = "key"
+                else:
+                    top.index += 1
+            else:
+                self._primitive_start = i
+            i += 1
+
+        self.pos = i
+        return events
+
+
+def sse_event(event: str, data: Any) -> str:
+    """Frame one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def lesson_events(lesson: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """The events a complete lesson would have produced while streaming (used for cache hits)"""
+    events: List[Tuple[str, Any]] = [("vocabulary", item) for item in lesson.get("vocabulary", [])]
+    if "grammar_notes" in lesson:
+        events.append(("grammar_notes", lesson["grammar_notes"]))
+    quiz = lesson.get("quiz") or {}
+    events.extend(("vocab_matching", item) for item in quiz.get("vocab_matching", []))
+    events.extend(("mini_translation", item) for item in quiz.get("mini_translations", []))
+    return events
+
+
+class StreamingStats:
+    def __init__(self):
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.time_to_first_vocabulary = Histogram()
+        self.total_time = Histogram()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "streams_started": self.started,
+            "streams_completed": self.completed,
+            "streams_failed": self.failed,
+            "time_to_first_vocabulary": self.time_to_first_vocabulary.snapshot(),
+            "total_time": self.total_time.snapshot(),
+        }
+
+
+lesson_streaming = StreamingStats()
@@ -0,0 +1,285 @@
+# llm_providers.py - Pluggable LLM backends for lesson generation
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional
+
+import httpx
+
+from http_pool import outbound_http
+from metrics import Histogram
+from rate_limiter import outbound_limiter, parse_reset_duration
+
+logger = logging.getLogger(__name__)
+
+# Which backend serves lessons: "openai" (default) or "stub" for offline load tests
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower()
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+
+# Stub backend: latency distribution (ms), error injection and RNG seed
+STUB_LATENCY_DIST = os.getenv("STUB_LATENCY_DIST", "fixed").lower()  # fixed | uniform | normal | lognormal
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "0"))
+STUB_LATENCY_JITTER_MS = float(os.getenv("STUB_LATENCY_JITTER_MS", "0"))
+STUB_ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+STUB_ERROR_STATUS = int(os.getenv("STUB_ERROR_STATUS", "500"))
+STUB_SEED = os.getenv("STUB_SEED")
+
+
+class LLMCompletion(NamedTuple):
+    content: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+class LLMProviderError(Exception):
+    """The provider answered with an error status (rate limit, overload, bad request...)"""
+
+    def __init__(self, status_code: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class LLMProvider:
+    """Chat-completion backend: messages in, lesson JSON text out"""
+
+    name = "base"
+
+    def __init__(self, model: str):
+        self.model = model
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latency = Histogram()
+
+    @property
+    def cache_id(self) -> str:
+        """Identifies what produced a lesson, so lessons from different backends never share cache entries"""
+        return self.model if self.name == "openai" else f"{self.name}:{self.model}"
+
+    async def complete(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> LLMCompletion:
+        raise NotImplementedError
+
+    def stream(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    def _record_usage(self, completion: LLMCompletion) -> LLMCompletion:
+        self.prompt_tokens += completion.prompt_tokens
+        self.completion_tokens += completion.completion_tokens
+        return completion
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "provider": self.name,
+            "model": self.model,
+            "calls": self.calls,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "latency": self.latency.snapshot(),
+        }
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    def __init__(self, model: str = OPENAI_MODEL, base_url: str = OPENAI_BASE_URL):
+        super().__init__(model)
+        self.url = f"{base_url.rstrip('/')}/chat/completions"
+
+    def _payload(self, messages, temperature, max_tokens, stream=False) -> Dict[str, Any]:
+        payload = {
+            "model": self.model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "messages": messages
+        }
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    @staticmethod
+    def _headers() -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}",
+            "Content-Type": "application/json"
+        }
+
+    @staticmethod
+    def _raise_for_status(response: httpx.Response):
+        # Remaining-budget headers come on successes too, so the limiter can slow down before a 429
+        outbound_limiter.observe_headers(response.headers)
+        if response.status_code >= 400:
+            retry_after = parse_reset_duration(response.headers.get("retry-after"))
+            if retry_after is None and response.status_code == 429:
+                retry_after = parse_reset_duration(response.headers.get("x-ratelimit-reset-requests"))
+            raise LLMProviderError(response.status_code, f"OpenAI returned HTTP {response.status_code}",
+                                   retry_after)
+
+    async def complete(self, messages, temperature, max_tokens) -> LLMCompletion:
+        self.calls += 1
+        start = time.time()
+        try:
+            response = await outbound_http.post(self.url, json=self._payload(messages, temperature, max_tokens),
+                                                headers=self._headers())
+            self._raise_for_status(response)
+            body = response.json()
+        except Exception:
+            self.errors += 1
+            raise
+        self.latency.observe(time.time() - start)
+        usage = body.get("usage") or {}
+        return self._record_usage(LLMCompletion(body["choices"][0]["message"]["content"],
+                                                usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)))
+
+    async def stream(self, messages, temperature, max_tokens) -> AsyncIterator[str]:
+        self.calls += 1
+        start = time.time()
+        payload = self._payload(messages, temperature, max_tokens, stream=True)
+        try:
+            async with outbound_http.stream("POST", self.url, json=payload, headers=self._headers()) as response:
+                self._raise_for_status(response)
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+        except Exception:
+            self.errors += 1
+            raise
+        self.latency.observe(time.time() - start)
+
+
+_TRANSLATE_RE = re.compile(r"Translate from '([^']*)' to '([^']*)'")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_FILLER_WORDS = ["hello", "please", "thank you", "water", "table", "friend", "time", "today", "price", "help"]
+
+
+class StubProvider(LLMProvider):
+    """Deterministic offline backend that returns schema-valid lessons.
+
+    The same prompt always yields the same lesson. Latency is drawn from a configurable
+    distribution and a configurable fraction of calls fail, so the full request path can be
+    load-tested without spending API quota.
+    """
+
+    name = "stub"
+
+    def __init__(self, model: str = "stub-v1", latency_dist: str = STUB_LATENCY_DIST,
+                 latency_ms: float = STUB_LATENCY_MS, jitter_ms: float = STUB_LATENCY_JITTER_MS,
+                 error_rate: float = STUB_ERROR_RATE, error_status: int = STUB_ERROR_STATUS,
+                 seed: Optional[int] = int(STUB_SEED) if STUB_SEED else None):
+        super().__init__(model)
+        if latency_dist not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown stub latency distribution: {latency_dist}")
+        self.latency_dist = latency_dist
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._rng = random.Random(seed)
+
+    def sample_latency(self) -> float:
+        """Seconds to wait for one simulated call"""
+        mean, jitter = self.latency_ms, self.jitter_ms
+        if self.latency_dist == "uniform":
+            value = self._rng.uniform(mean - jitter, mean + jitter)
+        elif self.latency_dist == "normal":
+            value = self._rng.gauss(mean, jitter)
+        elif self.latency_dist == "lognormal" and mean > 0:
+            # Parameterized so the distribution's median is latency_ms and jitter_ms widens the tail
+            sigma = jitter / mean if jitter else 0.0
+            value = mean * self._rng.lognormvariate(0.0, sigma)
+        else:
+            value = mean
+        return max(0.0, value) / 1000
+
+    @staticmethod
+    def build_lesson(messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        topic = next((m["content"] for m in messages if m["role"] == "user"), "")
+        match = _TRANSLATE_RE.search(system)
+        native_lang, target_lang = match.groups() if match else ("native", "target")
+        tag = target_lang[:2].lower() or "xx"
+
+        rng = random.Random(hashlib.sha256(topic.encode("utf-8")).hexdigest())
+        words = list(dict.fromkeys(w.lower() for w in _WORD_RE.findall(topic)))
+        words += [w for w in _FILLER_WORDS if w not in words]
+        count = 6 + rng.randrange(3)
+        vocabulary = [{"native": w, "target": f"{w} ({tag})"} for w in words[:count]]
+        sentences = [
+            {"native": f"I would like the {item['native']}.", "target": f"[{tag}] I would like the {item['target']}."}
+            for item in vocabulary[:6]
+        ]
+        return {
+            "vocabulary": vocabulary,
+            "grammar_notes": f"Stub lesson about '{topic.strip()}' from {native_lang} to {target_lang}.",
+            "quiz": {"vocab_matching": [dict(item) for item in vocabulary], "mini_translations": sentences}
+        }
+
+    async def _simulate_call(self, delay: float):
+        await asyncio.sleep(delay)
+        if self.error_rate and self._rng.random() < self.error_rate:
+            raise LLMProviderError(self.error_status, f"Stub provider injected HTTP {self.error_status}")
+
+    async def complete(self, messages, temperature, max_tokens) -> LLMCompletion:
+        self.calls += 1
+        start = time.time()
+        try:
+            await self._simulate_call(self.sample_latency())
+        except LLMProviderError:
+            self.errors += 1
+            raise
+        content = json.dumps(self.build_lesson(messages), ensure_ascii=False)
+        self.latency.observe(time.time() - start)
+        prompt_chars = sum(len(m["content"]) for m in messages)
+        return self._record_usage(LLMCompletion(content, prompt_chars // 4, len(content) // 4))
+
+    async def stream(self, messages, temperature, max_tokens) -> AsyncIterator[str]:
+        self.calls += 1
+        start = time.time()
+        content = json.dumps(self.build_lesson(messages), ensure_ascii=False)
+        chunk_size = 16
+        chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        total_delay = self.sample_latency()
+        try:
+            # Time to first token is a fifth of the latency; the rest is spread over the chunks
+            await self._simulate_call(total_delay / 5)
+        except LLMProviderError:
+            self.errors += 1
+            raise
+        per_chunk = total_delay * 4 / 5 / len(chunks)
+        for chunk in chunks:
+            if per_chunk:
+                await asyncio.sleep(per_chunk)
+            yield chunk
+        self.latency.observe(time.time() - start)
+
+
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "stub": StubProvider,
+}
+
+
+def get_provider(name: str = LLM_PROVIDER) -> LLMProvider:
+    """Instantiate the configured provider"""
+    try:
+        provider_cls = PROVIDERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown LLM_PROVIDER '{name}'; expected one of {sorted(PROVIDERS)}")
+    provider = provider_cls()
+    logger.info(f"🧠 Using LLM provider '{provider.name}' (model={provider.model})")
+    return provider
@@ -0,0 +1,231 @@
+# login_limiter.py - Sliding-window limits on sign-in attempts per email and per client IP
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LOGIN_LIMIT_ENABLED = os.getenv("LOGIN_LIMIT_ENABLED", "true").lower() == "true"
+LOGIN_LIMIT_WINDOW = float(os.getenv("LOGIN_LIMIT_WINDOW", "60"))  # seconds
+LOGIN_LIMIT_PER_EMAIL = int(os.getenv("LOGIN_LIMIT_PER_EMAIL", "10"))  # attempts per window
+LOGIN_LIMIT_PER_IP = int(os.getenv("LOGIN_LIMIT_PER_IP", "50"))
+LOGIN_LIMIT_BACKEND = os.getenv("LOGIN_LIMIT_BACKEND", "memory").lower()  # memory | redis
+LOGIN_LIMIT_MAX_KEYS = int(os.getenv("LOGIN_LIMIT_MAX_KEYS", "100000"))  # emails and IPs counted in memory
+# Proxies in front of the app that append to X-Forwarded-For (1 behind an ALB). With 0 the socket peer
+# is the client: right when clients connect directly, but behind a proxy every client is the proxy.
+LOGIN_LIMIT_TRUSTED_PROXIES = int(os.getenv("LOGIN_LIMIT_TRUSTED_PROXIES", "0"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+class LoginRateLimited(Exception):
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"too many sign-in attempts for this {scope}")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class MemoryWindowBackend:
+    """Exact counts of the current and previous fixed windows per key, in a bounded LRU map.
+
+    Keys untouched for two windows count nothing and are dropped; past max_keys the least
+    recently counted key goes first, so a flood of new keys can only forget old ones, never
+    inflate the count of anyone else.
+    """
+
+    name = "memory"
+
+    def __init__(self, window: float, max_keys: int = LOGIN_LIMIT_MAX_KEYS):
+        self.window = window
+        self.max_keys = max_keys
+        self._counters: "OrderedDict[str, List[int]]" = OrderedDict()  # key -> [window index, previous, current]
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    @staticmethod
+    def _at(counter: Optional[List[int]], index: int) -> Tuple[int, int]:
+        if counter is None or counter[0] < index - 1:
+            return 0, 0
+        if counter[0] == index - 1:
+            return counter[2], 0
+        return counter[1], counter[2]
+
+    def _expire(self, index: int):
+        # Least recently counted first, so the stale keys are all at the front
+        while self._counters:
+            key, counter = next(iter(self._counters.items()))
+            if counter[0] >= index - 1 and len(self._counters) <= self.max_keys:
+                break
+            del self._counters[key]
+            if counter[0] >= index - 1:
+                self.evicted += 1
+
+    def counts(self, keys: List[str], now: float) -> List[Tuple[int, int]]:
+        """(previous window, current window) counts of each key"""
+        index = int(now // self.window)
+        with self._lock:
+            return [self._at(self._counters.get(key), index) for key in keys]
+
+    def add(self, keys: List[str], now: float):
+        index = int(now // self.window)
+        with self._lock:
+            for key in keys:
+                previous, current = self._at(self._counters.pop(key, None), index)
+                self._counters[key] = [index, previous, current + 1]
+            self._expire(index)
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+
+    def keys(self) -> int:
+        return len(self._counters)
+
+
+class RedisWindowBackend:
+    """Exact per-key window counters in Redis, so every replica enforces the same limit"""
+
+    name = "redis"
+    prefix = "lingua:login:"
+    evicted = 0  # keys expire with their window, and Redis has no cap of ours to evict for
+
+    def __init__(self, url: str, window: float):
+        import redis
+        self.window = window
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+
+    def _key(self, key: str, index: int) -> str:
+        return f"{self.prefix}{key}:{index}"
+
+    def counts(self, keys: List[str], now: float) -> List[Tuple[int, int]]:
+        index = int(now // self.window)
+        values = self._redis.mget([self._key(key, i) for key in keys for i in (index - 1, index)])
+        values = [int(v) if v is not None else 0 for v in values]
+        return [(values[2 * n], values[2 * n + 1]) for n in range(len(keys))]
+
+    def add(self, keys: List[str], now: float):
+        index = int(now // self.window)
+        pipe = self._redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.incr(self._key(key, index))
+            # Still needed as the previous window during the next one
+            pipe.expire(self._key(key, index), int(2 * self.window) + 1)
+        pipe.execute()
+
+    def clear(self):
+        for key in self._redis.scan_iter(match=self.prefix + "*"):
+            self._redis.delete(key)
+
+    def keys(self) -> int:
+        return -1  # not worth a SCAN per /metrics call
+
+
+def get_window_backend(name: str = LOGIN_LIMIT_BACKEND, window: float = LOGIN_LIMIT_WINDOW):
+    if name == "redis":
+        try:
+            return RedisWindowBackend(REDIS_URL, window)
+        except ImportError:
+            logger.warning("⚠️ LOGIN_LIMIT_BACKEND=redis but the 'redis' package is not installed; using memory")
+    elif name != "memory":
+        raise ValueError(f"Unknown LOGIN_LIMIT_BACKEND '{name}'; expected 'memory' or 'redis'")
+    return MemoryWindowBackend(window)
+
+
+class LoginLimiter:
+    """Rejects sign-in attempts over the per-email or per-IP limit before any DB or bcrypt work.
+
+    The count over the last `window` seconds is estimated as previous_window * (1 - elapsed) +
+    current_window, where elapsed is the fraction of the current window that has passed.
+    Rejected attempts are not counted, so a blocked client is let back in once its earlier
+    attempts age out, however hard it keeps retrying.
+    """
+
+    def __init__(self, backend=None, window: float = LOGIN_LIMIT_WINDOW, per_email: int = LOGIN_LIMIT_PER_EMAIL,
+                 per_ip: int = LOGIN_LIMIT_PER_IP, enabled: bool = LOGIN_LIMIT_ENABLED):
+        self.backend = backend if backend is not None else get_window_backend(window=window)
+        self.window = window
+        self.per_email = per_email
+        self.per_ip = per_ip
+        self.enabled = enabled
+        self.allowed = 0
+        self.rejected = {"email": 0, "ip": 0}
+        self.backend_errors = 0
+
+    def check(self, email: Optional[str], ip: Optional[str], now: Optional[float] = None):
+        """Count one attempt, or raise LoginRateLimited without counting it"""
+        if not self.enabled:
+            return
+        now = time.time() if now is None else now
+        limits = []
+        if ip:
+            limits.append(("ip", f"ip:{ip}", self.per_ip))
+        if email:
+            limits.append(("email", f"email:{str(email).strip().lower()}", self.per_email))
+        if not limits:
+            return
+        keys = [key for _, key, _ in limits]
+        try:
+            counts = self.backend.counts(keys, now)
+        except Exception as e:
+            # Fail open: a limiter outage must not lock everybody out
+            self.backend_errors += 1
+            logger.warning(f"⚠️ Login limiter unavailable: {e}")
+            return
+
+        elapsed = (now % self.window) / self.window
+        for (scope, _, limit), (previous, current) in zip(limits, counts):
+            if previous * (1 - elapsed) + current >= limit:
+                self.rejected[scope] += 1
+                raise LoginRateLimited(scope, self._retry_after(previous, current, limit, elapsed))
+
+        try:
+            self.backend.add(keys, now)
+        except Exception as e:
+            self.backend_errors += 1
+            logger.warning(f"⚠️ Login limiter unavailable: {e}")
+        self.allowed += 1
+
+    def _retry_after(self, previous: int, current: int, limit: int, elapsed: float) -> float:
+        if current < limit and previous:
+            # Wait for enough of the previous window to slide out
+            needed = 1 - (limit - current) / previous
+            if needed > elapsed:
+                return (needed - elapsed) * self.window
+        return (1 - elapsed) * self.window
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend.name,
+            "window_seconds": self.window,
+            "per_email": self.per_email,
+            "per_ip": self.per_ip,
+            "allowed": self.allowed,
+            "rejected_email": self.rejected["email"],
+            "rejected_ip": self.rejected["ip"],
+            "backend_errors": self.backend_errors,
+            "keys": self.backend.keys(),
+            "evicted": self.backend.evicted,
+        }
+
+
+def client_ip(request, trusted_proxies: int = LOGIN_LIMIT_TRUSTED_PROXIES) -> Optional[str]:
+    """The address the outermost trusted proxy saw the request come from.
+
+    Each proxy appends its peer to X-Forwarded-For, so only the last trusted_proxies entries
+    are trustworthy; anything left of them was sent by the client and may be made up.
+    """
+    if trusted_proxies > 0:
+        forwarded = [entry.strip() for entry in request.headers.get("x-forwarded-for", "").split(",")]
+        forwarded = [entry for entry in forwarded if entry]
+        if forwarded:
+            return forwarded[-min(trusted_proxies, len(forwarded))]
+    return request.client.host if request.client else None
+
+
+login_limiter = LoginLimiter()
@@ -1,29 +1,52 @@
 # main.py - Complete file with 2FA support and database migration
 import os
+import copy
+import base64
+import math
+import asyncio
 import logging
 import json
 import time
 import secrets
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from typing import List, Dict, Any, Optional
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
 from datetime import datetime, timedelta
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from dotenv import load_dotenv
 import httpx
 import bcrypt
 import jwt
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import text
+from sqlalchemy import select, tuple_
 
 # Import our database models
-from database import get_db, create_tables, User, LearningSession, QuestionAttempt, UserProgress, EmailVerificationCode, \
-    engine
+from database import get_async_db, check_database, User, LearningSession, QuestionAttempt, UserProgress, \
+    MistakeAggregate, SessionLocal, AsyncSessionLocal
+from lesson_cache import lesson_cache, lesson_cache_key
+from http_pool import outbound_http, OUTBOUND_READ_TIMEOUT
+from singleflight import SingleFlight
+from llm_providers import get_provider, LLMProviderError
+from rate_limiter import outbound_limiter, RateLimitExceeded
+from lesson_schema import parse_lesson, LessonFormatError, lesson_parsing
+from lesson_jobs import lesson_jobs
+from password_hashing import password_hasher, HashingOverloaded
+from user_cache import user_cache
+from email_outbox import email_outbox
+from verification_codes import verification_codes
+from login_limiter import login_limiter, LoginRateLimited, client_ip
+from attempt_buffer import attempt_buffer, attempt_record, write_attempts, AttemptBufferFull
+from migrations import migration_runner, MIGRATE_ON_STARTUP
+from startup_profile import startup
+from attempt_archive import attempt_archive
+from replica_router import read_router
+from topic_index import topic_index, topic_scope, TOPIC_INDEX_ENABLED
+from lesson_stream import IncrementalLessonParser, sse_event, lesson_events, lesson_streaming
 
 # ─── Setup ──────────────────────────────────────────────
 load_dotenv()
@@ -33,10 +56,55 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Engines and the first connections are set up here, not when main is imported
+    with startup.phase("database"):
+        await check_database()
+    with startup.phase("migrations"):
+        if MIGRATE_ON_STARTUP:
+            await asyncio.to_thread(run_migrations)
+        elif not await asyncio.to_thread(migration_runner.is_current):
+            logger.error("❌ Database schema is behind; run `python migrations.py upgrade`")
+    with startup.phase("services"):
+        # One pooled client for all outbound LLM calls, so connections are reused across lessons
+        await outbound_http.start()
+        if TOPIC_INDEX_ENABLED:
+            # Index stored lessons in the background; until it finishes, near-duplicate lookups just miss
+            asyncio.create_task(asyncio.to_thread(load_topic_index))
+        await lesson_jobs.start(run_lesson_job)
+        await email_outbox.start()
+        await verification_codes.start()
+        await attempt_buffer.start()
+        await attempt_archive.start()
+    startup.ready()
+    yield
+    await attempt_archive.stop()
+    # Buffered quiz attempts are flushed before the database clients go away
+    await attempt_buffer.stop()
+    await verification_codes.stop()
+    await email_outbox.stop()
+    await lesson_jobs.stop()
+    await outbound_http.close()
+    password_hasher.shutdown()
+
+
+def load_topic_index():
+    db = SessionLocal()
+    try:
+        topic_index.load(db)
+    except SQLAlchemyError as e:
+        logger.warning(f"⚠️ Could not load topic index: {e}")
+    finally:
+        db.close()
+
+
 app = FastAPI(
     title="LinguaPersonal API with 2FA",
     version="2.1",
-    timeout_keep_alive=60
+    timeout_keep_alive=60,
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -45,48 +113,36 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 
-# Database migration function
+# Schema migrations run from the lifespan (or `python migrations.py upgrade`), never at import
 def run_migrations():
-    """Run database migrations for existing tables"""
-    try:
-        logger.info("🔄 Running database migrations...")
+    """Bring the schema up to date; a single version query when it already is"""
+    migration_runner.upgrade()
 
-        # Add the two_fa_enabled column if it doesn't exist
-        with engine.connect() as connection:
-            try:
-                connection.execute(
-                    text("ALTER TABLE users ADD COLUMN IF NOT EXISTS two_fa_enabled BOOLEAN DEFAULT TRUE;"))
-                connection.commit()
-                logger.info("✅ Added two_fa_enabled column to users table")
-            except Exception as e:
-                logger.warning(f"⚠️ Column migration warning: {e}")
-
-        logger.info("✅ Database migrations completed")
-
-    except Exception as e:
-        logger.error(f"❌ Migration error: {e}")
-
-
-# Create database tables and run migrations on startup
-create_tables()
-run_migrations()
 
 # JWT Settings
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Email Settings for 2FA
-SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
-SMTP_EMAIL = os.getenv("SMTP_EMAIL")
-SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+# Lesson generation settings
+llm_provider = get_provider()
+LESSON_TEMPERATURE = 0.7
+LESSON_MAX_TOKENS = 2000
+LESSON_PROMPT_VERSION = "1"  # bump whenever the system prompt below changes so cached lessons are not reused
+
+# Quiz settings
+QUIZ_BATCH_MAX_ATTEMPTS = int(os.getenv("QUIZ_BATCH_MAX_ATTEMPTS", "200"))
+MISTAKES_PAGE_MAX = 100
 
 security = HTTPBearer()
 
+# Identical lesson requests that arrive while one is being generated wait for that generation
+lesson_flights = SingleFlight()
+
 
 # ─── Pydantic Models ────────────────────────────────────
 class UserCreate(BaseModel):
@@ -130,20 +186,13 @@ class QuizAttempt(BaseModel):
     is_correct: bool
 
 
-# ─── Email Service ─────────────────────────────────────
-async def send_verification_email(email: str, code: str):
-    """Send verification code via email"""
-    try:
-        if not SMTP_EMAIL or not SMTP_PASSWORD:
-            logger.error("❌ Email credentials not configured")
-            raise HTTPException(status_code=500, detail="Email service not configured")
+class QuizAttemptBatch(BaseModel):
+    attempts: List[QuizAttempt] = Field(min_length=1, max_length=QUIZ_BATCH_MAX_ATTEMPTS)
 
-        msg = MIMEMultipart()
-        msg['From'] = SMTP_EMAIL
-        msg['To'] = email
-        msg['Subject'] = "LinguaPersonal - Login Verification Code"
 
-        body = f"""
+# ─── Email Service ─────────────────────────────────────
+def verification_email_html(code: str) -> str:
+    return f"""
         <html>
         <body style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px;">
             <div style="text-align: center; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 30px; border-radius: 10px; margin-bottom: 20px;">
@@ -180,21 +229,16 @@ async def send_verification_email(email: str, code: str):
             </div>
         </body>
         </html>
-        """
-
-        msg.attach(MIMEText(body, 'html'))
+    """
 
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_EMAIL, SMTP_PASSWORD)
-            text = msg.as_string()
-            server.sendmail(SMTP_EMAIL, email, text)
 
-        logger.info(f"✅ Verification email sent to {email}")
-
-    except Exception as e:
-        logger.error(f"❌ Failed to send email: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to send verification email")
+async def send_verification_email(email: str, code: str, db: AsyncSession):
+    """Queue the verification code email in the caller's transaction; the outbox sender delivers it"""
+    if not email_outbox.configured:
+        logger.error("❌ Email credentials not configured")
+        raise HTTPException(status_code=500, detail="Email service not configured")
+    await db.run_sync(email_outbox.enqueue, email, "LinguaPersonal - Login Verification Code",
+                      verification_email_html(code))
 
 
 def generate_verification_code() -> str:
@@ -215,6 +259,22 @@ def verify_password(password: str, hashed: str) -> bool:
         return False
 
 
+def hashing_busy(e: HashingOverloaded) -> HTTPException:
+    logger.warning(f"🚦 Password hashing overloaded; retry in {e.retry_after:.0f}s")
+    return HTTPException(status_code=503, detail="Too many sign-ins right now. Please retry shortly.",
+                         headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+
+def limit_login_attempt(email: Optional[str], request: Request):
+    """Raise 429 when this email or client IP is over its sign-in limit; run before any DB or bcrypt work"""
+    try:
+        login_limiter.check(email, client_ip(request))
+    except LoginRateLimited as e:
+        logger.warning(f"🚦 Sign-in rate limit hit ({e.scope}) for {email or 'unknown email'}")
+        raise HTTPException(status_code=429, detail="Too many sign-in attempts. Please retry later.",
+                            headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -222,16 +282,62 @@ def create_access_token(data: dict):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+def token_subject(token: str) -> str:
+    payload = user_cache.get_claims(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.PyJWTError:
             raise HTTPException(status_code=401, detail="Invalid token")
-    except jwt.PyJWTError:
+        user_cache.put_claims(token, payload)
+    email: str = payload.get("sub")
+    if email is None:
         raise HTTPException(status_code=401, detail="Invalid token")
+    return email
 
-    user = db.query(User).filter(User.email == email).first()
+
+async def load_current_user(db: AsyncSession, email: str) -> Optional[User]:
+    user = await user_cache.get_user(db, email)
+    if user is None:
+        user = (await db.execute(select(User).where(User.email == email))).scalars().first()
+        if user is not None:
+            await user_cache.put_user(email, user)
+    return user
+
+
+async def get_current_user_async(credentials: HTTPAuthorizationCredentials = Depends(security),
+                                 db: AsyncSession = Depends(get_async_db)) -> AsyncIterator[User]:
+    """The signed-in user for endpoints on the primary, attached to the endpoint's AsyncSession"""
+    email = token_subject(credentials.credentials)
+
+    user = await load_current_user(db, email)
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    try:
+        yield user
+    finally:
+        # Whatever the endpoint wrote, this user's next reads must see it
+        read_router.note_write(email)
+
+
+async def get_read_db(credentials: HTTPAuthorizationCredentials = Depends(security)) -> AsyncIterator[AsyncSession]:
+    """AsyncSession for read-only endpoints: the replica when configured, unless this user just wrote"""
+    async with read_router.session(token_subject(credentials.credentials)) as db:
+        yield db
+
+
+async def get_current_reader(credentials: HTTPAuthorizationCredentials = Depends(security),
+                             db: AsyncSession = Depends(get_read_db)) -> User:
+    """get_current_user_async for read-only endpoints, looked up on the get_read_db session"""
+    email = token_subject(credentials.credentials)
+
+    user = await load_current_user(db, email)
+    if user is None and read_router.is_replica(db):
+        # Signed up after the pin expired but before the replica caught up; the primary has the row
+        async with read_router.primary() as primary:
+            user = await load_current_user(primary, email)
+        if user is not None:
+            user = await db.merge(user, load=False)
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
     return user
@@ -239,19 +345,19 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
 
 # ─── Authentication Endpoints ───────────────────────────
 @app.post("/register", response_model=Token)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
     start_time = time.time()
 
     try:
         # Check if user exists
         logger.info(f"🔍 Checking if user exists: {user_data.email}")
-        existing_user = db.query(User).filter(User.email == user_data.email).first()
+        existing_user = (await db.execute(select(User.id).where(User.email == user_data.email))).first()
         if existing_user:
             raise HTTPException(status_code=400, detail="Email already registered")
 
         # Create new user
         logger.info("🔐 Hashing password...")
-        hashed_password = hash_password(user_data.password)
+        hashed_password = await password_hasher.run(hash_password, user_data.password)
 
         logger.info("👤 Creating new user...")
         new_user = User(
@@ -260,8 +366,8 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
             two_fa_enabled=True  # Enable 2FA by default
         )
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        read_router.note_write(user_data.email)
 
         # Create access token (skip 2FA for registration)
         logger.info("🎟️ Creating access token...")
@@ -274,28 +380,31 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
 
     except HTTPException:
         raise
+    except HashingOverloaded as e:
+        raise hashing_busy(e)
     except SQLAlchemyError as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Database error during registration: {e}")
         raise HTTPException(status_code=500, detail="Database error")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         total_time = time.time() - start_time
         logger.error(f"Registration failed after {total_time:.3f}s: {str(e)}")
         raise HTTPException(status_code=500, detail="Registration failed")
 
 
 @app.post("/login-step1", response_model=LoginStep1Response)
-async def login_step1(user_data: UserLogin, db: Session = Depends(get_db)):
+async def login_step1(user_data: UserLogin, request: Request, db: AsyncSession = Depends(get_async_db)):
     """Step 1: Verify credentials and send 2FA code if needed"""
+    limit_login_attempt(user_data.email, request)
     start_time = time.time()
 
     try:
         logger.info(f"🔍 Login attempt for: {user_data.email}")
 
         # Find user and verify password
-        user = db.query(User).filter(User.email == user_data.email).first()
-        if not user or not verify_password(user_data.password, user.password_hash):
+        user = (await db.execute(select(User).where(User.email == user_data.email))).scalars().first()
+        if not user or not await password_hasher.run(verify_password, user_data.password, user.password_hash):
             logger.warning(f"❌ Invalid credentials for: {user_data.email}")
             raise HTTPException(status_code=401, detail="Invalid credentials")
 
@@ -304,7 +413,7 @@ async def login_step1(user_data: UserLogin, db: Session = Depends(get_db)):
             logger.info("⚡ 2FA disabled, completing login immediately")
             access_token = create_access_token(data={"sub": user_data.email})
             user.last_login = datetime.utcnow()
-            db.commit()
+            await db.commit()
 
             total_time = time.time() - start_time
             logger.info(f"✅ Direct login completed in {total_time:.3f}s")
@@ -319,28 +428,16 @@ async def login_step1(user_data: UserLogin, db: Session = Depends(get_db)):
         # Generate and send verification code
         logger.info("📧 Generating 2FA code...")
         code = generate_verification_code()
-        expires_at = datetime.utcnow() + timedelta(minutes=10)
-
-        # Clean up old codes for this user
-        db.query(EmailVerificationCode).filter(
-            EmailVerificationCode.user_id == user.id,
-            EmailVerificationCode.used == False
-        ).update({"used": True})
-
-        # Create new verification code
-        verification_code = EmailVerificationCode(
-            user_id=user.id,
-            code=code,
-            expires_at=expires_at
-        )
-        db.add(verification_code)
-        db.commit()
+        # The new code supersedes any earlier one, so older codes need no update
+        await db.run_sync(verification_codes.issue, user.id, code)
 
-        # Send email
-        await send_verification_email(user_data.email, code)
+        # Queue the email in the same transaction as the code, then wake the sender
+        await send_verification_email(user_data.email, code, db)
+        await db.commit()
+        email_outbox.notify()
 
         total_time = time.time() - start_time
-        logger.info(f"✅ 2FA code sent in {total_time:.3f}s")
+        logger.info(f"✅ 2FA code queued in {total_time:.3f}s")
 
         return {
             "message": "Verification code sent to your email",
@@ -349,15 +446,17 @@ async def login_step1(user_data: UserLogin, db: Session = Depends(get_db)):
 
     except HTTPException:
         raise
+    except HashingOverloaded as e:
+        raise hashing_busy(e)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         total_time = time.time() - start_time
         logger.error(f"Login step 1 failed after {total_time:.3f}s: {str(e)}")
         raise HTTPException(status_code=500, detail="Login failed")
 
 
 @app.post("/login-step2", response_model=Token)
-async def login_step2(verify_data: VerifyCodeRequest, db: Session = Depends(get_db)):
+async def login_step2(verify_data: VerifyCodeRequest, db: AsyncSession = Depends(get_async_db)):
     """Step 2: Verify the 2FA code and complete login"""
     start_time = time.time()
 
@@ -365,26 +464,17 @@ async def login_step2(verify_data: VerifyCodeRequest, db: Session = Depends(get_
         logger.info(f"🔐 Verifying 2FA code for: {verify_data.email}")
 
         # Find the user
-        user = db.query(User).filter(User.email == verify_data.email).first()
+        user = (await db.execute(select(User).where(User.email == verify_data.email))).scalars().first()
         if not user:
             raise HTTPException(status_code=401, detail="Invalid request")
 
-        # Find valid verification code
-        verification = db.query(EmailVerificationCode).filter(
-            EmailVerificationCode.user_id == user.id,
-            EmailVerificationCode.code == verify_data.code,
-            EmailVerificationCode.used == False,
-            EmailVerificationCode.expires_at > datetime.utcnow()
-        ).first()
-
-        if not verification:
+        # Check and spend the code in one statement
+        if not await db.run_sync(verification_codes.consume, user.id, verify_data.code):
             logger.warning(f"❌ Invalid/expired code for: {verify_data.email}")
             raise HTTPException(status_code=401, detail="Invalid or expired verification code")
 
-        # Mark code as used and update last login
-        verification.used = True
         user.last_login = datetime.utcnow()
-        db.commit()
+        await db.commit()
 
         # Create access token
         access_token = create_access_token(data={"sub": user.email})
@@ -397,7 +487,7 @@ async def login_step2(verify_data: VerifyCodeRequest, db: Session = Depends(get_
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         total_time = time.time() - start_time
         logger.error(f"Login step 2 failed after {total_time:.3f}s: {str(e)}")
         raise HTTPException(status_code=500, detail="Verification failed")
@@ -405,95 +495,85 @@ async def login_step2(verify_data: VerifyCodeRequest, db: Session = Depends(get_
 
 # Legacy login endpoint (redirects to new flow)
 @app.post("/login", response_model=LoginStep1Response)
-async def login_legacy(user_data: UserLogin, db: Session = Depends(get_db)):
+async def login_legacy(user_data: UserLogin, request: Request, db: AsyncSession = Depends(get_async_db)):
     """Legacy login endpoint - now uses 2FA flow"""
-    return await login_step1(user_data, db)
+    return await login_step1(user_data, request, db)
 
 
 # ─── 2FA Management Endpoints ───────────────────────────
 @app.post("/resend-verification-code")
-async def resend_verification_code(email_data: dict, db: Session = Depends(get_db)):
+async def resend_verification_code(email_data: dict, request: Request, db: AsyncSession = Depends(get_async_db)):
     """Resend verification code if the previous one expired"""
+    limit_login_attempt(email_data.get("email"), request)
     try:
         email = email_data.get("email")
         if not email:
             raise HTTPException(status_code=400, detail="Email is required")
 
-        user = db.query(User).filter(User.email == email).first()
+        user = (await db.execute(select(User.id).where(User.email == email))).first()
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
         # Generate new code
         code = generate_verification_code()
-        expires_at = datetime.utcnow() + timedelta(minutes=10)
-
-        # Mark old codes as used
-        db.query(EmailVerificationCode).filter(
-            EmailVerificationCode.user_id == user.id,
-            EmailVerificationCode.used == False
-        ).update({"used": True})
-
-        # Create new code
-        verification_code = EmailVerificationCode(
-            user_id=user.id,
-            code=code,
-            expires_at=expires_at
-        )
-        db.add(verification_code)
-        db.commit()
+        await db.run_sync(verification_codes.issue, user.id, code)
 
-        # Send email
-        await send_verification_email(email, code)
+        # Queue the email in the same transaction as the code, then wake the sender
+        await send_verification_email(email, code, db)
+        await db.commit()
+        email_outbox.notify()
 
-        logger.info(f"✅ Verification code resent to {email}")
+        logger.info(f"✅ Verification code re-queued for {email}")
         return {"message": "New verification code sent"}
 
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Resend verification failed: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to resend code")
 
 
 @app.post("/toggle-2fa")
-async def toggle_2fa(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def toggle_2fa(current_user: User = Depends(get_current_user_async),
+                     db: AsyncSession = Depends(get_async_db)):
     """Enable/disable 2FA for the current user"""
     try:
-        current_user.two_fa_enabled = not current_user.two_fa_enabled
-        db.commit()
-
-        status = "enabled" if current_user.two_fa_enabled else "disabled"
-        logger.info(f"🔧 2FA {status} for user: {current_user.email}")
-        return {"message": f"2FA {status}", "two_fa_enabled": current_user.two_fa_enabled}
+        # The cached user may be stale; toggle what the database holds, with the row locked
+        user = (await db.execute(
+            select(User).where(User.id == current_user.id).with_for_update()
+            .execution_options(populate_existing=True)
+        )).scalars().one()
+        user.two_fa_enabled = not user.two_fa_enabled
+        await db.commit()  # invalidates the cached user
+
+        status = "enabled" if user.two_fa_enabled else "disabled"
+        logger.info(f"🔧 2FA {status} for user: {user.email}")
+        return {"message": f"2FA {status}", "two_fa_enabled": user.two_fa_enabled}
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Toggle 2FA failed: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to update 2FA settings")
 
 
 # ─── Cleanup Endpoint ───────────────────────────────────
 @app.post("/cleanup-expired-codes")
-async def cleanup_expired_codes(db: Session = Depends(get_db)):
-    """Clean up expired verification codes (call this periodically)"""
+async def cleanup_expired_codes():
+    """Clean up expired verification codes now (the background sweeper also does this periodically)"""
     try:
-        deleted_count = db.query(EmailVerificationCode).filter(
-            EmailVerificationCode.expires_at < datetime.utcnow()
-        ).delete()
-
-        db.commit()
+        # Same chunked delete the background sweeper runs
+        deleted_count = await asyncio.to_thread(verification_codes.sweep)
         logger.info(f"🧹 Cleaned up {deleted_count} expired verification codes")
         return {"message": f"Cleaned up {deleted_count} expired codes"}
 
     except Exception as e:
-        db.rollback()
         logger.error(f"Cleanup failed: {str(e)}")
         raise HTTPException(status_code=500, detail="Cleanup failed")
 
 
 # ─── OpenAI Function ────────────────────────────────────
-async def fetch_lesson_from_openai(prompt: str, target_lang: str, native_lang: str) -> Dict[str, Any]:
+def build_lesson_messages(prompt: str, target_lang: str, native_lang: str) -> List[Dict[str, str]]:
     system_prompt = f"""
 You are a helpful Spanish teacher AI. Create a comprehensive lesson based on the user's topic.
 
@@ -532,43 +612,149 @@ IMPORTANT REQUIREMENTS:
 - Each mini_translation should be a complete, useful sentence someone would actually say
 """
 
-    payload = {
-        "model": "gpt-3.5-turbo",
-        "temperature": 0.7,
-        "max_tokens": 2000,
-        "messages": [
-            {"role": "system", "content": system_prompt.strip()},
-            {"role": "user", "content": prompt.strip()}
-        ]
-    }
+    return [
+        {"role": "system", "content": system_prompt.strip()},
+        {"role": "user", "content": prompt.strip()}
+    ]
 
-    headers = {
-        "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}",
-        "Content-Type": "application/json"
-    }
+
+def provider_busy(retry_after: float) -> HTTPException:
+    """503 telling the client when the LLM provider is expected to have capacity again"""
+    return HTTPException(status_code=503, detail="Lesson generation is busy right now. Please retry shortly.",
+                         headers={"Retry-After": str(math.ceil(retry_after))})
+
+
+async def fetch_lesson_from_openai(prompt: str, target_lang: str, native_lang: str) -> Dict[str, Any]:
+    """Generate a lesson with the configured LLM provider (OpenAI unless LLM_PROVIDER says otherwise)"""
+    messages = build_lesson_messages(prompt, target_lang, native_lang)
 
     try:
-        timeout = httpx.Timeout(90.0)
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            logger.info("🤖 Calling OpenAI API...")
-            response = await client.post("https://api.openai.com/v1/chat/completions", json=payload, headers=headers)
-            response.raise_for_status()
-            content = response.json()
-            raw_json = json.loads(content["choices"][0]["message"]["content"])
-            logger.info("✅ OpenAI API call successful")
-            return raw_json
+        async with outbound_limiter.slot():
+            logger.info(f"🤖 Calling {llm_provider.name} LLM provider...")
+            completion = await llm_provider.complete(messages, temperature=LESSON_TEMPERATURE,
+                                                     max_tokens=LESSON_MAX_TOKENS)
+        lesson = parse_lesson(completion.content).lesson
+        logger.info("✅ LLM call successful")
+        return lesson
+    except LessonFormatError:
+        raise HTTPException(status_code=502, detail="Lesson provider returned an unusable lesson. Please try again.")
+    except RateLimitExceeded as e:
+        logger.warning(f"🚦 Rejected lesson generation ({e.reason}); retry in {e.retry_after:.1f}s")
+        raise provider_busy(e.retry_after)
     except httpx.ReadTimeout:
-        logger.error("⏰ Timeout: OpenAI API took longer than 90 seconds.")
+        logger.error(f"⏰ Timeout: LLM provider took longer than {OUTBOUND_READ_TIMEOUT:.0f} seconds.")
         raise HTTPException(status_code=504, detail="OpenAI API is taking too long. Please try again.")
+    except (httpx.ConnectTimeout, httpx.PoolTimeout):
+        logger.error("⏰ Timeout: could not get a connection to the LLM provider.")
+        raise HTTPException(status_code=504, detail="OpenAI API is unavailable right now. Please try again.")
+    except LLMProviderError as e:
+        if e.status_code == 429:
+            outbound_limiter.throttle(e.retry_after)
+            raise provider_busy(outbound_limiter.retry_hint())
+        logger.error(f"💥 LLM provider error: {e}")
+        raise HTTPException(status_code=502, detail="Lesson provider returned an error. Please try again.")
     except Exception as e:
         logger.exception("💥 Unexpected error while fetching lesson")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def stream_lesson_from_openai(prompt: str, target_lang: str, native_lang: str) -> AsyncIterator[str]:
+    """Yield the lesson JSON text as the configured LLM provider streams it"""
+    messages = build_lesson_messages(prompt, target_lang, native_lang)
+    try:
+        async with outbound_limiter.slot():
+            logger.info(f"🤖 Streaming from {llm_provider.name} LLM provider...")
+            async for chunk in llm_provider.stream(messages, temperature=LESSON_TEMPERATURE,
+                                                   max_tokens=LESSON_MAX_TOKENS):
+                yield chunk
+    except LLMProviderError as e:
+        if e.status_code == 429:
+            outbound_limiter.throttle(e.retry_after)
+            raise RateLimitExceeded("provider rate limited", outbound_limiter.retry_hint())
+        raise
+
+
+def find_cached_lesson(db: Session, req: LessonRequest, cache_key: str) -> Optional[Dict[str, Any]]:
+    """Exact cache hit first, then a stored lesson for a near-duplicate topic"""
+    lesson = lesson_cache.get(db, cache_key)
+    if lesson is None and TOPIC_INDEX_ENABLED:
+        match = topic_index.lookup(req.user_prompt, lesson_scope(req))
+        if match is not None and match[0] != cache_key:
+            lesson = lesson_cache.get(db, match[0])
+            if lesson is not None:
+                logger.info(f"🧭 Reusing lesson of a similar topic (similarity {match[1]:.2f})")
+    return lesson
+
+
+def store_generated_lesson(db: Session, req: LessonRequest, cache_key: str, lesson: Dict[str, Any],
+                           generation_ms: int):
+    lesson_cache.put(db, cache_key, lesson, prompt=req.user_prompt, target_lang=req.target_lang,
+                     native_lang=req.native_lang, model=llm_provider.cache_id,
+                     template_version=LESSON_PROMPT_VERSION, generation_ms=generation_ms)
+    if TOPIC_INDEX_ENABLED:
+        topic_index.add(req.user_prompt, lesson_scope(req), cache_key)
+
+
+def lesson_scope(req: LessonRequest):
+    return topic_scope(req.target_lang, req.native_lang, llm_provider.cache_id, LESSON_PROMPT_VERSION)
+
+
+async def timed_lesson_fetch(prompt: str, target_lang: str, native_lang: str):
+    """Fetch a lesson and report how long the LLM round trip took (ms)"""
+    start = time.time()
+    lesson = await fetch_lesson_from_openai(prompt, target_lang, native_lang)
+    return lesson, int((time.time() - start) * 1000)
+
+
+async def generate_and_store_lesson(req: LessonRequest, cache_key: str) -> Dict[str, Any]:
+    """The shared call behind produce_lesson: stores the lesson for whichever requests are still waiting"""
+    generated, generation_ms = await timed_lesson_fetch(req.user_prompt, req.target_lang, req.native_lang)
+    # Its own session: the request that started the call may be gone, and its session closed with it
+    async with AsyncSessionLocal() as db:
+        await db.run_sync(store_generated_lesson, req, cache_key, generated, generation_ms)
+    return generated
+
+
+async def produce_lesson(db: AsyncSession, req: LessonRequest) -> Dict[str, Any]:
+    """A lesson for req that the caller may modify: from the lesson cache, or generated and stored"""
+    # Serve from the lesson cache when the same lesson was generated before
+    cache_key = lesson_cache_key(req.user_prompt, req.target_lang, req.native_lang, llm_provider.cache_id,
+                                 LESSON_PROMPT_VERSION)
+    lesson = await db.run_sync(find_cached_lesson, req, cache_key)
+    if lesson is not None:
+        logger.info(f"⚡ Lesson cache hit for '{req.user_prompt}'")
+        return lesson
+
+    # Call OpenAI once for all concurrent requests with the same cache key
+    generated, is_leader = await lesson_flights.do(cache_key, lambda: generate_and_store_lesson(req, cache_key))
+    if not is_leader:
+        logger.info(f"🔗 Joined in-flight lesson generation for '{req.user_prompt}'")
+    # The generated dict is shared by every coalesced request, so each gets its own copy
+    return copy.deepcopy(generated)
+
+
+async def run_lesson_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Worker side of POST /lesson-jobs: the same work as /generate-lesson, off the request path"""
+    req = LessonRequest(**job["request"])
+    async with AsyncSessionLocal() as db:
+        try:
+            # The session only once there is a lesson for it: a failed attempt leaves nothing behind
+            lesson = await produce_lesson(db, req)
+            session = LearningSession(user_id=job["user_id"], language=req.target_lang, topic=req.user_prompt)
+            db.add(session)
+            await db.commit()
+            lesson["session_id"] = session.id
+            return lesson
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"Database error in lesson job {job['id']}: {e}")
+            raise HTTPException(status_code=500, detail="Database error")
+
+
 # ─── Lesson Generation Endpoint ─────────────────────────
 @app.post("/generate-lesson")
-async def generate_lesson(req: LessonRequest, current_user: User = Depends(get_current_user),
-                          db: Session = Depends(get_db)):
+async def generate_lesson(req: LessonRequest, current_user: User = Depends(get_current_user_async),
+                          db: AsyncSession = Depends(get_async_db)):
     logger.info(f"📚 Lesson request from {current_user.email}: {req.user_prompt}")
     try:
         # Create a learning session
@@ -578,11 +764,9 @@ async def generate_lesson(req: LessonRequest, current_user: User = Depends(get_c
             topic=req.user_prompt
         )
         db.add(session)
-        db.commit()
-        db.refresh(session)
+        await db.commit()
 
-        # Call OpenAI
-        lesson = await fetch_lesson_from_openai(req.user_prompt, req.target_lang, req.native_lang)
+        lesson = await produce_lesson(db, req)
         lesson["session_id"] = session.id
 
         logger.info(f"✅ Lesson generated successfully for session {session.id}")
@@ -595,91 +779,281 @@ async def generate_lesson(req: LessonRequest, current_user: User = Depends(get_c
         raise HTTPException(status_code=500, detail="Lesson generation failed.")
 
 
-# ─── Quiz and Progress Endpoints ────────────────────────
-@app.post("/submit-quiz-attempt")
-def submit_quiz_attempt(attempt: QuizAttempt, current_user: User = Depends(get_current_user),
-                        db: Session = Depends(get_db)):
+@app.post("/generate-lesson/stream")
+async def generate_lesson_stream(req: LessonRequest, current_user: User = Depends(get_current_user_async),
+                                 db: AsyncSession = Depends(get_async_db)):
+    """Server-sent events variant of /generate-lesson: items are sent as soon as the model finishes them"""
+    logger.info(f"📚 Streaming lesson request from {current_user.email}: {req.user_prompt}")
+    start_time = time.time()
+    user_id = current_user.id
+    cache_key = lesson_cache_key(req.user_prompt, req.target_lang, req.native_lang, llm_provider.cache_id,
+                                 LESSON_PROMPT_VERSION)
+    cached = await db.run_sync(find_cached_lesson, req, cache_key)
+
+    async def events():
+        # Runs after the endpoint has returned, when the request's session may be closed already
+        async with AsyncSessionLocal() as stream_db:
+            try:
+                session = LearningSession(
+                    user_id=user_id,
+                    language=req.target_lang,
+                    topic=req.user_prompt
+                )
+                stream_db.add(session)
+                await stream_db.commit()
+            except SQLAlchemyError as e:
+                await stream_db.rollback()
+                logger.error(f"Database error in generate_lesson_stream: {e}")
+                yield sse_event("error", {"detail": "Database error"})
+                return
+
+            session_id = session.id
+            first_vocabulary_seen = False
+            yield sse_event("session", {"session_id": session_id, "cached": cached is not None})
+            try:
+                if cached is not None:
+                    lesson = cached
+                    for event, value in lesson_events(lesson):
+                        yield sse_event(event, value)
+                else:
+                    lesson_streaming.started += 1
+                    parser = IncrementalLessonParser()
+                    async for chunk in stream_lesson_from_openai(req.user_prompt, req.target_lang, req.native_lang):
+                        for event, value in parser.feed(chunk):
+                            if event == "vocabulary" and not first_vocabulary_seen:
+                                first_vocabulary_seen = True
+                                lesson_streaming.time_to_first_vocabulary.observe(time.time() - start_time)
+                            yield sse_event(event, value)
+                    lesson = parse_lesson(parser.buffer).lesson
+                    await stream_db.run_sync(store_generated_lesson, req, cache_key, lesson,
+                                             int((time.time() - start_time) * 1000))
+                    lesson_streaming.completed += 1
+                    lesson_streaming.total_time.observe(time.time() - start_time)
+
+                lesson["session_id"] = session_id
+                yield sse_event("lesson", lesson)
+                logger.info(f"✅ Lesson streamed successfully for session {session_id}")
+            except RateLimitExceeded as e:
+                lesson_streaming.failed += 1
+                logger.warning(f"🚦 Rejected lesson stream ({e.reason}); retry in {e.retry_after:.1f}s")
+                yield sse_event("error", {"detail": "Lesson generation is busy right now. Please retry shortly.",
+                                          "retry_after": math.ceil(e.retry_after)})
+            except Exception as e:
+                lesson_streaming.failed += 1
+                logger.error(f"💥 Lesson streaming failed: {str(e)}")
+                yield sse_event("error", {"detail": "Lesson generation failed."})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# ─── Lesson Job Endpoints ───────────────────────────────
+def lesson_job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    view = {"job_id": job["id"], "status": job["status"], "created_at": job["created_at"].isoformat()}
+    if job["status"] == "done":
+        view["lesson"] = job["result"]
+    elif job["status"] == "failed":
+        view["error"] = {"status_code": job["error_status"], "detail": job["error"]}
+    return view
+
+
+@app.post("/lesson-jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_lesson_job(req: LessonRequest, current_user: User = Depends(get_current_user_async)):
+    """Queue a lesson and return at once; poll GET /lesson-jobs/{job_id} for the result"""
     try:
-        # Verify session belongs to user
-        session = db.query(LearningSession).filter(
-            LearningSession.id == attempt.session_id,
-            LearningSession.user_id == current_user.id
-        ).first()
-
-        if not session:
-            raise HTTPException(status_code=404, detail="Session not found")
-
-        # Save the attempt
-        quiz_attempt = QuestionAttempt(
-            session_id=attempt.session_id,
-            question_text=attempt.question_text,
-            user_answer=attempt.user_answer,
-            correct_answer=attempt.correct_answer,
-            is_correct=attempt.is_correct
+        job = await lesson_jobs.submit(current_user.id, req.model_dump())
+    except SQLAlchemyError as e:
+        logger.error(f"Database error while queueing lesson job: {e}")
+        raise HTTPException(status_code=500, detail="Database error")
+    logger.info(f"📥 Queued lesson job {job['id']} for {current_user.email}: {req.user_prompt}")
+    return {**lesson_job_view(job), "status_url": f"/lesson-jobs/{job['id']}"}
+
+
+@app.get("/lesson-jobs/{job_id}")
+async def get_lesson_job(job_id: str, wait: float = 0, current_user: User = Depends(get_current_user_async),
+                         db: AsyncSession = Depends(get_async_db)):
+    """Job status; with ?wait=N (seconds) the request is held until the job finishes or N runs out"""
+    user_id = current_user.id
+    # Hand the auth lookup's connection back to the pool before a long poll
+    await db.close()
+    job = await (lesson_jobs.wait(job_id, wait) if wait > 0 else lesson_jobs.get(job_id))
+    if job is None or job["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Lesson job not found")
+    return lesson_job_view(job)
+
+
+# ─── Quiz and Progress Endpoints ────────────────────────
+async def record_quiz_attempts(db: AsyncSession, user_id: int, attempts: List[QuizAttempt]) -> int:
+    """Store attempts (from any of the user's sessions) and update progress in one transaction.
+
+    One query checks ownership of every session involved, the attempts go in as one bulk INSERT,
+    and progress is one upsert covering every language. In write-behind mode the attempts are
+    only journaled here and reach the database with the next flush. Returns how many were correct.
+    """
+    session_ids = {attempt.session_id for attempt in attempts}
+    owned = await db.execute(
+        select(LearningSession.id, LearningSession.language).where(
+            LearningSession.id.in_(session_ids),
+            LearningSession.user_id == user_id
         )
-        db.add(quiz_attempt)
-
-        # Update user progress
-        progress = db.query(UserProgress).filter(
-            UserProgress.user_id == current_user.id,
-            UserProgress.language == session.language
-        ).first()
-
-        if not progress:
-            progress = UserProgress(
-                user_id=current_user.id,
-                language=session.language,
-                total_questions=0,
-                correct_answers=0
-            )
-            db.add(progress)
-
-        progress.total_questions += 1
-        if attempt.is_correct:
-            progress.correct_answers += 1
-        progress.last_studied = datetime.utcnow()
-
-        db.commit()
+    )
+    languages = dict(owned.all())
+    if len(languages) != len(session_ids):
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    now = datetime.utcnow()
+    records = [attempt_record(user_id, languages[attempt.session_id], attempt.session_id, attempt.question_text,
+                              attempt.user_answer, attempt.correct_answer, attempt.is_correct, now)
+               for attempt in attempts]
+    correct = sum(attempt.is_correct for attempt in attempts)
+
+    if attempt_buffer.enabled:
+        try:
+            await attempt_buffer.add(records)
+            return correct
+        except AttemptBufferFull as e:
+            logger.warning(f"🚦 Quiz attempt buffer full ({e}); writing directly")
+
+    await db.run_sync(write_attempts, records)
+    await db.commit()
+    return correct
+
+
+@app.post("/submit-quiz-attempts")
+async def submit_quiz_attempts(batch: QuizAttemptBatch, current_user: User = Depends(get_current_user_async),
+                               db: AsyncSession = Depends(get_async_db)):
+    """Record several quiz answers at once, e.g. a whole quiz when it is finished"""
+    try:
+        correct = await record_quiz_attempts(db, current_user.id, batch.attempts)
+        return {"message": "Attempts recorded", "recorded": len(batch.attempts), "correct": correct}
 
+    except HTTPException:
+        raise
+    except SQLAlchemyError as e:
+        await db.rollback()
+        logger.error(f"Database error in submit_quiz_attempts: {e}")
+        raise HTTPException(status_code=500, detail="Database error")
+
+
+@app.post("/submit-quiz-attempt")
+async def submit_quiz_attempt(attempt: QuizAttempt, current_user: User = Depends(get_current_user_async),
+                              db: AsyncSession = Depends(get_async_db)):
+    try:
+        await record_quiz_attempts(db, current_user.id, [attempt])
         return {"message": "Attempt recorded", "is_correct": attempt.is_correct}
 
     except HTTPException:
         raise
     except SQLAlchemyError as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Database error in submit_quiz_attempt: {e}")
         raise HTTPException(status_code=500, detail="Database error")
 
 
 @app.get("/user-progress")
-async def get_user_progress(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_user_progress(current_user: User = Depends(get_current_reader),
+                            db: AsyncSession = Depends(get_read_db)):
     try:
-        progress = db.query(UserProgress).filter(UserProgress.user_id == current_user.id).all()
-        return progress
+        result = await db.execute(select(UserProgress).where(UserProgress.user_id == current_user.id))
+        return result.scalars().all()
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_user_progress: {e}")
         raise HTTPException(status_code=500, detail="Database error")
 
 
+def mistake_position(mistake) -> Tuple[datetime, int]:
+    """(attempt_time, id) of a question_attempts row or of an archived attempt"""
+    if isinstance(mistake, dict):
+        return mistake["attempt_time"], mistake["id"]
+    return mistake.attempt_time, mistake.id
+
+
+def encode_mistakes_cursor(mistake) -> str:
+    attempt_time, attempt_id = mistake_position(mistake)
+    position = json.dumps([attempt_time.isoformat(), attempt_id])
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_mistakes_cursor(cursor: str):
+    try:
+        attempt_time, attempt_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(attempt_time), int(attempt_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @app.get("/user-mistakes")
-async def get_user_mistakes(language: Optional[str] = None, current_user: User = Depends(get_current_user),
-                            db: Session = Depends(get_db)):
+async def get_user_mistakes(response: Response, language: Optional[str] = None,
+                            limit: int = Query(20, ge=1, le=MISTAKES_PAGE_MAX),
+                            cursor: Optional[str] = None,
+                            current_user: User = Depends(get_current_reader),
+                            db: AsyncSession = Depends(get_read_db)):
+    """Newest mistakes first. When there are more, X-Next-Cursor holds the cursor for the next page.
+
+    Keyset pagination on (attempt_time, id): every page is one range scan of
+    idx_attempt_user_mistakes (or the per-language index), however long the history is.
+    Once the table runs out, pages continue into the attempt archive, which keeps each user's
+    files under their own prefix, so only this user's archived months are listed and read.
+    """
     try:
-        query = db.query(QuestionAttempt).join(LearningSession).filter(
-            LearningSession.user_id == current_user.id,
+        query = select(QuestionAttempt).where(
+            QuestionAttempt.user_id == current_user.id,
             QuestionAttempt.is_correct == False
         )
 
+        before = decode_mistakes_cursor(cursor) if cursor else None
         if language:
-            query = query.filter(LearningSession.language == language)
-
-        mistakes = query.limit(20).all()
+            query = query.where(QuestionAttempt.language == language)
+        if before:
+            query = query.where(tuple_(QuestionAttempt.attempt_time, QuestionAttempt.id) < tuple_(*before))
+
+        query = query.order_by(QuestionAttempt.attempt_time.desc(), QuestionAttempt.id.desc()).limit(limit + 1)
+        mistakes = list((await db.execute(query)).scalars().all())
+        if len(mistakes) <= limit and attempt_archive.enabled:
+            archived = await asyncio.to_thread(attempt_archive.mistakes_before, current_user.id, language, before,
+                                               limit + 1)
+            mistakes = sorted(mistakes + archived, key=mistake_position, reverse=True)[:limit + 1]
+        if len(mistakes) > limit:
+            mistakes = mistakes[:limit]
+            response.headers["X-Next-Cursor"] = encode_mistakes_cursor(mistakes[-1])
         return mistakes
     except SQLAlchemyError as e:
         logger.error(f"Database error in get_user_mistakes: {e}")
         raise HTTPException(status_code=500, detail="Database error")
 
 
+@app.get("/weak-items")
+async def get_weak_items(language: Optional[str] = None, limit: int = Query(20, ge=1, le=MISTAKES_PAGE_MAX),
+                         current_user: User = Depends(get_current_reader),
+                         db: AsyncSession = Depends(get_read_db)):
+    """The user's most-missed questions, each counted once, read from the mistake_aggregates rollup"""
+    try:
+        query = select(MistakeAggregate).where(
+            MistakeAggregate.user_id == current_user.id,
+            MistakeAggregate.miss_count > 0
+        )
+        if language:
+            query = query.where(MistakeAggregate.language == language)
+        query = query.order_by(MistakeAggregate.miss_count.desc(), MistakeAggregate.last_seen.desc()).limit(limit)
+
+        items = (await db.execute(query)).scalars().all()
+        return [
+            {
+                "question_text": item.question_text,
+                "correct_answer": item.correct_answer,
+                "language": item.language,
+                "miss_count": item.miss_count,
+                "attempt_count": item.attempt_count,
+                "miss_rate": round(item.miss_count / item.attempt_count, 3),
+                "last_seen": item.last_seen,
+            }
+            for item in items
+        ]
+    except SQLAlchemyError as e:
+        logger.error(f"Database error in get_weak_items: {e}")
+        raise HTTPException(status_code=500, detail="Database error")
+
+
 # ─── Health Check ───────────────────────────────────────
 @app.get("/health")
 async def health_check():
@@ -688,4 +1062,30 @@ async def health_check():
         "timestamp": datetime.utcnow(),
         "features": ["2FA", "email_verification", "quiz_tracking"],
         "version": "2.1"
-    }
\ No newline at end of file
+    }
+
+
+# ─── Metrics ────────────────────────────────────────────
+@app.get("/metrics")
+async def metrics():
+    return {
+        "lesson_cache": lesson_cache.stats(),
+        "outbound_http": outbound_http.stats(),
+        "lesson_coalescing": lesson_flights.stats(),
+        "lesson_streaming": lesson_streaming.stats(),
+        "llm_provider": llm_provider.stats(),
+        "outbound_limiter": outbound_limiter.stats(),
+        "lesson_parsing": lesson_parsing.stats(),
+        "lesson_jobs": await lesson_jobs.stats(),
+        "password_hashing": password_hasher.stats(),
+        "user_cache": user_cache.stats(),
+        "email_outbox": await email_outbox.stats(),
+        "verification_codes": verification_codes.stats(),
+        "login_limiter": login_limiter.stats(),
+        "quiz_attempt_buffer": attempt_buffer.stats(),
+        "read_routing": read_router.stats(),
+        "attempt_archive": attempt_archive.stats(),
+        "schema_migrations": migration_runner.stats(),
+        "startup": startup.stats(),
+        "topic_index": topic_index.stats()
+    }
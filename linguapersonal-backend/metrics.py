@@ -0,0 +1,71 @@
+# metrics.py - Lightweight in-process latency histograms for the /metrics endpoint
+import threading
+from collections import deque
+from typing import Dict, Any, Sequence
+
+# Bucket upper bounds in milliseconds
+DEFAULT_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+# Bucket upper bounds for counts (queue depths, batch sizes)
+DEFAULT_BUCKETS_COUNT = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def _percentile(sorted_samples, q: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    return round(sorted_samples[min(len(sorted_samples) - 1, int(round(q * (len(sorted_samples) - 1))))], 3)
+
+
+class Histogram:
+    """Per-bucket counts plus a bounded window of recent samples for percentiles"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS_MS, window: int = 1024, unit: str = "ms"):
+        self.buckets = tuple(buckets)
+        self.unit = unit
+        self._bucket_counts = [0] * (len(self.buckets) + 1)
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        """Record a duration (stored in milliseconds)"""
+        self.observe_value(seconds * 1000)
+
+    def observe_value(self, value: float):
+        """Record a raw value in this histogram's unit"""
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+            self._recent.append(value)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._bucket_counts[i] += 1
+                    break
+            else:
+                self._bucket_counts[-1] += 1
+
+    def percentile(self, q: float) -> float:
+        with self._lock:
+            samples = sorted(self._recent)
+        return _percentile(samples, q)
+
+    def snapshot(self) -> Dict[str, Any]:
+        unit = self.unit
+        with self._lock:
+            samples = sorted(self._recent)
+            buckets = {f"le_{bound:g}{unit}": count for bound, count in zip(self.buckets, self._bucket_counts)}
+            buckets["le_inf"] = self._bucket_counts[-1]
+            count, total, maximum = self.count, self.total, self.max
+
+        suffix = f"_{unit}" if unit else ""
+        return {
+            "count": count,
+            f"mean{suffix}": round(total / count, 3) if count else 0.0,
+            f"p50{suffix}": _percentile(samples, 0.50),
+            f"p95{suffix}": _percentile(samples, 0.95),
+            f"p99{suffix}": _percentile(samples, 0.99),
+            f"max{suffix}": round(maximum, 3),
+            "buckets": buckets,
+        }
@@ -0,0 +1,374 @@
+# migrations.py - Versioned schema migrations, applied by one process at a time
+"""
+Schema changes are numbered migrations recorded in the schema_version table. Applying them
+takes a lock (a PostgreSQL advisory lock, a lock file next to a SQLite database), so of all
+the processes starting at once only one migrates and the others find the work done. When the
+schema is current, checking costs one SELECT.
+
+Usage:
+    python migrations.py upgrade    # apply pending migrations (the container runs this before uvicorn)
+    python migrations.py status     # applied migrations with their durations, and what is pending
+    python migrations.py check      # exit status 1 while migrations are pending
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Index, Integer, MetaData, String, Table, Text,
+                        func, insert, inspect, select, text)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.orm import Session
+
+from database import SchemaVersion, get_engine
+from mistake_aggregates import backfill_mistake_aggregates
+
+logger = logging.getLogger(__name__)
+
+# Off where a deploy step runs `python migrations.py upgrade`; the app then only checks the version
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "true").lower() == "true"
+MIGRATION_LOCK_ID = 7226351  # pg_advisory_lock key taken by whoever migrates this database
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "5000"))  # rows per backfill transaction
+
+
+class Migration(NamedTuple):
+    version: int
+    name: str
+    apply: Callable[[Connection], None]
+    transactional: bool = True  # False: runs on an autocommit connection and must be safe to re-run
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str, transactional: bool = True):
+    def register(apply: Callable[[Connection], None]):
+        MIGRATIONS.append(Migration(version, name, apply, transactional))
+        return apply
+    return register
+
+
+def _has_column(connection: Connection, table: str, column: str) -> bool:
+    return column in {info["name"] for info in inspect(connection).get_columns(table)}
+
+
+# The tables as they stood when migrations began, frozen here so later model edits never change
+# what migration 1 creates; every schema change since is a migration of its own
+_baseline = MetaData()
+
+Table(
+    "users", _baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("email", String(255), unique=True, index=True),
+    Column("password_hash", String(255)),
+    Column("created_at", DateTime, index=True),
+    Column("last_login", DateTime, index=True),
+    Index("idx_user_email_unique", "email", unique=True),
+    Index("idx_user_last_login", "last_login"),
+)
+
+Table(
+    "email_verification_codes", _baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), index=True),
+    Column("code", String(6)),
+    Column("expires_at", DateTime, index=True),
+    Column("used", Boolean),
+    Column("created_at", DateTime),
+    Index("idx_verification_user_used", "user_id", "used"),
+    Index("idx_verification_expires", "expires_at"),
+)
+
+Table(
+    "learning_sessions", _baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), index=True),
+    Column("language", String(50), index=True),
+    Column("topic", String(500)),
+    Column("started_at", DateTime, index=True),
+    Column("completed_at", DateTime),
+    Index("idx_session_user_lang", "user_id", "language"),
+    Index("idx_session_user_started", "user_id", "started_at"),
+)
+
+Table(
+    "question_attempts", _baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("session_id", Integer, ForeignKey("learning_sessions.id"), index=True),
+    Column("question_text", Text),
+    Column("user_answer", Text),
+    Column("correct_answer", Text),
+    Column("is_correct", Boolean, index=True),
+    Column("attempt_time", DateTime, index=True),
+    Index("idx_attempt_session_correct", "session_id", "is_correct"),
+)
+
+Table(
+    "user_progress", _baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id"), index=True),
+    Column("language", String(50), index=True),
+    Column("total_questions", Integer),
+    Column("correct_answers", Integer),
+    Column("last_studied", DateTime, index=True),
+    Index("idx_progress_user_lang", "user_id", "language", unique=True),
+)
+
+Table(
+    "mistake_aggregates", _baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("language", String(50)),
+    Column("question_key", String(64)),
+    Column("question_text", Text),
+    Column("correct_answer", Text),
+    Column("miss_count", Integer),
+    Column("attempt_count", Integer),
+    Column("last_seen", DateTime),
+    Index("idx_mistake_agg_question", "user_id", "language", "question_key", unique=True),
+    Index("idx_mistake_agg_rank", "user_id", "miss_count", "last_seen"),
+    Index("idx_mistake_agg_lang_rank", "user_id", "language", "miss_count", "last_seen"),
+)
+
+Table(
+    "lesson_cache", _baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("cache_key", String(64), unique=True, index=True),
+    Column("prompt", String(500)),
+    Column("target_lang", String(50)),
+    Column("native_lang", String(50)),
+    Column("model", String(100)),
+    Column("template_version", String(20)),
+    Column("lesson_json", Text),
+    Column("generation_ms", Integer),
+    Column("created_at", DateTime, index=True),
+    Index("idx_lesson_cache_langs", "target_lang", "native_lang"),
+)
+
+Table(
+    "lesson_jobs", _baseline,
+    Column("id", String(36), primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id"), index=True),
+    Column("status", String(20)),
+    Column("request_json", Text),
+    Column("result_json", Text),
+    Column("error", String(500)),
+    Column("error_status", Integer),
+    Column("worker_id", String(100)),
+    Column("attempts", Integer),
+    Column("created_at", DateTime),
+    Column("started_at", DateTime),
+    Column("finished_at", DateTime),
+    Index("idx_lesson_job_status_created", "status", "created_at"),
+)
+
+Table(
+    "email_outbox", _baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("recipient", String(255)),
+    Column("subject", String(255)),
+    Column("html_body", Text),
+    Column("status", String(20)),
+    Column("attempts", Integer),
+    Column("next_attempt_at", DateTime),
+    Column("last_error", String(500)),
+    Column("created_at", DateTime),
+    Column("sent_at", DateTime),
+    Index("idx_email_outbox_status_due", "status", "next_attempt_at"),
+)
+
+
+def _create_index(connection: Connection, name: str, table: str, columns: str):
+    """CREATE INDEX IF NOT EXISTS; CONCURRENTLY on PostgreSQL, so writes go on during the build"""
+    if connection.dialect.name != "postgresql":
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+        return
+    # An interrupted concurrent build leaves an invalid index behind, which IF NOT EXISTS would keep
+    invalid = connection.execute(text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+                                 {"name": name}).scalar()
+    if invalid:
+        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    connection.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+# ─── Migrations (append only; never edit one that has shipped) ─
+@migration(1, "create tables")
+def _create_tables(connection: Connection):
+    _baseline.create_all(bind=connection)  # skips tables a pre-migrations database already has
+
+
+@migration(2, "users.two_fa_enabled")
+def _two_fa_enabled(connection: Connection):
+    if not _has_column(connection, "users", "two_fa_enabled"):
+        connection.execute(text("ALTER TABLE users ADD COLUMN two_fa_enabled BOOLEAN DEFAULT TRUE"))
+
+
+@migration(3, "question_attempts.user_id and language", transactional=False)
+def _attempt_owner(connection: Connection):
+    # Denormalized session owner for the paginated mistakes query. Every statement commits on its
+    # own: the backfill goes in batches and the indexes build without locking out writers
+    if not _has_column(connection, "question_attempts", "user_id"):
+        connection.execute(text("ALTER TABLE question_attempts ADD COLUMN user_id INTEGER REFERENCES users(id)"))
+    if not _has_column(connection, "question_attempts", "language"):
+        connection.execute(text("ALTER TABLE question_attempts ADD COLUMN language VARCHAR(50)"))
+    after = 0
+    while True:
+        # Walk the id order, so attempts without a session to copy from are passed, not retried
+        ids = connection.execute(text(
+            "SELECT id FROM question_attempts WHERE user_id IS NULL AND id > :after ORDER BY id LIMIT :limit"),
+            {"after": after, "limit": MIGRATION_BATCH_SIZE}).scalars().all()
+        if not ids:
+            break
+        connection.execute(text(
+            "UPDATE question_attempts SET user_id = learning_sessions.user_id, "
+            "language = learning_sessions.language FROM learning_sessions "
+            "WHERE question_attempts.session_id = learning_sessions.id AND question_attempts.user_id IS NULL "
+            "AND question_attempts.id BETWEEN :first AND :last"), {"first": ids[0], "last": ids[-1]})
+        after = ids[-1]
+    _create_index(connection, "idx_attempt_user_mistakes", "question_attempts",
+                  "user_id, is_correct, attempt_time, id")
+    _create_index(connection, "idx_attempt_user_lang_mistakes", "question_attempts",
+                  "user_id, language, is_correct, attempt_time, id")
+
+
+@migration(4, "mistake_aggregates backfill")
+def _mistake_aggregates(connection: Connection):
+    # Sessions on the migration's connection: their commits stay inside its transaction
+    backfill_mistake_aggregates(session_factory=lambda: Session(bind=connection))
+
+
+class MigrationRunner:
+    def __init__(self, bind: Optional[Engine] = None, migrations: Optional[List[Migration]] = None):
+        self._engine = bind
+        self.migrations = sorted(migrations or MIGRATIONS, key=lambda m: m.version)
+        self.latest = self.migrations[-1].version
+        self._lock = threading.Lock()  # for databases with neither advisory locks nor a file
+        self.checks = 0
+        self.last_check_ms = 0.0
+        self.applied: List[Dict[str, Any]] = []
+
+    @property
+    def engine(self) -> Engine:
+        return self._engine if self._engine is not None else get_engine()
+
+    def current_version(self) -> int:
+        try:
+            with self.engine.connect() as connection:
+                return connection.execute(select(func.max(SchemaVersion.version))).scalar() or 0
+        except (OperationalError, ProgrammingError):
+            return 0  # no schema_version table: nothing applied yet
+
+    def is_current(self) -> bool:
+        start = time.perf_counter()
+        current = self.current_version() >= self.latest
+        self.checks += 1
+        self.last_check_ms = (time.perf_counter() - start) * 1000
+        return current
+
+    @contextmanager
+    def lock(self):
+        """Held while migrating, so concurrent starters wait instead of migrating twice"""
+        if self.engine.dialect.name == "postgresql":
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_ID})
+                try:
+                    yield
+                finally:
+                    connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_ID})
+        elif self.engine.dialect.name == "sqlite" and self.engine.url.database not in (None, "", ":memory:"):
+            with open(f"{self.engine.url.database}.migrate-lock", "a") as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)  # released when the file closes
+                yield
+        else:
+            with self._lock:
+                yield
+
+    def upgrade(self) -> List[Dict[str, Any]]:
+        """Apply pending migrations, each in its own transaction unless it opts out; returns what this call applied"""
+        if self.is_current():
+            return []
+        applied = []
+        with self.lock():
+            SchemaVersion.__table__.create(bind=self.engine, checkfirst=True)
+            done = self.current_version()  # whoever held the lock before us may have done it all
+            for step in self.migrations:
+                if step.version <= done:
+                    continue
+                logger.info(f"🔄 Applying migration {step.version}: {step.name}")
+                start = time.perf_counter()
+                if step.transactional:
+                    with self.engine.begin() as connection:
+                        step.apply(connection)
+                        duration_ms = self._record(connection, step, start)
+                else:
+                    with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                        step.apply(connection)
+                    with self.engine.begin() as connection:
+                        duration_ms = self._record(connection, step, start)
+                logger.info(f"✅ Migration {step.version} applied in {duration_ms} ms")
+                applied.append({"version": step.version, "name": step.name, "duration_ms": duration_ms})
+        self.applied.extend(applied)
+        return applied
+
+    @staticmethod
+    def _record(connection: Connection, step: Migration, start: float) -> int:
+        duration_ms = round((time.perf_counter() - start) * 1000)
+        connection.execute(insert(SchemaVersion).values(
+            version=step.version, name=step.name, applied_at=datetime.utcnow(), duration_ms=duration_ms))
+        return duration_ms
+
+    def status(self) -> Dict[str, Any]:
+        try:
+            with self.engine.connect() as connection:
+                rows = connection.execute(select(SchemaVersion).order_by(SchemaVersion.version)).mappings().all()
+        except (OperationalError, ProgrammingError):
+            rows = []
+        versions = {row["version"] for row in rows}
+        return {
+            "version": max(versions, default=0),
+            "latest": self.latest,
+            "applied": [{"version": row["version"], "name": row["name"], "duration_ms": row["duration_ms"],
+                         "applied_at": row["applied_at"].isoformat() if row["applied_at"] else None}
+                        for row in rows],
+            "pending": [{"version": m.version, "name": m.name} for m in self.migrations if m.version not in versions],
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "latest": self.latest,
+            "checks": self.checks,
+            "last_check_ms": round(self.last_check_ms, 2),
+            "applied": self.applied,
+        }
+
+
+migration_runner = MigrationRunner()
+
+
+def cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Apply or inspect schema migrations")
+    parser.add_argument("command", nargs="?", default="upgrade", choices=["upgrade", "status", "check"])
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == "upgrade":
+        start = time.perf_counter()
+        applied = migration_runner.upgrade()
+        print(json.dumps({"applied": applied, "seconds": round(time.perf_counter() - start, 3)}, indent=2))
+        return 0
+    if args.command == "status":
+        print(json.dumps(migration_runner.status(), indent=2))
+        return 0
+    return 0 if migration_runner.is_current() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,79 @@
+# mistake_aggregates.py - Incremental per-user, per-question miss counts behind /weak-items
+import hashlib
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, QuestionAttempt, MistakeAggregate
+from lesson_cache import normalize_prompt
+from upsert import increment_upsert
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_CHUNK = 5000
+
+
+def question_key(question_text: str) -> str:
+    """Same key for the same question however it was capitalized, spaced or punctuated"""
+    return hashlib.sha256(normalize_prompt(question_text).encode("utf-8")).hexdigest()
+
+
+def update_mistake_aggregates(db: Session, records: List[Dict[str, Any]]):
+    """Fold attempt records into mistake_aggregates with one upsert (the caller commits)"""
+    rows: Dict[Tuple[int, str, str], Dict[str, Any]] = {}
+    for record in records:
+        key = (record["user_id"], record["language"], question_key(record["question_text"]))
+        row = rows.get(key)
+        if row is None:
+            row = rows[key] = {"user_id": key[0], "language": key[1], "question_key": key[2], "miss_count": 0,
+                               "attempt_count": 0, "last_seen": record["attempt_time"]}
+        row["attempt_count"] += 1
+        row["miss_count"] += not record["is_correct"]
+        # Shown text and answer follow the latest attempt
+        if record["attempt_time"] >= row["last_seen"]:
+            row["last_seen"] = record["attempt_time"]
+            row["question_text"] = record["question_text"]
+            row["correct_answer"] = record["correct_answer"]
+    if not rows:
+        return
+    db.execute(increment_upsert(
+        db.get_bind().dialect.name, MistakeAggregate, list(rows.values()),
+        conflict_columns=["user_id", "language", "question_key"],
+        increments=["miss_count", "attempt_count"],
+        replace=["question_text", "correct_answer"],
+        newest="last_seen"
+    ))
+
+
+def backfill_mistake_aggregates(session_factory=SessionLocal, chunk: int = BACKFILL_CHUNK) -> int:
+    """Build the rollup from existing attempts; does nothing once the table has rows"""
+    db = session_factory()
+    try:
+        if db.execute(select(func.count()).select_from(MistakeAggregate)).scalar():
+            return 0
+        last_id, total = 0, 0
+        while True:
+            attempts = db.execute(
+                select(QuestionAttempt.id, QuestionAttempt.user_id, QuestionAttempt.language,
+                       QuestionAttempt.question_text, QuestionAttempt.correct_answer, QuestionAttempt.is_correct,
+                       QuestionAttempt.attempt_time)
+                .where(QuestionAttempt.id > last_id, QuestionAttempt.user_id.is_not(None))
+                .order_by(QuestionAttempt.id)
+                .limit(chunk)
+            ).mappings().all()
+            if not attempts:
+                break
+            update_mistake_aggregates(db, [
+                {**attempt, "attempt_time": attempt["attempt_time"] or datetime.min} for attempt in attempts
+            ])
+            db.commit()
+            last_id = attempts[-1]["id"]
+            total += len(attempts)
+        if total:
+            logger.info(f"📊 Built mistake aggregates from {total} earlier attempts")
+        return total
+    finally:
+        db.close()
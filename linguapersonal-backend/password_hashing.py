@@ -0,0 +1,98 @@
+# password_hashing.py - Bounded thread pool that keeps bcrypt work off the event loop
+import os
+import math
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# bcrypt releases the GIL while hashing, so threads give real parallelism up to the core count.
+# 0 workers runs hashing inline on the event loop (only useful for comparison benchmarks).
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "64"))  # waiting hashes beyond the busy workers
+
+
+class HashingOverloaded(Exception):
+    """More password hashes are waiting than the queue allows"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("password hashing queue is full")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    def __init__(self, max_workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_QUEUE):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.pending = 0  # running + waiting
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queue_wait = Histogram()
+        self.service_time = Histogram()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def retry_hint(self) -> float:
+        """Seconds until the current backlog should have drained"""
+        mean_seconds = self.service_time.snapshot()["mean_ms"] / 1000 or 0.05
+        return max(1.0, math.ceil(self.pending * mean_seconds / max(1, self.max_workers)))
+
+    @staticmethod
+    def _timed(submitted: float, fn: Callable, args):
+        started = time.perf_counter()
+        result = fn(*args)
+        return result, started - submitted, time.perf_counter() - started
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Run a hashing function in the pool; raises HashingOverloaded instead of queueing without bound"""
+        if self.max_workers <= 0:
+            result, waited, took = self._timed(time.perf_counter(), fn, args)
+        else:
+            if self.pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise HashingOverloaded(self.retry_hint())
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+            try:
+                loop = asyncio.get_running_loop()
+                # Timings are measured in the worker thread but recorded here, on the loop thread
+                result, waited, took = await loop.run_in_executor(self.executor, self._timed, time.perf_counter(),
+                                                                  fn, args)
+            finally:
+                self.pending -= 1
+        self.completed += 1
+        self.queue_wait.observe(waited)
+        self.service_time.observe(took)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.max_workers,
+            "running": min(self.pending, self.max_workers),
+            "queued": max(0, self.pending - self.max_workers),
+            "peak_pending": self.peak_pending,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "queue_wait": self.queue_wait.snapshot(),
+            "service_time": self.service_time.snapshot(),
+        }
+
+
+password_hasher = PasswordHasher()
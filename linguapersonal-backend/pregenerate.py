@@ -0,0 +1,172 @@
+# pregenerate.py - Bulk lesson pre-generation for popular topics
+"""
+Pre-generate lessons into the lesson store so first requests for popular topics are cache reads.
+
+Usage:
+    python pregenerate.py manifest.json --concurrency 8
+    python pregenerate.py manifest.csv --concurrency 8 --failures failed.jsonl
+
+Manifest formats:
+    JSON: {"topics": ["ordering coffee", ...], "language_pairs": [["Spanish", "English"], ...]}
+          (every topic is generated for every (target_lang, native_lang) pair)
+    CSV:  header row topic,target_lang,native_lang followed by one lesson per row
+
+The run is resumable: lessons already in the lesson store are skipped, so re-running after a
+crash only generates what is missing (including anything that failed last time).
+"""
+import os
+import csv
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from typing import List
+
+from fastapi import HTTPException
+
+import main
+from main import LessonRequest, fetch_lesson_from_openai, store_generated_lesson, lesson_cache_key, \
+    LESSON_PROMPT_VERSION
+from database import SessionLocal, CachedLesson
+
+logger = logging.getLogger("pregenerate")
+
+
+def load_manifest(path: str) -> List[LessonRequest]:
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            jobs = [LessonRequest(user_prompt=row["topic"], target_lang=row["target_lang"],
+                                  native_lang=row["native_lang"]) for row in csv.DictReader(f)]
+    else:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        jobs = [LessonRequest(user_prompt=topic, target_lang=target_lang, native_lang=native_lang)
+                for target_lang, native_lang in manifest["language_pairs"]
+                for topic in manifest["topics"]]
+
+    # Drop duplicates that normalize to the same lesson
+    unique = {}
+    for job in jobs:
+        unique.setdefault(job_key(job), job)
+    return list(unique.values())
+
+
+def job_key(job: LessonRequest) -> str:
+    return lesson_cache_key(job.user_prompt, job.target_lang, job.native_lang, main.llm_provider.cache_id,
+                            LESSON_PROMPT_VERSION)
+
+
+def already_stored(keys: List[str], batch_size: int = 500) -> set:
+    db = SessionLocal()
+    try:
+        stored = set()
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            stored.update(key for (key,) in db.query(CachedLesson.cache_key).filter(CachedLesson.cache_key.in_(batch)))
+        return stored
+    finally:
+        db.close()
+
+
+class PregenerationRun:
+    def __init__(self, jobs: List[LessonRequest], concurrency: int, failures_path: str = None):
+        self.jobs = jobs
+        self.concurrency = concurrency
+        self.failures_path = failures_path
+        self.generated = 0
+        self.failed = 0
+        self.skipped = 0
+        self.failures = []
+
+    async def _generate(self, job: LessonRequest):
+        start = time.time()
+        try:
+            lesson = await fetch_lesson_from_openai(job.user_prompt, job.target_lang, job.native_lang)
+        except HTTPException as e:
+            self._fail(job, e.status_code, e.detail)
+            return
+        try:
+            db = SessionLocal()
+            try:
+                store_generated_lesson(db, job, job_key(job), lesson, int((time.time() - start) * 1000))
+            finally:
+                db.close()
+        except Exception as e:
+            # A storage error fails this lesson only; the worker goes on with the queue
+            self._fail(job, None, f"store failed: {e}")
+            return
+        self.generated += 1
+
+    def _fail(self, job: LessonRequest, status, error: str):
+        self.failed += 1
+        self.failures.append({**job.model_dump(), "status": status, "error": error})
+        logger.warning(f"❌ {job.user_prompt} ({job.native_lang}→{job.target_lang}): {error}")
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            job = await queue.get()
+            try:
+                await self._generate(job)
+            finally:
+                queue.task_done()
+            done = self.generated + self.failed
+            if done % 25 == 0:
+                logger.info(f"📦 {done} lessons processed ({self.failed} failed)")
+
+    async def run(self):
+        keys = [job_key(job) for job in self.jobs]
+        stored = already_stored(keys)
+        pending = [job for job, key in zip(self.jobs, keys) if key not in stored]
+        self.skipped = len(self.jobs) - len(pending)
+        logger.info(f"🚀 {len(pending)} lessons to generate, {self.skipped} already stored, "
+                    f"concurrency {self.concurrency}")
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for job in pending:
+            queue.put_nowait(job)
+        tokens_before = (main.llm_provider.prompt_tokens, main.llm_provider.completion_tokens)
+        start = time.time()
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await main.outbound_http.close()
+        elapsed = time.time() - start
+
+        if self.failures_path and self.failures:
+            with open(self.failures_path, "w", encoding="utf-8") as f:
+                for failure in self.failures:
+                    f.write(json.dumps(failure, ensure_ascii=False) + "\n")
+
+        return {
+            "manifest_lessons": len(self.jobs),
+            "skipped_already_stored": self.skipped,
+            "generated": self.generated,
+            "failed": self.failed,
+            "elapsed_seconds": round(elapsed, 2),
+            "lessons_per_second": round(self.generated / elapsed, 2) if elapsed else 0.0,
+            "prompt_tokens": main.llm_provider.prompt_tokens - tokens_before[0],
+            "completion_tokens": main.llm_provider.completion_tokens - tokens_before[1],
+        }
+
+
+def cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Pre-generate lessons into the lesson store")
+    parser.add_argument("manifest", help="JSON (topics x language_pairs) or CSV (topic,target_lang,native_lang)")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("PREGENERATE_CONCURRENCY", "4")))
+    parser.add_argument("--failures", help="write failed lessons to this JSON-lines file")
+    args = parser.parse_args(argv)
+
+    main.run_migrations()
+    jobs = load_manifest(args.manifest)
+    report = asyncio.run(PregenerationRun(jobs, args.concurrency, args.failures).run())
+    print(json.dumps(report, indent=2))
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,235 @@
+# rate_limiter.py - Adaptive outbound limiter with a bounded backpressure queue for LLM calls
+import os
+import re
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Mapping, Optional
+
+from metrics import Histogram, DEFAULT_BUCKETS_COUNT
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_RATE_PER_SECOND = float(os.getenv("OUTBOUND_RATE_PER_SECOND", "10"))  # 0 = no request-rate cap
+OUTBOUND_BURST = int(os.getenv("OUTBOUND_BURST", "20"))
+OUTBOUND_MAX_CONCURRENCY = int(os.getenv("OUTBOUND_MAX_CONCURRENCY", "32"))
+OUTBOUND_MIN_CONCURRENCY = int(os.getenv("OUTBOUND_MIN_CONCURRENCY", "2"))
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "100"))
+OUTBOUND_QUEUE_TIMEOUT = float(os.getenv("OUTBOUND_QUEUE_TIMEOUT", "10"))
+
+_DURATION_PART_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI-style reset durations such as '20ms', '1s', '6m0s' into seconds"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class RateLimitExceeded(Exception):
+    """The wait queue is full or the caller's deadline passed before a slot opened"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """Token bucket on request rate plus an AIMD concurrency cap, fronted by a bounded FIFO queue.
+
+    - The concurrency cap grows by ~1 per cap's worth of successful calls and halves on a 429.
+    - Retry-After and x-ratelimit-* headers pause all new calls until the provider's reset time.
+    - Callers wait in a FIFO queue of at most max_queue entries for at most queue_timeout seconds;
+      beyond that they get RateLimitExceeded immediately instead of piling onto the provider.
+    """
+
+    def __init__(self, rate_per_second: float = OUTBOUND_RATE_PER_SECOND, burst: int = OUTBOUND_BURST,
+                 max_concurrency: int = OUTBOUND_MAX_CONCURRENCY, min_concurrency: int = OUTBOUND_MIN_CONCURRENCY,
+                 max_queue: int = OUTBOUND_QUEUE_SIZE, queue_timeout: float = OUTBOUND_QUEUE_TIMEOUT):
+        self.rate = rate_per_second
+        self.burst = max(1, burst)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min(min_concurrency, max_concurrency)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiters: deque = deque()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.throttled = 0
+        self.peak_queue_depth = 0
+        self.wait_time = Histogram()
+        self.queue_depth = Histogram(buckets=DEFAULT_BUCKETS_COUNT, unit="")
+
+    # ─── Capacity bookkeeping ──────────────────────────
+    def _refill(self, now: float):
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _next_opening(self, now: float) -> Optional[float]:
+        """0 if a call may start now, seconds until one may start, or None if waiting on a release"""
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.in_flight >= int(self.concurrency_limit):
+            return None
+        if self.rate > 0 and self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        return 0.0
+
+    def _admit(self):
+        if self.rate > 0:
+            self._tokens -= 1
+        self.in_flight += 1
+        self.admitted += 1
+
+    def _dispatch(self):
+        """Hand free capacity to queued callers in FIFO order"""
+        now = time.monotonic()
+        self._refill(now)
+        while self._waiters:
+            waiter = self._waiters[0]
+            if waiter.done():
+                self._waiters.popleft()
+                continue
+            delay = self._next_opening(now)
+            if delay is None:
+                return
+            if delay > 0:
+                self._schedule(delay)
+                return
+            self._waiters.popleft()
+            self._admit()
+            waiter.set_result(True)
+
+    def _abandon(self, waiter: asyncio.Future):
+        """Take a caller that stopped waiting out of the queue, so it holds no place in it"""
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass  # already popped by _dispatch
+
+    def _schedule(self, delay: float):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def retry_hint(self) -> float:
+        """Seconds a rejected caller should wait before retrying"""
+        now = time.monotonic()
+        pause = max(0.0, self._paused_until - now)
+        drain = len(self._waiters) / self.rate if self.rate > 0 else 1.0
+        return max(1.0, pause, drain)
+
+    # ─── Public API ────────────────────────────────────
+    async def acquire(self):
+        now = time.monotonic()
+        self._refill(now)
+        if not self._waiters and self._next_opening(now) == 0:
+            self._admit()
+            self.wait_time.observe(0)
+            self.queue_depth.observe_value(0)
+            return
+
+        depth = len(self._waiters)
+        if depth >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise RateLimitExceeded("queue full", self.retry_hint())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queue_depth.observe_value(depth + 1)
+        self.peak_queue_depth = max(self.peak_queue_depth, depth + 1)
+        self._dispatch()
+        try:
+            await asyncio.wait({waiter}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            self._abandon(waiter)
+            raise
+        if not waiter.done():
+            self._abandon(waiter)
+            self.rejected_timeout += 1
+            raise RateLimitExceeded("queue timeout", self.retry_hint())
+        self.wait_time.observe(time.monotonic() - now)
+
+    def release(self, success: Optional[bool] = None):
+        self.in_flight -= 1
+        if success:
+            self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+        if self._waiters:
+            self._dispatch()
+
+    def throttle(self, retry_after: Optional[float] = None):
+        """The provider said 429: back off concurrency and pause until its reset time"""
+        self.throttled += 1
+        self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+        self.pause(retry_after if retry_after is not None else 1.0)
+        logger.warning(f"🚦 LLM provider throttled us; concurrency limit now {int(self.concurrency_limit)}")
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def observe_headers(self, headers: Mapping[str, str]):
+        """Honor x-ratelimit-* headers: stop sending when the remaining budget is exhausted"""
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is not None and remaining.strip() == "0":
+                reset = parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                self.pause(reset if reset is not None else 1.0)
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        success = False
+        try:
+            yield
+            success = True
+        finally:
+            self.release(success)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            "in_flight": self.in_flight,
+            "concurrency_limit": int(self.concurrency_limit),
+            "max_concurrency": self.max_concurrency,
+            "rate_per_second": self.rate,
+            "tokens_available": round(self._tokens, 2),
+            "paused_for_seconds": round(max(0.0, self._paused_until - now), 3),
+            "queue_depth": len(self._waiters),
+            "peak_queue_depth": self.peak_queue_depth,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "throttled_429": self.throttled,
+            "wait_time": self.wait_time.snapshot(),
+            "queue_depth_at_enqueue": self.queue_depth.snapshot(),
+        }
+
+
+outbound_limiter = AdaptiveLimiter()
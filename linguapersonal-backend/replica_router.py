@@ -0,0 +1,144 @@
+# replica_router.py - Route read-only endpoints to the read replica, keeping each user's own writes visible
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, ReplicaAsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+REPLICA_READS_ENABLED = os.getenv("REPLICA_READS_ENABLED", "true").lower() == "true"
+# How long a user's reads stay on the primary after they wrote; must cover the replica's lag
+REPLICA_READ_YOUR_WRITES_SECONDS = float(os.getenv("REPLICA_READ_YOUR_WRITES_SECONDS", "5"))
+REPLICA_RETRY_AFTER = float(os.getenv("REPLICA_RETRY_AFTER", "30"))  # seconds on the primary after a failure
+REPLICA_MAX_PINNED = int(os.getenv("REPLICA_MAX_PINNED", "100000"))
+
+
+def pool_stats(session_factory) -> Optional[Dict[str, Any]]:
+    """Connection pool occupancy of the engine behind a session factory"""
+    if session_factory is None:
+        return None
+    engine = session_factory.kw.get("bind")
+    if engine is None:
+        return None  # not bound yet (init_database() runs in the lifespan)
+    pool = engine.pool
+    stats: Dict[str, Any] = {"url": engine.url.render_as_string(hide_password=True), "pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)  # only QueuePool-style pools count connections
+        if method is not None:
+            stats[name] = method()
+    return stats
+
+
+class ReplicaRouter:
+    """Picks the primary or the replica for a read-only request.
+
+    Reads go to the replica unless the user wrote within the last
+    REPLICA_READ_YOUR_WRITES_SECONDS (their change may not have replicated yet), or the
+    replica recently failed. A replica that can't hand out a connection sends reads to the
+    primary for REPLICA_RETRY_AFTER seconds. Recent writers are remembered per process, so
+    with several workers read-your-writes holds for requests served by the same worker
+    only; keep the window above the replica's lag either way.
+    """
+
+    def __init__(self, primary=AsyncSessionLocal, replica=ReplicaAsyncSessionLocal,
+                 enabled: bool = REPLICA_READS_ENABLED, pin_seconds: float = REPLICA_READ_YOUR_WRITES_SECONDS,
+                 retry_after: float = REPLICA_RETRY_AFTER, max_pinned: int = REPLICA_MAX_PINNED):
+        self.primary = primary
+        self.replica = replica
+        self.enabled = enabled
+        self.pin_seconds = pin_seconds
+        self.retry_after = retry_after
+        self.max_pinned = max_pinned
+        self._pinned: "OrderedDict[str, float]" = OrderedDict()  # subject -> monotonic time the pin ends
+        self._lock = threading.Lock()
+        self._replica_down_until = 0.0
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self.pinned_reads = 0
+        self.replica_failures = 0
+
+    # ─── Read-your-writes ──────────────────────────────
+    def note_write(self, subject: str, now: Optional[float] = None):
+        """Keep this user's reads on the primary until their write has reached the replica"""
+        if self.replica is None:
+            return
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._pinned[subject] = now + self.pin_seconds
+            self._pinned.move_to_end(subject)
+            # Insertion order is expiry order, so anything expired or over the cap sits at the front
+            while self._pinned and (len(self._pinned) > self.max_pinned or next(iter(self._pinned.values())) <= now):
+                self._pinned.popitem(last=False)
+
+    def pinned(self, subject: str, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            until = self._pinned.get(subject)
+            return until is not None and until > now
+
+    def replica_available(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        return self.enabled and self.replica is not None and now >= self._replica_down_until
+
+    # ─── Sessions ──────────────────────────────────────
+    async def _replica_session(self) -> Optional[AsyncSession]:
+        session = self.replica()
+        try:
+            await session.connection()  # checks a connection out now, so a dead replica fails here
+            return session
+        except (SQLAlchemyError, OSError) as e:
+            await session.close()
+            self.replica_failures += 1
+            self._replica_down_until = time.monotonic() + self.retry_after
+            logger.warning(f"⚠️ Read replica unavailable, reading from the primary for {self.retry_after:.0f}s: {e}")
+            return None
+
+    @asynccontextmanager
+    async def session(self, subject: Optional[str]) -> AsyncIterator[AsyncSession]:
+        """An AsyncSession for a read-only request made by subject (the token's email)"""
+        session = None
+        if self.replica_available():
+            if subject is not None and self.pinned(subject):
+                self.pinned_reads += 1
+            else:
+                session = await self._replica_session()
+        if session is None:
+            session = self.primary()
+            self.primary_reads += 1
+        else:
+            self.replica_reads += 1
+        try:
+            yield session
+        finally:
+            await session.close()
+
+    def is_replica(self, session: AsyncSession) -> bool:
+        return self.replica is not None and session.bind is self.replica.kw.get("bind")
+
+    def clear(self):
+        with self._lock:
+            self._pinned.clear()
+        self._replica_down_until = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled and self.replica is not None,
+            "replica_available": self.replica_available(),
+            "replica_reads": self.replica_reads,
+            "primary_reads": self.primary_reads,
+            "pinned_reads": self.pinned_reads,
+            "replica_failures": self.replica_failures,
+            "pinned_users": len(self._pinned),
+            "pools": {"primary": pool_stats(self.primary), "replica": pool_stats(self.replica)},
+        }
+
+
+read_router = ReplicaRouter()
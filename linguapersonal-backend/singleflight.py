@@ -0,0 +1,78 @@
+# singleflight.py - Coalesce identical in-flight async calls into one
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Concurrent callers with the same key share one execution of the underlying call.
+
+    The first caller (the leader) starts the call as its own task; later callers wait on it.
+    Results and exceptions fan out to every waiter. A waiter that is cancelled only stops
+    waiting - the shared call is cancelled when its last waiter goes away.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.merged = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.peak_waiters = 0
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _finished(self, key: str, flight: _Flight):
+        self._forget(key, flight)
+        if not flight.task.cancelled() and flight.task.exception() is not None:
+            self.failures += 1
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Run fn once per key; returns (result, is_leader). The result object is shared between waiters."""
+        flight = self._flights.get(key)
+        is_leader = flight is None
+        if is_leader:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            flight.task.add_done_callback(lambda _: self._finished(key, flight))
+            self._flights[key] = flight
+            self.leaders += 1
+        else:
+            self.merged += 1
+
+        flight.waiters += 1
+        self.peak_waiters = max(self.peak_waiters, flight.waiters)
+        try:
+            return await asyncio.shield(flight.task), is_leader
+        except asyncio.CancelledError:
+            if not flight.task.done() and flight.waiters == 1:
+                # Nobody else is waiting: stop the shared call and let the next caller start afresh
+                self.cancelled += 1
+                self._forget(key, flight)
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self.leaders + self.merged
+        return {
+            "in_flight": len(self._flights),
+            "leader_calls": self.leaders,
+            "merged_calls": self.merged,
+            "merge_ratio": round(self.merged / calls, 4) if calls else 0.0,
+            "peak_waiters": self.peak_waiters,
+            "failures": self.failures,
+            "cancelled": self.cancelled,
+        }
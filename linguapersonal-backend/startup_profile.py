@@ -0,0 +1,149 @@
+# startup_profile.py - Where cold start time goes: per-module import cost and lifespan init phases
+"""
+The lifespan records how long each init phase took (GET /metrics -> startup). This script
+breaks a cold start down further: it starts a fresh interpreter under `python -X importtime`,
+imports main, runs the lifespan up to the point the app would serve, and reports the slowest
+imports, the phases and the total.
+
+Usage:
+    python startup_profile.py                   # report for this environment (DATABASE_URL etc.)
+    python startup_profile.py --budget-ms 2000  # exit status 1 when startup takes longer
+    python startup_profile.py --json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+# Optional subsystems that must only be imported on first use, never by `import main`
+# (zstandard isn't listed: httpx imports it for its response decoders when installed)
+LAZY_MODULES = ("spacy", "gtts", "openai", "redis", "boto3", "smtplib")
+
+_CHILD = """
+import json, time, asyncio
+start = time.perf_counter()
+import main
+import_ms = (time.perf_counter() - start) * 1000
+from startup_profile import startup
+
+async def boot():
+    async with main.app.router.lifespan_context(main.app):
+        pass
+
+asyncio.run(boot())
+print(json.dumps({"import_ms": import_ms, **startup.stats()}))
+"""
+
+
+def _process_age() -> Optional[float]:
+    """Seconds since this process started (Linux), so a report covers interpreter startup too"""
+    try:
+        with open("/proc/self/stat") as f:
+            started_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - started_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupProfile:
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.ready_after: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - start
+
+    def ready(self):
+        """Called when the lifespan hands over to serving"""
+        self.ready_after = _process_age()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+            "ready_after_process_start_ms": round(self.ready_after * 1000) if self.ready_after is not None else None,
+        }
+
+
+startup = StartupProfile()
+
+
+def parse_importtime(output: str, root: str = "main") -> Dict[str, Any]:
+    """Cumulative milliseconds of every module root imported directly, plus all module names seen"""
+    children: List[Dict[str, Any]] = []
+    pending: List[Dict[str, Any]] = []
+    modules = set()
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, field = line.split("|", 2)
+        name = field[1:].lstrip()
+        depth = (len(field) - 1 - len(name)) // 2
+        modules.add(name.strip())
+        if depth == 0:
+            # Children print before their parent; keep them only if the parent is root
+            if name.strip() == root:
+                children = pending
+            pending = []
+        elif depth == 1:
+            pending.append({"module": name.strip(), "ms": int(cumulative) / 1000})
+    children.sort(key=lambda child: child["ms"], reverse=True)
+    return {"imports": children, "modules": modules}
+
+
+def profile_startup(env: Optional[Dict[str, str]] = None, top: int = 15) -> Dict[str, Any]:
+    """Cold-start a fresh interpreter and report where its time went"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", _CHILD], env=env, capture_output=True,
+                            text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"startup failed:\n{result.stderr[-4000:]}")
+    child = json.loads(result.stdout.strip().splitlines()[-1])
+    imports = parse_importtime(result.stderr)
+    return {
+        "import_ms": round(child["import_ms"], 1),
+        "imports": imports["imports"][:top],
+        "phases_ms": child["phases_ms"],
+        "total_ms": round(child["import_ms"] + sum(child["phases_ms"].values()), 1),
+        "ready_after_process_start_ms": child["ready_after_process_start_ms"],
+        "lazy_modules_imported": sorted(module for module in LAZY_MODULES if module in imports["modules"]),
+    }
+
+
+def cli(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Break down cold start time of the API")
+    parser.add_argument("--budget-ms", type=float, help="exit with status 1 when import + init takes longer")
+    parser.add_argument("--top", type=int, default=15, help="slowest direct imports of main to list")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args(argv)
+
+    report = profile_startup(top=args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"{'import main':<40} {report['import_ms']:>9.1f} ms")
+        for entry in report["imports"]:
+            print(f"  {entry['module']:<38} {entry['ms']:>9.1f}")
+        print("lifespan")
+        for name, ms in report["phases_ms"].items():
+            print(f"  {name:<38} {ms:>9.1f}")
+        print(f"{'total':<40} {report['total_ms']:>9.1f} ms")
+        if report["ready_after_process_start_ms"] is not None:
+            print(f"{'ready after process start':<40} {report['ready_after_process_start_ms']:>9.0f} ms")
+        if report["lazy_modules_imported"]:
+            print(f"⚠️ imported at startup but meant to load lazily: {', '.join(report['lazy_modules_imported'])}")
+    over_budget = args.budget_ms is not None and report["total_ms"] > args.budget_ms
+    return 1 if over_budget or report["lazy_modules_imported"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,189 @@
+# topic_index.py - MinHash/LSH index for reusing lessons across near-duplicate topics
+import os
+import re
+import time
+import struct
+import hashlib
+import logging
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import CachedLesson
+from lesson_cache import normalize_prompt
+
+logger = logging.getLogger(__name__)
+
+TOPIC_INDEX_ENABLED = os.getenv("TOPIC_INDEX_ENABLED", "true").lower() == "true"
+TOPIC_SIMILARITY_THRESHOLD = float(os.getenv("TOPIC_SIMILARITY_THRESHOLD", "0.85"))
+
+# Words that carry no topic meaning ("how to order a coffee" == "ordering coffee")
+_STOPWORDS = frozenset("""
+a an the at in on to of for from with about into by and or my your our their his her its some any
+i me we you they it is are be am do does can could would should will shall how what when where which
+want need like please let lets learn learning lesson practice talking talk say saying
+""".split())
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_SUFFIXES = ("ing", "ed", "es", "s")
+
+
+def canonical_topic(prompt: str) -> str:
+    """Accent-free, stopword-free, lightly stemmed, order-independent form of a topic"""
+    text = unicodedata.normalize("NFKD", normalize_prompt(prompt))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    stems = set()
+    for token in _TOKEN_RE.findall(text):
+        if token in _STOPWORDS:
+            continue
+        for suffix in _SUFFIXES:
+            if len(token) > len(suffix) + 3 and token.endswith(suffix):
+                token = token[:-len(suffix)]
+                break
+        stems.add(token)
+    return " ".join(sorted(stems))
+
+
+def shingles(canonical: str, n: int = 3) -> set:
+    padded = f" {canonical} "
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class TopicIndex:
+    """Character n-gram MinHash signatures bucketed with LSH bands.
+
+    Candidates from the LSH buckets are verified with the exact Jaccard similarity of their
+    shingle sets, so the threshold is applied to the real similarity, not the estimate.
+    Entries are partitioned by scope (language pair, model, prompt version).
+    """
+
+    def __init__(self, threshold: float = TOPIC_SIMILARITY_THRESHOLD, num_perm: int = 32, bands: int = 8):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._unpack = struct.Struct(f"<{num_perm}I").unpack
+        self._digest_size = num_perm * 4
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple, List[int]] = {}
+        self._exact: Dict[Tuple, int] = {}
+        self._canonical: List[str] = []
+        self._keys: List[str] = []
+        self.lookups = 0
+        self.matches = 0
+        self.exact_matches = 0
+        self.candidates_checked = 0
+        self.lookup_seconds = 0.0
+
+    def signature(self, shingle_set: set) -> List[int]:
+        # Each 32-bit word of one SHAKE digest acts as an independent hash function,
+        # so the per-function minimum is taken column-wise in C instead of in a Python loop
+        unpack, size = self._unpack, self._digest_size
+        rows = [unpack(hashlib.shake_128(s.encode("utf-8")).digest(size)) for s in shingle_set]
+        return list(map(min, zip(*rows)))
+
+    def _band_keys(self, scope: Tuple, signature: List[int]):
+        rows = self.rows
+        return [(scope, band, tuple(signature[band * rows:(band + 1) * rows])) for band in range(self.bands)]
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, topic: str, scope: Tuple, cache_key: str):
+        canonical = canonical_topic(topic)
+        if not canonical:
+            return
+        band_keys = self._band_keys(scope, self.signature(shingles(canonical)))
+        with self._lock:
+            if (scope, canonical) in self._exact:
+                return
+            entry_id = len(self._keys)
+            self._keys.append(cache_key)
+            self._canonical.append(canonical)
+            self._exact[(scope, canonical)] = entry_id
+            for band_key in band_keys:
+                self._buckets.setdefault(band_key, []).append(entry_id)
+
+    def lookup(self, topic: str, scope: Tuple) -> Optional[Tuple[str, float]]:
+        """Best (cache_key, similarity) at or above the threshold, or None"""
+        start = time.perf_counter()
+        try:
+            canonical = canonical_topic(topic)
+            if not canonical:
+                return None
+            with self._lock:
+                self.lookups += 1
+                entry_id = self._exact.get((scope, canonical))
+                if entry_id is not None:
+                    self.matches += 1
+                    self.exact_matches += 1
+                    return self._keys[entry_id], 1.0
+
+            query = shingles(canonical)
+            band_keys = self._band_keys(scope, self.signature(query))
+            with self._lock:
+                candidates = set()
+                for band_key in band_keys:
+                    candidates.update(self._buckets.get(band_key, ()))
+                scored = [(self._canonical[c], self._keys[c]) for c in candidates]
+                self.candidates_checked += len(scored)
+
+            best = None
+            for candidate, cache_key in scored:
+                similarity = jaccard(query, shingles(candidate))
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (cache_key, similarity)
+            if best is not None:
+                with self._lock:
+                    self.matches += 1
+            return best
+        finally:
+            self.lookup_seconds += time.perf_counter() - start
+
+    def load(self, db: Session, batch_size: int = 1000) -> int:
+        """Index every stored lesson; returns the number of topics indexed"""
+        loaded = 0
+        rows = db.query(CachedLesson.prompt, CachedLesson.target_lang, CachedLesson.native_lang,
+                        CachedLesson.model, CachedLesson.template_version, CachedLesson.cache_key
+                        ).yield_per(batch_size)
+        for row in rows:
+            self.add(row.prompt, topic_scope(row.target_lang, row.native_lang, row.model, row.template_version),
+                     row.cache_key)
+            loaded += 1
+        logger.info(f"🧭 Topic index loaded {loaded} stored lessons")
+        return loaded
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+            self._exact.clear()
+            self._canonical.clear()
+            self._keys.clear()
+
+    def stats(self):
+        return {
+            "entries": len(self._keys),
+            "threshold": self.threshold,
+            "lookups": self.lookups,
+            "matches": self.matches,
+            "exact_canonical_matches": self.exact_matches,
+            "candidates_checked": self.candidates_checked,
+            "mean_lookup_us": round(self.lookup_seconds / self.lookups * 1e6, 1) if self.lookups else 0.0,
+        }
+
+
+def topic_scope(target_lang: str, native_lang: str, model: str, template_version: str) -> Tuple:
+    return target_lang.strip().casefold(), native_lang.strip().casefold(), model, template_version
+
+
+topic_index = TopicIndex()
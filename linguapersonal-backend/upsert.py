@@ -0,0 +1,42 @@
+# upsert.py - Single-statement INSERT ... ON CONFLICT DO UPDATE for counter rows (PostgreSQL, SQLite)
+from importlib import import_module
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import case, or_
+
+# Both dialects spell ON CONFLICT the same way; SQLite (3.24+) is what the tests run on.
+# Only the dialect in use gets imported, on the first upsert.
+_DIALECTS = {
+    "postgresql": "sqlalchemy.dialects.postgresql",
+    "sqlite": "sqlalchemy.dialects.sqlite",
+}
+
+
+def increment_upsert(dialect_name: str, model, rows: List[Dict[str, Any]], conflict_columns: Sequence[str],
+                     increments: Iterable[str], replace: Iterable[str] = (), newest: Optional[str] = None):
+    """Insert rows, or add their `increments` columns onto the existing row with the same conflict key.
+
+    The addition happens in the database, so concurrent callers never lose each other's
+    increments and never race on the unique constraint. `replace` columns are overwritten, or,
+    given a `newest` timestamp column, only by rows at least as new as the stored one; that
+    column itself only moves forward, so late or replayed batches can't roll it back.
+    Each conflict key may appear only once in rows (PostgreSQL rejects a row updated twice).
+    Rows are written in conflict key order, so concurrent batches lock shared keys in the same
+    order and can't deadlock on PostgreSQL.
+    """
+    try:
+        module = _DIALECTS[dialect_name]
+    except KeyError:
+        raise NotImplementedError(f"No upsert support for the '{dialect_name}' dialect")
+    insert = import_module(module).insert
+    stmt = insert(model).values(sorted(rows, key=lambda row: tuple(row[column] for column in conflict_columns)))
+    table = model.__table__
+    set_ = {column: table.c[column] + stmt.excluded[column] for column in increments}
+    if newest is None:
+        set_.update({column: stmt.excluded[column] for column in replace})
+    else:
+        # GREATEST(stored, incoming), spelled so both dialects run it
+        is_newer = or_(table.c[newest].is_(None), stmt.excluded[newest] >= table.c[newest])
+        set_.update({column: case((is_newer, stmt.excluded[column]), else_=table.c[column])
+                     for column in [*replace, newest]})
+    return stmt.on_conflict_do_update(index_elements=list(conflict_columns), set_=set_)
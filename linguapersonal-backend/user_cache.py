@@ -0,0 +1,300 @@
+# user_cache.py - TTL cache of decoded tokens and the users they resolve to (get_current_user_async)
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from database import User
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_ENABLED = os.getenv("USER_CACHE_ENABLED", "true").lower() == "true"
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+USER_CACHE_BACKEND = os.getenv("USER_CACHE_BACKEND", "memory").lower()  # memory | redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Credentials stay out of the cache (and out of Redis); sign-in reads them from the database
+_CREDENTIAL_COLUMNS = {"password_hash"}
+_USER_COLUMNS = [column.key for column in sa_inspect(User).column_attrs if column.key not in _CREDENTIAL_COLUMNS]
+_DATETIME_COLUMNS = {"created_at", "last_login"}
+
+
+def user_snapshot(user: User) -> Dict[str, Any]:
+    """Column values of a user except credentials, JSON-serializable so a shared backend can store them"""
+    snapshot = {}
+    for key in _USER_COLUMNS:
+        value = getattr(user, key)
+        snapshot[key] = value.isoformat() if isinstance(value, datetime) else value
+    return snapshot
+
+
+def user_from_snapshot(snapshot: Dict[str, Any]) -> User:
+    values = {key: datetime.fromisoformat(value) if key in _DATETIME_COLUMNS and value else value
+              for key, value in snapshot.items()}
+    user = User(**values)
+    # Detached with an identity, so Session.merge(load=False) can attach it without a SELECT
+    make_transient_to_detached(user)
+    return user
+
+
+class _TTLStore:
+    """Bounded LRU whose entries expire; shared by the token map and the memory user backend"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class MemoryUserBackend:
+    name = "memory"
+    blocking = False
+
+    def __init__(self, max_entries: int):
+        self._store = _TTLStore(max_entries)
+
+    def get(self, subject: str) -> Optional[Dict[str, Any]]:
+        return self._store.get(subject)
+
+    def set(self, subject: str, snapshot: Dict[str, Any], ttl: float):
+        self._store.set(subject, snapshot, ttl)
+
+    def delete(self, subject: str):
+        self._store.delete(subject)
+
+    def clear(self):
+        self._store.clear()
+
+    def size(self) -> int:
+        return len(self._store)
+
+
+class RedisUserBackend:
+    """Users cached in Redis, so an invalidation on one replica is seen by all of them"""
+
+    name = "redis"
+    prefix = "lingua:user:"
+    blocking = True  # a network round trip: UserCache keeps it off the event loop
+
+    def __init__(self, url: str):
+        import redis
+        self._redis = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+
+    def get(self, subject: str) -> Optional[Dict[str, Any]]:
+        raw = self._redis.get(self.prefix + subject)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, subject: str, snapshot: Dict[str, Any], ttl: float):
+        self._redis.set(self.prefix + subject, json.dumps(snapshot), px=int(ttl * 1000))
+
+    def delete(self, subject: str):
+        self._redis.delete(self.prefix + subject)
+
+    def clear(self):
+        for key in self._redis.scan_iter(match=self.prefix + "*"):
+            self._redis.delete(key)
+
+    def size(self) -> int:
+        return -1
+
+
+def get_user_backend(name: str = USER_CACHE_BACKEND, max_entries: int = USER_CACHE_MAX_ENTRIES):
+    if name == "redis":
+        try:
+            return RedisUserBackend(REDIS_URL)
+        except ImportError:
+            logger.warning("⚠️ USER_CACHE_BACKEND=redis but the 'redis' package is not installed; using memory")
+    elif name != "memory":
+        raise ValueError(f"Unknown USER_CACHE_BACKEND '{name}'; expected 'memory' or 'redis'")
+    return MemoryUserBackend(max_entries)
+
+
+class UserCache:
+    """Decoded tokens (always in-process: a token's claims never change) and users keyed by subject.
+
+    Users are cached as column snapshots and rebuilt as detached instances, then attached to
+    the request's session with merge(load=False), so a cache hit costs no query at all. Calls
+    to a blocking backend (Redis) run in a worker thread, never on the event loop.
+    """
+
+    def __init__(self, backend=None, ttl: float = USER_CACHE_TTL, max_entries: int = USER_CACHE_MAX_ENTRIES,
+                 enabled: bool = USER_CACHE_ENABLED):
+        self.backend = backend if backend is not None else get_user_backend(max_entries=max_entries)
+        self.ttl = ttl
+        self.enabled = enabled
+        self._tokens = _TTLStore(max_entries)
+        self.token_hits = 0
+        self.token_misses = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.backend_errors = 0
+
+    # ─── Tokens ────────────────────────────────────────
+    def get_claims(self, token: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        claims = self._tokens.get(token)
+        if claims is None:
+            self.token_misses += 1
+        else:
+            self.token_hits += 1
+        return claims
+
+    def put_claims(self, token: str, claims: Dict[str, Any]):
+        if not self.enabled:
+            return
+        # Never keep a token past its own expiry
+        ttl = self.ttl
+        if "exp" in claims:
+            ttl = min(ttl, claims["exp"] - time.time())
+        if ttl > 0:
+            self._tokens.set(token, claims, ttl)
+
+    # ─── Users ─────────────────────────────────────────
+    async def _call(self, fn, *args):
+        if self.backend.blocking:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    async def get_user(self, db: AsyncSession, subject: str) -> Optional[User]:
+        if not self.enabled:
+            return None
+        try:
+            snapshot = await self._call(self.backend.get, subject)
+        except Exception as e:
+            self.backend_errors += 1
+            logger.warning(f"⚠️ User cache read failed: {e}")
+            snapshot = None
+        if snapshot is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return await db.merge(user_from_snapshot(snapshot), load=False)
+
+    async def put_user(self, subject: str, user: User):
+        if not self.enabled:
+            return
+        try:
+            await self._call(self.backend.set, subject, user_snapshot(user), self.ttl)
+        except Exception as e:
+            self.backend_errors += 1
+            logger.warning(f"⚠️ User cache write failed: {e}")
+
+    def invalidate(self, subject: str):
+        """Drop a user after it changed; the session hooks below call this for every committed change"""
+        self.invalidations += 1
+        if self.backend.blocking and _on_event_loop():
+            # Called from a commit on the event loop: hand the round trip to a worker thread
+            asyncio.get_running_loop().run_in_executor(None, self._delete, subject)
+        else:
+            self._delete(subject)
+
+    def _delete(self, subject: str):
+        try:
+            self.backend.delete(subject)
+        except Exception as e:
+            self.backend_errors += 1
+            logger.warning(f"⚠️ User cache invalidation failed: {e}")
+
+    def clear(self):
+        self._tokens.clear()
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "backend": self.backend.name,
+            "ttl_seconds": self.ttl,
+            "user_hits": self.hits,
+            "user_misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "db_queries_saved": self.hits,  # one user SELECT per hit; hit_rate is the saving per request
+            "token_hits": self.token_hits,
+            "token_misses": self.token_misses,
+            "invalidations": self.invalidations,
+            "backend_errors": self.backend_errors,
+            "cached_users": self.backend.size(),
+            "cached_tokens": len(self._tokens),
+        }
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+user_cache = UserCache()
+
+_STALE_KEY = "user_cache_stale"  # Session.info entry: emails of users changed in the open transaction
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _remember_changed_user(mapper, connection, target: User):
+    # ORM flushes of a User invalidate automatically once committed; bulk query.update() bypasses
+    # this, so code doing bulk updates on users must call user_cache.invalidate itself
+    session = sa_inspect(target).session
+    if session is None:
+        return
+    stale = session.info.setdefault(_STALE_KEY, set())
+    stale.add(target.email)
+    stale.update(sa_inspect(target).attrs.email.history.deleted or ())
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session: Session):
+    # Not at flush: a reader could re-cache the old row between the flush and the commit
+    for email in session.info.pop(_STALE_KEY, ()):
+        user_cache.invalidate(email)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_rolled_back_users(session: Session):
+    session.info.pop(_STALE_KEY, None)
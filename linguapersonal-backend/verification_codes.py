@@ -0,0 +1,210 @@
+# verification_codes.py - Storage for 2FA verification codes (memory or database) with an expiry sweeper
+import os
+import time
+import asyncio
+import logging
+import secrets
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import SessionLocal, EmailVerificationCode
+
+logger = logging.getLogger(__name__)
+
+VERIFICATION_CODE_STORE = os.getenv("VERIFICATION_CODE_STORE", "database").lower()  # database | memory
+VERIFICATION_CODE_TTL = int(os.getenv("VERIFICATION_CODE_TTL", "600"))
+VERIFICATION_SWEEP_INTERVAL = float(os.getenv("VERIFICATION_SWEEP_INTERVAL", "300"))
+VERIFICATION_SWEEP_CHUNK = int(os.getenv("VERIFICATION_SWEEP_CHUNK", "1000"))
+
+
+class VerificationCodeStore:
+    """Only the most recently issued code of a user is valid, so issuing never has to touch older codes.
+
+    issue() and consume() are one storage round trip each. Expired codes are removed by sweep(),
+    which the background sweeper calls every VERIFICATION_SWEEP_INTERVAL seconds.
+    """
+
+    name = "base"
+
+    def __init__(self, ttl_seconds: int = VERIFICATION_CODE_TTL, sweep_interval: float = VERIFICATION_SWEEP_INTERVAL,
+                 sweep_chunk: int = VERIFICATION_SWEEP_CHUNK):
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self.sweep_chunk = sweep_chunk
+        self._task: Optional[asyncio.Task] = None
+        self.issued = 0
+        self.consumed = 0
+        self.rejected = 0
+        self.swept = 0
+        self.sweeps = 0
+        self.last_sweep_seconds = 0.0
+
+    def issue(self, db: Session, user_id: int, code: str):
+        """Store code as the user's current one; joins the caller's transaction where that applies"""
+        raise NotImplementedError
+
+    def consume(self, db: Session, user_id: int, code: str) -> bool:
+        """True (and the code is spent) if code is the user's current, unexpired, unused code"""
+        raise NotImplementedError
+
+    def sweep(self) -> int:
+        """Delete expired codes; returns how many were removed"""
+        raise NotImplementedError
+
+    def _record_consume(self, ok: bool) -> bool:
+        if ok:
+            self.consumed += 1
+        else:
+            self.rejected += 1
+        return ok
+
+    async def start(self):
+        if self._task is None and self.sweep_interval > 0:
+            self._task = asyncio.create_task(self._sweeper())
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _sweeper(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            start = time.perf_counter()
+            try:
+                deleted = await asyncio.to_thread(self.sweep)
+            except SQLAlchemyError as e:
+                logger.warning(f"⚠️ Verification code sweep failed: {e}")
+                continue
+            self.last_sweep_seconds = time.perf_counter() - start
+            if deleted:
+                logger.info(f"🧹 Swept {deleted} expired verification codes in {self.last_sweep_seconds:.3f}s")
+
+    def clear(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "store": self.name,
+            "issued": self.issued,
+            "consumed": self.consumed,
+            "rejected": self.rejected,
+            "sweeps": self.sweeps,
+            "swept": self.swept,
+            "last_sweep_seconds": round(self.last_sweep_seconds, 4),
+        }
+
+
+class MemoryCodeStore(VerificationCodeStore):
+    """Codes in a dict keyed by user; only for a single replica (codes are lost on restart)"""
+
+    name = "memory"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._codes: Dict[int, Tuple[str, datetime]] = {}
+        self._lock = threading.Lock()
+
+    def issue(self, db: Session, user_id: int, code: str):
+        with self._lock:
+            self._codes[user_id] = (code, datetime.utcnow() + timedelta(seconds=self.ttl_seconds))
+        self.issued += 1
+
+    def consume(self, db: Session, user_id: int, code: str) -> bool:
+        with self._lock:
+            current = self._codes.get(user_id)
+            ok = (current is not None and current[1] > datetime.utcnow()
+                  and secrets.compare_digest(current[0], code))
+            if ok:
+                del self._codes[user_id]
+        return self._record_consume(ok)
+
+    def sweep(self) -> int:
+        now = datetime.utcnow()
+        with self._lock:
+            expired = [user_id for user_id, (_, expires_at) in self._codes.items() if expires_at <= now]
+            for user_id in expired:
+                del self._codes[user_id]
+        self.sweeps += 1
+        self.swept += len(expired)
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._codes.clear()
+
+
+class DatabaseCodeStore(VerificationCodeStore):
+    name = "database"
+
+    def __init__(self, session_factory=SessionLocal, **kwargs):
+        super().__init__(**kwargs)
+        self.session_factory = session_factory
+
+    def issue(self, db: Session, user_id: int, code: str):
+        db.add(EmailVerificationCode(user_id=user_id, code=code, used=False,
+                                     expires_at=datetime.utcnow() + timedelta(seconds=self.ttl_seconds)))
+        self.issued += 1
+
+    def consume(self, db: Session, user_id: int, code: str) -> bool:
+        latest = (select(EmailVerificationCode.id)
+                  .where(EmailVerificationCode.user_id == user_id)
+                  .order_by(EmailVerificationCode.id.desc())
+                  .limit(1)
+                  .scalar_subquery())
+        spent = db.execute(
+            update(EmailVerificationCode)
+            .where(EmailVerificationCode.id == latest,
+                   EmailVerificationCode.code == code,
+                   EmailVerificationCode.used == False,
+                   EmailVerificationCode.expires_at > datetime.utcnow())
+            .values(used=True)
+            .returning(EmailVerificationCode.id)
+        ).first()
+        return self._record_consume(spent is not None)
+
+    def sweep(self) -> int:
+        """Delete expired codes in chunks of sweep_chunk rows, one short transaction per chunk"""
+        total = 0
+        db = self.session_factory()
+        try:
+            while True:
+                expired = (select(EmailVerificationCode.id)
+                           .where(EmailVerificationCode.expires_at < datetime.utcnow())
+                           .limit(self.sweep_chunk))
+                deleted = db.execute(delete(EmailVerificationCode).where(EmailVerificationCode.id.in_(expired))
+                                     ).rowcount
+                db.commit()
+                total += deleted
+                if deleted < self.sweep_chunk:
+                    break
+        except SQLAlchemyError:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self.sweeps += 1
+        self.swept += total
+        return total
+
+
+CODE_STORES = {
+    "database": DatabaseCodeStore,
+    "memory": MemoryCodeStore,
+}
+
+
+def get_code_store(name: str = VERIFICATION_CODE_STORE) -> VerificationCodeStore:
+    try:
+        return CODE_STORES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown VERIFICATION_CODE_STORE '{name}'; expected one of {sorted(CODE_STORES)}")
+
+
+verification_codes = get_code_store()
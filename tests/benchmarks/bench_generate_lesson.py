@@ -0,0 +1,102 @@
+# tests/benchmarks/bench_generate_lesson.py
+"""
+Offline benchmark of the full /generate-lesson request path (auth, DB session, cache, provider).
+Runs the app in-process against a throwaway SQLite database and the stub LLM provider, so no API
+quota is spent. Each --profile is benchmarked in turn so providers/latency shapes can be compared.
+
+Run with:
+    python tests/benchmarks/bench_generate_lesson.py --requests 200 --concurrency 20 \\
+        --profile fast=fixed:50:0:0 --profile slow-tail=lognormal:800:600:0.02
+Profile format: name=distribution:latency_ms:jitter_ms:error_rate (distribution: fixed|uniform|normal|lognormal)
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+# Configure the app for an offline run BEFORE importing it
+_db_dir = tempfile.mkdtemp(prefix="lingua-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_db_dir, 'bench.db')}")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret-key-benchmark-secret")
+os.environ.setdefault("LLM_PROVIDER", "stub")
+os.environ.setdefault("OUTBOUND_RATE_PER_SECOND", "0")  # measure the app, not the outbound rate cap
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../linguapersonal-backend')))
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from database import SessionLocal, User  # noqa: E402
+from llm_providers import StubProvider, get_provider  # noqa: E402
+from metrics import Histogram  # noqa: E402
+
+main.run_migrations()  # the throwaway database starts empty
+
+
+def parse_profile(spec: str):
+    name, _, params = spec.partition("=")
+    if name == "openai":
+        return name, get_provider("openai")
+    dist, latency_ms, jitter_ms, error_rate = params.split(":")
+    return name, StubProvider(latency_dist=dist, latency_ms=float(latency_ms), jitter_ms=float(jitter_ms),
+                              error_rate=float(error_rate), seed=42)
+
+
+def create_bench_user() -> dict:
+    db = SessionLocal()
+    try:
+        email = f"bench_{int(time.time() * 1000)}@example.com"
+        db.add(User(email=email, password_hash=main.hash_password("benchmark"), two_fa_enabled=False))
+        db.commit()
+    finally:
+        db.close()
+    return {"Authorization": f"Bearer {main.create_access_token(data={'sub': email})}"}
+
+
+async def run_profile(name, provider, headers, total: int, concurrency: int, distinct_topics: int, stream: bool):
+    main.llm_provider = provider
+    main.lesson_cache.clear()
+    latency = Histogram()
+    statuses = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    path = "/generate-lesson/stream" if stream else "/generate-lesson"
+
+    async def one(i: int, client: httpx.AsyncClient):
+        topic = f"{name} topic {i % distinct_topics if distinct_topics else i}"
+        body = {"user_prompt": topic, "target_lang": "Spanish", "native_lang": "English"}
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(path, json=body, headers=headers)
+            latency.observe(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[one(i, client) for i in range(total)])
+        elapsed = time.perf_counter() - start
+
+    snapshot = latency.snapshot()
+    print(f"{name:<16} {total / elapsed:>9.1f} {snapshot['p50_ms']:>9.1f} {snapshot['p95_ms']:>9.1f} "
+          f"{snapshot['p99_ms']:>9.1f} {snapshot['max_ms']:>9.1f}  {statuses}")
+
+
+async def main_async(args):
+    headers = create_bench_user()
+    print(f"{'profile':<16} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}  statuses")
+    for spec in args.profile or ["stub=fixed:0:0:0"]:
+        name, provider = parse_profile(spec)
+        await run_profile(name, provider, headers, args.requests, args.concurrency, args.distinct_topics,
+                          args.stream)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark /generate-lesson offline")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--distinct-topics", type=int, default=0,
+                        help="cycle through this many topics (0 = every request unique, i.e. all cache misses)")
+    parser.add_argument("--stream", action="store_true", help="benchmark /generate-lesson/stream instead")
+    parser.add_argument("--profile", action="append", help="name=dist:latency_ms:jitter_ms:error_rate or 'openai'")
+    asyncio.run(main_async(parser.parse_args()))
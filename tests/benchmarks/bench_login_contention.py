@@ -0,0 +1,104 @@
+# tests/benchmarks/bench_login_contention.py
+"""
+How much do concurrent logins (bcrypt) slow down cheap endpoints on the same worker?
+Runs the app in-process on one event loop against a throwaway SQLite database, keeps --logins
+login requests in flight while probing /health and /user-progress, and reports probe latency.
+Each mode is run in turn: "inline" hashes on the event loop (the old behavior), "pool" uses the
+bounded bcrypt thread pool.
+
+Run with:
+    python tests/benchmarks/bench_login_contention.py --logins 8 --duration 5
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+# Configure the app for an offline run BEFORE importing it
+_db_dir = tempfile.mkdtemp(prefix="lingua-bench-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(_db_dir, 'bench.db')}")
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret-key-benchmark-secret")
+os.environ.setdefault("LLM_PROVIDER", "stub")
+os.environ.setdefault("LOGIN_LIMIT_ENABLED", "false")  # the benchmark logs in as one user, as fast as it can
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../linguapersonal-backend')))
+
+import httpx  # noqa: E402
+
+import main  # noqa: E402
+from database import SessionLocal, User  # noqa: E402
+from metrics import Histogram  # noqa: E402
+from password_hashing import PasswordHasher, PASSWORD_HASH_WORKERS  # noqa: E402
+
+main.run_migrations()  # the throwaway database starts empty
+
+PASSWORD = "benchmark-password"
+
+
+def create_bench_user() -> str:
+    db = SessionLocal()
+    try:
+        email = f"bench_{int(time.time() * 1000)}@example.com"
+        db.add(User(email=email, password_hash=main.hash_password(PASSWORD), two_fa_enabled=False))
+        db.commit()
+    finally:
+        db.close()
+    return email
+
+
+async def run_mode(name: str, workers: int, email: str, logins: int, duration: float, probe_interval: float):
+    main.password_hasher = PasswordHasher(max_workers=workers)
+    headers = {"Authorization": f"Bearer {main.create_access_token(data={'sub': email})}"}
+    probes = {"/health": Histogram(), "/user-progress": Histogram()}
+    login_latency = Histogram()
+    statuses = {}
+    deadline = time.perf_counter() + duration
+
+    async def login_loop(client: httpx.AsyncClient):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = await client.post("/login-step1", json={"email": email, "password": PASSWORD})
+            login_latency.observe(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    async def probe_loop(client: httpx.AsyncClient, path: str):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await client.get(path, headers=headers)
+            probes[path].observe(time.perf_counter() - start)
+            await asyncio.sleep(probe_interval)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await asyncio.gather(*[login_loop(client) for _ in range(logins)],
+                             *[probe_loop(client, path) for path in probes])
+    main.password_hasher.shutdown()
+
+    for path, histogram in probes.items():
+        s = histogram.snapshot()
+        print(f"{name:<8} {path:<15} {s['count']:>7} {s['p50_ms']:>9.1f} {s['p99_ms']:>9.1f} {s['max_ms']:>9.1f}")
+    s = login_latency.snapshot()
+    print(f"{name:<8} {'login-step1':<15} {s['count']:>7} {s['p50_ms']:>9.1f} {s['p99_ms']:>9.1f} "
+          f"{s['max_ms']:>9.1f}  {statuses}")
+
+
+async def main_async(args):
+    email = create_bench_user()
+    print(f"{'mode':<8} {'endpoint':<15} {'count':>7} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for mode in args.mode:
+        workers = 0 if mode == "inline" else args.workers
+        await run_mode(mode, workers, email, args.logins, args.duration, args.probe_interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Probe latency of cheap endpoints under concurrent logins")
+    parser.add_argument("--logins", type=int, default=8, help="concurrent login loops")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per mode")
+    parser.add_argument("--probe-interval", type=float, default=0.01)
+    parser.add_argument("--workers", type=int, default=PASSWORD_HASH_WORKERS, help="bcrypt pool size for 'pool'")
+    parser.add_argument("--mode", action="append", choices=["inline", "pool"],
+                        help="repeatable; default runs inline then pool")
+    args = parser.parse_args()
+    args.mode = args.mode or ["inline", "pool"]
+    asyncio.run(main_async(args))